@@ -0,0 +1,302 @@
+"""
+Fake Ollama for benchmarking Ollama8Web
+Answers the Ollama API with synthetic models, latency and token rates, without loading a model
+"""
+
+import re
+import json
+import hashlib
+import time
+import argparse
+import threading
+import http.server
+import socketserver
+from http import HTTPStatus
+
+WORDS = ("The", " quick", " brown", " fox", " jumps", " over", " the", " lazy", " dog.")
+
+
+# Defaults for the synthetic model
+LOAD_LATENCY = 0.02  # seconds before the first token, standing in for model load + prompt eval
+TOKENS_PER_SECOND = 200.0
+TOKENS = 64  # tokens per generation unless the request sets options.num_predict
+MODELS = 8  # entries in /api/tags
+PROMPT_TOKENS = 32
+COLD_LOAD = 0.0  # extra seconds the first request for a model not in memory waits
+KEEP_ALIVE = 300.0  # seconds a model stays loaded unless the request says otherwise
+BUILD_TIME = 1.0  # seconds /api/create takes, spread over its progress lines
+
+
+def parse_keep_alive(value) -> float:
+    """Seconds from Ollama's keep_alive forms: 300, "5m", "1h30m", negative for forever"""
+    if value is None:
+        return KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        return float('inf') if value < 0 else float(value)
+    parts = re.findall(r'(-?[\d.]+)(h|m|s|ms)?', value)
+    seconds = sum(float(number) * {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}[unit or 's'] for number, unit in parts)
+    return float('inf') if seconds < 0 else seconds
+
+
+def model_name(name: str) -> str:
+    return name if ':' in name.rsplit('/', 1)[-1] else name + ':latest'
+
+
+class FakeModelConfig:
+    """How the fake server behaves; every generation uses the same numbers"""
+
+    def __init__(self, load_latency: float = LOAD_LATENCY, tokens_per_second: float = TOKENS_PER_SECOND,
+                 tokens: int = TOKENS, models: int = MODELS, prompt_tokens: int = PROMPT_TOKENS,
+                 cold_load: float = COLD_LOAD, build_time: float = BUILD_TIME):
+        self.load_latency = load_latency
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.models = models
+        self.prompt_tokens = prompt_tokens
+        self.cold_load = cold_load
+        self.build_time = build_time
+
+
+class FakeOllamaHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Ollama's Go server sets TCP_NODELAY too
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self) -> FakeModelConfig:
+        return self.server.config
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            models = {f"fake-model-{index}:latest": f"{index:064x}" for index in range(self.config.models)}
+            with self.server.lock:
+                models.update(self.server.created)
+            self.send_json({"models": [
+                {
+                    "name": name,
+                    "model": name,
+                    "modified_at": "2024-01-01T00:00:00Z",
+                    "size": 4_000_000_000,
+                    "digest": digest,
+                    "details": {"family": "fake", "parameter_size": "7B", "quantization_level": "Q4_0"},
+                }
+                for name, digest in models.items()
+            ]})
+        elif self.path == '/api/version':
+            self.send_json({"version": "0.0.0-fake"})
+        elif self.path == '/api/ps':
+            now = time.time()
+            with self.server.lock:
+                loaded = {model: expires for model, expires in self.server.loaded.items() if expires > now}
+            self.send_json({"models": [
+                {"name": model, "model": model, "size_vram": 4_000_000_000,
+                 "expires_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(min(expires, 4e9)))}
+                for model, expires in sorted(loaded.items())
+            ]})
+        else:
+            self.send_json({"error": "not found"}, HTTPStatus.NOT_FOUND)
+
+    def do_HEAD(self):
+        # Blobs never exist yet, so clients always upload them
+        self.send_response(HTTPStatus.NOT_FOUND)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path.startswith('/api/blobs/'):
+            self.send_response(HTTPStatus.CREATED)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.path == '/api/create':
+            self.create(json.loads(body or b'{}'))
+            return
+
+        if self.path == '/api/copy':
+            request = json.loads(body or b'{}')
+            with self.server.lock:
+                digest = self.server.created.get(model_name(request.get('source', '')))
+                if digest is not None:
+                    self.server.created[model_name(request.get('destination', ''))] = digest
+            if digest is None:
+                self.send_json({"error": "model not found"}, HTTPStatus.NOT_FOUND)
+            else:
+                self.send_json({})
+            return
+
+        if self.path not in ('/api/generate', '/api/chat'):
+            self.send_json({"error": "not found"}, HTTPStatus.NOT_FOUND)
+            return
+
+        request = json.loads(body or b'{}')
+        model = request.get('model', 'fake-model-0:latest')
+        self.load(model, parse_keep_alive(request.get('keep_alive')))
+        if not request.get('prompt') and not request.get('messages'):
+            # Like Ollama, an empty request only loads the model
+            self.send_json({"model": model, "created_at": "2024-01-01T00:00:00Z", "response": "",
+                            "done": True, "done_reason": "load"})
+            return
+        tokens = int((request.get('options') or {}).get('num_predict') or self.config.tokens)
+        self.generate(self.path == '/api/chat', model, tokens, request.get('stream', True))
+
+    def create(self, request):
+        """Stream create progress over `build_time`, then list the model under a digest of what it was built from"""
+        recipe = {key: value for key, value in request.items() if key not in ('model', 'name', 'stream')}
+        digest = hashlib.sha256(json.dumps(recipe, sort_keys=True).encode('utf-8')).hexdigest()
+        statuses = ("parsing modelfile", "using existing layer", "creating new layer", "writing manifest", "success")
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for status in statuses:
+            time.sleep(self.config.build_time / len(statuses))
+            if status == "success":
+                with self.server.lock:
+                    self.server.created[model_name(request.get('model') or request.get('name') or '')] = digest
+            self.write_chunk(json.dumps({"status": status}).encode('utf-8') + b'\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def load(self, model: str, keep_alive: float):
+        """Pay the cold-load delay unless `model` is still in memory, then keep it for `keep_alive` seconds"""
+        model = model_name(model)
+        with self.server.lock:
+            resident = self.server.loaded.get(model, 0) > time.time()
+        if not resident and self.config.cold_load:
+            time.sleep(self.config.cold_load)
+        with self.server.lock:
+            self.server.loaded[model] = time.time() + keep_alive
+
+    def read_body(self) -> bytes:
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+
+        remaining = int(self.headers.get('Content-Length', 0))
+        chunks = []
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+
+    def generate(self, chat: bool, model: str, tokens: int, stream: bool):
+        interval = 1.0 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+        started = time.perf_counter()
+        time.sleep(self.config.load_latency)
+        prompt_done = time.perf_counter()
+
+        def token_object(text, done=False):
+            item = {"model": model, "created_at": "2024-01-01T00:00:00Z", "done": done}
+            if chat:
+                item["message"] = {"role": "assistant", "content": text}
+            else:
+                item["response"] = text
+            return item
+
+        def final_object(text):
+            item = token_object(text, done=True)
+            now = time.perf_counter()
+            item.update({
+                "done_reason": "stop",
+                "total_duration": int((now - started) * 1e9),
+                "load_duration": 0,
+                "prompt_eval_count": self.config.prompt_tokens,
+                "prompt_eval_duration": int((prompt_done - started) * 1e9),
+                "eval_count": tokens,
+                "eval_duration": int((now - prompt_done) * 1e9),
+            })
+            return item
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/x-ndjson' if stream else 'application/json')
+
+        if not stream:
+            time.sleep(interval * tokens)
+            text = ''.join(WORDS[index % len(WORDS)] for index in range(tokens))
+            data = json.dumps(final_object(text)).encode('utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        # Streamed like Ollama: chunked, one JSON object per line per token
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        next_token_at = time.perf_counter()
+        for index in range(tokens):
+            next_token_at += interval
+            delay = next_token_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.write_chunk(json.dumps(token_object(WORDS[index % len(WORDS)])).encode('utf-8') + b'\n')
+        self.write_chunk(json.dumps(final_object('')).encode('utf-8') + b'\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def send_json(self, data, status=HTTPStatus.OK):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOllamaServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, config: FakeModelConfig = None, handler=FakeOllamaHandler):
+        super().__init__(server_address, handler)
+        self.config = config or FakeModelConfig()
+        self.loaded = {}  # model -> when its keep_alive runs out
+        self.created = {}  # model -> digest, for models made with /api/create or /api/copy
+        self.lock = threading.Lock()
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake Ollama API for benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--load-latency', type=float, default=LOAD_LATENCY)
+    parser.add_argument('--tokens-per-second', type=float, default=TOKENS_PER_SECOND)
+    parser.add_argument('--tokens', type=int, default=TOKENS)
+    parser.add_argument('--models', type=int, default=MODELS)
+    parser.add_argument('--cold-load', type=float, default=COLD_LOAD,
+                        help="seconds to load a model that is not in memory")
+    parser.add_argument('--build-time', type=float, default=BUILD_TIME,
+                        help="seconds /api/create takes")
+    args = parser.parse_args()
+
+    config = FakeModelConfig(args.load_latency, args.tokens_per_second, args.tokens, args.models,
+                             cold_load=args.cold_load, build_time=args.build_time)
+    with FakeOllamaServer((args.host, args.port), config) as server:
+        print(f"Fake Ollama listening on {server.api_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Traffic Replay for Ollama8Web
+Re-issues a recording made with `main.py --record FILE` and compares its latencies with the recorded ones
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import subprocess
+import http.client
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any, List
+
+from fake_ollama import FakeOllamaHandler, FakeOllamaServer
+from run_benchmarks import REPO_DIR, REQUEST_TIMEOUT, free_port, wait_for_http, stop_process, percentiles
+
+sys.path.insert(0, REPO_DIR)
+from traffic_recorder import load_records  # noqa: E402
+from metrics import route_label  # noqa: E402
+
+# Carries the record index to the playback stub through the proxy, which forwards unknown headers
+REPLAY_HEADER = 'X-Replay-Record'
+BLOB_PATH_PREFIX = '/api/blobs/sha256:'
+
+
+def restore(value):
+    """Undo anonymize(): every redacted string becomes filler of the same length"""
+    if isinstance(value, dict):
+        if set(value) == {"$redacted"}:
+            return 'x' * value["$redacted"]
+        return {name: restore(item) for name, item in value.items()}
+    if isinstance(value, list):
+        return [restore(item) for item in value]
+    return value
+
+
+def build_request(index: int, record: Dict[str, Any]):
+    """The method, path, headers and body to re-send for one record"""
+    path = record["path"]
+    headers = {REPLAY_HEADER: str(index)}
+    if record.get("content_type"):
+        headers['Content-Type'] = record["content_type"]
+
+    spec = record.get("body")
+    if spec is None:
+        body = None
+    elif isinstance(spec, dict) and set(spec) == {"$bytes"}:
+        body = b'\0' * spec["$bytes"]
+        if path.startswith(BLOB_PATH_PREFIX):
+            # The proxy checks blob digests, so address the filler by its own hash
+            path = BLOB_PATH_PREFIX + hashlib.sha256(body).hexdigest()
+    else:
+        body = json.dumps(restore(spec)).encode('utf-8')
+    return record["method"], path, headers, body
+
+
+class PlaybackHandler(FakeOllamaHandler):
+    """Plays back the recorded upstream response for requests carrying X-Replay-Record
+
+    Anything else (health checks, SSE and pull requests the proxy makes on
+    its own) falls through to the synthetic fake model.
+    """
+
+    def recorded_upstream(self) -> Optional[Dict[str, Any]]:
+        index = self.headers.get(REPLAY_HEADER)
+        if index is None or not index.isdigit() or int(index) >= len(self.server.records):
+            return None
+        return self.server.records[int(index)].get("upstream")
+
+    def do_GET(self):
+        upstream = self.recorded_upstream()
+        if upstream is None:
+            return super().do_GET()
+        self.play(upstream)
+
+    def do_HEAD(self):
+        upstream = self.recorded_upstream()
+        if upstream is None:
+            return super().do_HEAD()
+        self.play(upstream, with_body=False)
+
+    def do_POST(self):
+        upstream = self.recorded_upstream()
+        if upstream is None:
+            return super().do_POST()
+        self.read_body()
+        self.play(upstream)
+
+    def play(self, upstream: Dict[str, Any], with_body: bool = True):
+        origin = time.perf_counter()
+        self.wait_until(origin, upstream["ttfb_ms"])
+        self.send_response(upstream["status"])
+        if upstream.get("content_type"):
+            self.send_header('Content-Type', upstream["content_type"])
+        if not with_body or upstream["status"] in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED):
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        ndjson = 'ndjson' in upstream.get("content_type", '')
+        for position, (offset_ms, size) in enumerate(upstream["chunks"]):
+            self.wait_until(origin, offset_ms)
+            last = position == len(upstream["chunks"]) - 1
+            self.write_chunk(self.filler(size, ndjson, last))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def wait_until(self, origin: float, offset_ms: float):
+        if self.server.speed:
+            delay = origin + offset_ms / 1000 / self.server.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    @staticmethod
+    def filler(size: int, ndjson: bool, last: bool) -> bytes:
+        if not ndjson:
+            return b'x' * size
+        # One NDJSON line per chunk, padded to the recorded size, so token counting still works
+        line = b'{"model":"replay","response":"","done":%s}\n' % (b'true' if last else b'false')
+        padding = max(0, size - len(line))
+        return line.replace(b'"response":""', b'"response":"' + b'x' * padding + b'"')
+
+
+class PlaybackServer(FakeOllamaServer):
+    def __init__(self, server_address, records: List[Dict[str, Any]], speed: float):
+        super().__init__(server_address, handler=PlaybackHandler)
+        self.records = records
+        self.speed = speed
+
+
+def send_record(port: int, index: int, record: Dict[str, Any]) -> Dict[str, Any]:
+    method, path, headers, body = build_request(index, record)
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=REQUEST_TIMEOUT)
+    started = time.perf_counter()
+    try:
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        ttfb = time.perf_counter() - started
+        response.read()
+        return {"index": index, "status": response.status, "duration": time.perf_counter() - started, "ttfb": ttfb}
+    except (OSError, http.client.HTTPException) as e:
+        return {"index": index, "status": None, "duration": time.perf_counter() - started,
+                "error": f"{type(e).__name__}: {e}"}
+    finally:
+        connection.close()
+
+
+def replay(records: List[Dict[str, Any]], port: int, speed: float, concurrency: int) -> Dict[str, Any]:
+    """Send every record at its recorded offset divided by `speed` (0 = all at once)"""
+    results = []
+    lag = 0.0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        first = records[0]["t"]
+        started = time.monotonic()
+        for index, record in enumerate(records):
+            if speed:
+                due = started + (record["t"] - first) / speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                lag = max(lag, time.monotonic() - due)
+            futures.append(executor.submit(send_record, port, index, record))
+        for future in futures:
+            results.append(future.result())
+        elapsed = time.monotonic() - started
+    return {"results": results, "elapsed": elapsed, "max_dispatch_lag": lag}
+
+
+def compare(records: List[Dict[str, Any]], run: Dict[str, Any], scale: float) -> Dict[str, Any]:
+    """Recorded versus replayed latency per route; recorded times are multiplied by `scale`"""
+    routes: Dict[str, Dict[str, list]] = {}
+    for result in run["results"]:
+        record = records[result["index"]]
+        route = routes.setdefault(f'{record["method"]} {route_label(record["path"])}', {
+            "recorded": [], "replayed": [], "status_mismatches": 0, "errors": []
+        })
+        route["recorded"].append(record["duration_ms"] / 1000 * scale)
+        route["replayed"].append(result["duration"])
+        if result.get("error"):
+            route["errors"].append(result["error"])
+        elif result["status"] != record["status"]:
+            route["status_mismatches"] += 1
+
+    report = {}
+    for name, route in sorted(routes.items()):
+        recorded, replayed = percentiles(route["recorded"]), percentiles(route["replayed"])
+        report[name] = {
+            "requests": len(route["replayed"]),
+            "recorded_ms": recorded,
+            "replayed_ms": replayed,
+            "delta_ms": {key: round(replayed[key] - recorded[key], 3) for key in ('p50', 'p95', 'p99')},
+            "status_mismatches": route["status_mismatches"],
+            "errors": len(route["errors"]),
+        }
+        if route["errors"]:
+            report[name]["first_error"] = route["errors"][0]
+    return report
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay traffic recorded with main.py --record")
+    parser.add_argument('recording', help="file written by main.py --record")
+    parser.add_argument('--target', metavar='URL',
+                        help="replay against this running server instead of a proxy on a playback stub")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="time compression, e.g. 10 for ten times faster; 0 sends everything at once")
+    parser.add_argument('--concurrency', type=int, default=64, help="most requests in flight at once")
+    parser.add_argument('--workers', type=int, default=1, help="--workers passed to main.py in stub mode")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+
+def main():
+    options = parse_args()
+    records = [record for record in load_records(options.recording) if record.get("status") is not None]
+    if not records:
+        sys.exit(f"No complete records in {options.recording}")
+
+    stub = proxy = None
+    try:
+        if options.target:
+            port = urlparse(options.target).port or 80
+            # Upstream time is real here, so only arrivals are compressed
+            scale = 1.0
+        else:
+            stub = PlaybackServer(('127.0.0.1', free_port()), records, options.speed)
+            threading.Thread(target=stub.serve_forever, daemon=True).start()
+            port = free_port()
+            proxy = subprocess.Popen([
+                sys.executable, os.path.join(REPO_DIR, 'main.py'), '--port', str(port),
+                '--ollama-api', stub.api_url, '--workers', str(options.workers), '--no-browser',
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wait_for_http(port, '/api/version', proxy)
+            # The stub compresses upstream time too, so compare against compressed recordings
+            scale = 1 / options.speed if options.speed else 0.0
+
+        pace = f"{options.speed:g}x" if options.speed else "full speed"
+        print(f"Replaying {len(records)} requests at {pace}...", file=sys.stderr)
+        run = replay(records, port, options.speed, options.concurrency)
+    finally:
+        if proxy is not None:
+            stop_process(proxy)
+        if stub is not None:
+            stub.shutdown()
+
+    routes = compare(records, run, scale)
+    for name, route in routes.items():
+        print(f"  {name}: {route['requests']} requests, p50 {route['recorded_ms']['p50']} -> "
+              f"{route['replayed_ms']['p50']} ms, {route['status_mismatches']} status mismatches",
+              file=sys.stderr)
+
+    output = json.dumps({
+        "recording": os.path.abspath(options.recording),
+        "mode": "target" if options.target else "stub",
+        "speed": options.speed,
+        "requests": len(records),
+        "duration_s": round(run["elapsed"], 3),
+        "max_dispatch_lag_ms": round(run["max_dispatch_lag"] * 1000, 3),
+        "routes": routes,
+    }, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+Benchmarks for Ollama8Web
+Drives main.py with concurrent clients against fake_ollama.py and reports latency, throughput and memory as JSON
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import hashlib
+import argparse
+import platform
+import threading
+import subprocess
+import http.client
+from typing import Optional, Dict, Any, List, Callable
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+SCENARIOS = ('chat', 'metadata', 'tts', 'upload')
+STARTUP_TIMEOUT = 15.0
+REQUEST_TIMEOUT = 120.0
+TTS_TEXT = "This sentence is long enough to give the speech engine a realistic amount of work to do."
+
+
+class Sample:
+    """One finished request as seen by a client"""
+
+    def __init__(self, latency: float, ok: bool, ttft: Optional[float] = None, tokens: int = 0, size: int = 0):
+        self.latency = latency
+        self.ok = ok
+        self.ttft = ttft
+        self.tokens = tokens
+        self.size = size
+
+
+class ScenarioSkipped(Exception):
+    pass
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_http(port: int, path: str, process: subprocess.Popen):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with status {process.returncode}")
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+        try:
+            connection.request('GET', path)
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+        finally:
+            connection.close()
+    raise RuntimeError(f"Nothing answered on port {port} within {STARTUP_TIMEOUT:g}s")
+
+
+def stop_process(process: subprocess.Popen):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def peak_rss_kb(pid: int) -> Optional[int]:
+    """Peak resident memory of `pid` plus its direct children (pre-forked workers), from /proc"""
+    def read_status(status_pid):
+        fields = {}
+        try:
+            with open(f'/proc/{status_pid}/status') as f:
+                for line in f:
+                    name, _, value = line.partition(':')
+                    fields[name] = value.strip()
+        except OSError:
+            return None
+        return fields
+
+    own = read_status(pid)
+    if own is None or 'VmHWM' not in own:
+        return None
+    total = int(own['VmHWM'].split()[0])
+    for entry in os.listdir('/proc'):
+        if entry.isdigit() and int(entry) != pid:
+            child = read_status(entry)
+            if child and child.get('PPid') == str(pid) and 'VmHWM' in child:
+                total += int(child['VmHWM'].split()[0])
+    return total
+
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(fraction):
+        # Nearest-rank percentile
+        return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+    return {
+        "p50": round(rank(0.50) * 1000, 3),
+        "p95": round(rank(0.95) * 1000, 3),
+        "p99": round(rank(0.99) * 1000, 3),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+# Requests, one per scenario; each gets a keep-alive connection owned by its client thread
+
+def chat_request(connection: http.client.HTTPConnection, index: int, options: argparse.Namespace) -> Sample:
+    body = json.dumps({
+        "model": "fake-model-0:latest",
+        "messages": [{"role": "user", "content": "Tell me about foxes."}],
+        "options": {"num_predict": options.tokens},
+    })
+    started = time.perf_counter()
+    connection.request('POST', '/api/chat', body=body, headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    ttft = None
+    tokens = 0
+    while True:
+        line = response.readline()
+        if not line:
+            break
+        if ttft is None:
+            ttft = time.perf_counter() - started
+        if b'"done":false' in line.replace(b' ', b''):
+            tokens += 1
+    return Sample(time.perf_counter() - started, response.status == 200, ttft, tokens)
+
+
+def metadata_request(connection: http.client.HTTPConnection, index: int, options: argparse.Namespace) -> Sample:
+    # The browser polls both while the page is open
+    path = '/api/tags' if index % 2 == 0 else '/api/version'
+    started = time.perf_counter()
+    connection.request('GET', path)
+    response = connection.getresponse()
+    data = response.read()
+    return Sample(time.perf_counter() - started, response.status == 200, size=len(data))
+
+
+def tts_request(connection: http.client.HTTPConnection, index: int, options: argparse.Namespace) -> Sample:
+    started = time.perf_counter()
+    connection.request('POST', '/api/tts', body=json.dumps({"text": TTS_TEXT}),
+                       headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    data = response.read()
+    if response.status == 503:
+        raise ScenarioSkipped("voice dependencies are not installed")
+    return Sample(time.perf_counter() - started, response.status == 200, size=len(data))
+
+
+def upload_request(connection: http.client.HTTPConnection, index: int, options: argparse.Namespace) -> Sample:
+    started = time.perf_counter()
+    connection.request('POST', f'/api/blobs/sha256:{options.upload_digest}', body=options.upload_body,
+                       headers={'Content-Type': 'application/octet-stream'})
+    response = connection.getresponse()
+    response.read()
+    return Sample(time.perf_counter() - started, response.status in (200, 201), size=len(options.upload_body))
+
+
+SCENARIO_REQUESTS: Dict[str, Callable] = {
+    'chat': chat_request,
+    'metadata': metadata_request,
+    'tts': tts_request,
+    'upload': upload_request,
+}
+
+
+def run_scenario(name: str, port: int, options: argparse.Namespace) -> Dict[str, Any]:
+    """Run `options.clients` concurrent clients, each sending `options.requests` requests"""
+    send = SCENARIO_REQUESTS[name]
+    samples: List[Sample] = []
+    errors: List[str] = []
+    skipped: List[str] = []
+    lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=REQUEST_TIMEOUT)
+        try:
+            for index in range(options.requests):
+                try:
+                    sample = send(connection, index, options)
+                except ScenarioSkipped as e:
+                    with lock:
+                        skipped.append(str(e))
+                    return
+                except (OSError, http.client.HTTPException) as e:
+                    connection.close()
+                    with lock:
+                        errors.append(f"{type(e).__name__}: {e}")
+                    continue
+                with lock:
+                    samples.append(sample)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(options.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if skipped:
+        return {"skipped": skipped[0]}
+
+    failed = sum(1 for sample in samples if not sample.ok)
+    result = {
+        "requests": len(samples),
+        "errors": len(errors) + failed,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "latency_ms": percentiles([sample.latency for sample in samples]),
+    }
+    if errors:
+        result["first_error"] = errors[0]
+    if name == 'chat':
+        result["ttft_ms"] = percentiles([sample.ttft for sample in samples if sample.ttft is not None])
+        result["tokens_per_second"] = round(sum(sample.tokens for sample in samples) / elapsed, 1)
+    if name == 'upload':
+        result["mb_per_second"] = round(sum(sample.size for sample in samples) / elapsed / 1e6, 1)
+    return result
+
+
+def overhead(proxied: Dict[str, Any], direct: Dict[str, Any]) -> Dict[str, Any]:
+    """What going through the proxy added, in milliseconds (negative means faster, e.g. cache hits)"""
+    added = {}
+    for metric in ('latency_ms', 'ttft_ms'):
+        if proxied.get(metric) and direct.get(metric):
+            added[metric] = {
+                key: round(proxied[metric][key] - direct[metric][key], 3)
+                for key in ('p50', 'p95', 'p99')
+            }
+    return added
+
+
+def summarize(result: Dict[str, Any]) -> str:
+    if 'skipped' in result:
+        return f"skipped, {result['skipped']}"
+    if result["latency_ms"] is None:
+        return f"no successful requests ({result.get('first_error')})"
+    return (
+        f"{result['throughput_rps']} req/s, p50 {result['latency_ms']['p50']} ms, "
+        f"p99 {result['latency_ms']['p99']} ms, {result['errors']} errors"
+    )
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark Ollama8Web against a fake Ollama")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent clients per scenario")
+    parser.add_argument('--requests', type=int, default=25, help="requests per client")
+    parser.add_argument('--workers', type=int, default=1, help="--workers passed to main.py")
+    parser.add_argument('--tokens', type=int, default=64, help="tokens per chat reply")
+    parser.add_argument('--tokens-per-second', type=float, default=200.0, help="fake model generation speed")
+    parser.add_argument('--load-latency', type=float, default=0.02, help="fake model seconds before the first token")
+    parser.add_argument('--upload-mb', type=float, default=8.0, help="size of each uploaded blob")
+    parser.add_argument('--no-direct', action='store_true', help="skip the runs straight against the fake Ollama")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    options = parser.parse_args()
+
+    options.scenarios = [name.strip() for name in options.scenarios.split(',') if name.strip()]
+    unknown = set(options.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return options
+
+
+def main():
+    options = parse_args()
+    if 'upload' in options.scenarios:
+        options.upload_body = os.urandom(int(options.upload_mb * 1024 * 1024))
+        options.upload_digest = hashlib.sha256(options.upload_body).hexdigest()
+
+    fake_port, proxy_port = free_port(), free_port()
+    fake = subprocess.Popen([
+        sys.executable, os.path.join(BENCHMARK_DIR, 'fake_ollama.py'), '--port', str(fake_port),
+        '--tokens', str(options.tokens), '--tokens-per-second', str(options.tokens_per_second),
+        '--load-latency', str(options.load_latency),
+    ], stdout=subprocess.DEVNULL)
+    proxy = None
+    try:
+        wait_for_http(fake_port, '/api/version', fake)
+        proxy = subprocess.Popen([
+            sys.executable, os.path.join(REPO_DIR, 'main.py'), '--port', str(proxy_port),
+            '--ollama-api', f'http://127.0.0.1:{fake_port}/api', '--workers', str(options.workers), '--no-browser',
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_http(proxy_port, '/api/version', proxy)
+
+        report = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                key: getattr(options, key) for key in (
+                    'clients', 'requests', 'workers', 'tokens', 'tokens_per_second', 'load_latency', 'upload_mb'
+                )
+            },
+            "scenarios": {},
+        }
+        for name in options.scenarios:
+            print(f"Running {name}...", file=sys.stderr)
+            result = {"proxy": run_scenario(name, proxy_port, options)}
+            # TTS is served by the proxy itself, so there is nothing to compare against
+            if not options.no_direct and name != 'tts' and 'skipped' not in result["proxy"]:
+                result["direct"] = run_scenario(name, fake_port, options)
+                result["overhead_ms"] = overhead(result["proxy"], result["direct"])
+            report["scenarios"][name] = result
+            print(f"  {name}: {summarize(result['proxy'])}", file=sys.stderr)
+
+        report["proxy_peak_rss_kb"] = peak_rss_kb(proxy.pid)
+    finally:
+        if proxy is not None:
+            stop_process(proxy)
+        stop_process(fake)
+
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Build Manager for Ollama8Web
+Runs /api/create as background jobs, and skips or copies builds whose Modelfile an existing model was already built from
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import http.client
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any, List, Tuple, Iterator, Callable
+
+from pull_manager import PullJob, normalize_model_tag, upstream_error
+
+logger = logging.getLogger(__name__)
+
+BUILD_SLOTS = 1  # builds running at once; each one competes with inference for the GPU and disk
+# Request fields that name the new model or shape the response rather than the model itself
+NON_RECIPE_FIELDS = ('model', 'name', 'stream')
+
+
+def _instructions(modelfile: str) -> Iterator[Tuple[str, str]]:
+    """(INSTRUCTION, argument) pairs, with comments and blank lines dropped and \"\"\" blocks joined"""
+    lines = modelfile.replace('\r\n', '\n').split('\n')
+    index = 0
+    while index < len(lines):
+        line = lines[index].strip()
+        index += 1
+        if not line or line.startswith('#'):
+            continue
+        keyword, argument = (line.split(None, 1) + [''])[:2]
+        if argument.startswith('"""') and argument.count('"""') == 1:
+            block = [argument]
+            while index < len(lines):
+                block.append(lines[index])
+                index += 1
+                if '"""' in block[-1]:
+                    break
+            argument = '\n'.join(block)
+        yield keyword.upper(), argument
+
+
+def _is_path(argument: str) -> bool:
+    return argument.startswith(('.', '/', '~')) or argument.endswith('.gguf') or '\\' in argument
+
+
+def _normalize_argument(keyword: str, argument: str) -> str:
+    if argument.startswith('"""') and argument.endswith('"""') and len(argument) >= 6:
+        return '"""' + argument[3:-3].strip() + '"""'
+    if keyword == 'FROM' and not _is_path(argument):
+        return normalize_model_tag(argument)
+    if keyword == 'PARAMETER':
+        name, value = (argument.split(None, 1) + [''])[:2]
+        value = value.strip()
+        try:
+            number = float(value)
+            value = str(int(number)) if number.is_integer() else repr(number)
+        except (ValueError, OverflowError):
+            pass
+        return f"{name.lower()} {value}"
+    return ' '.join(argument.split())
+
+
+def normalize_modelfile(modelfile: str) -> str:
+    """A canonical form of a Modelfile, equal for Modelfiles that build the same model
+
+    Comments, blank lines, keyword case, spacing, number formatting
+    ("0.70" vs "0.7") and the order of PARAMETER lines do not change the
+    model, so they do not change the normal form either.
+    """
+    instructions = []
+    parameters = []
+    for keyword, argument in _instructions(modelfile):
+        entry = (keyword, _normalize_argument(keyword, argument))
+        (parameters if keyword == 'PARAMETER' else instructions).append(entry)
+    # Sorted by name only, so repeated parameters such as stop keep their order
+    parameters.sort(key=lambda entry: entry[1].split(' ', 1)[0])
+    return '\n'.join(f"{keyword} {argument}" for keyword, argument in instructions + parameters)
+
+
+def base_model(request: Dict[str, Any]) -> Optional[str]:
+    """The installed model a create request builds on, or None if it builds from files
+
+    A build from a local file or directory cannot be deduplicated: the
+    same path may hold different weights tomorrow.
+    """
+    if isinstance(request.get('from'), str):
+        return None if _is_path(request['from']) else normalize_model_tag(request['from'])
+    base = None
+    for keyword, argument in _instructions(request.get('modelfile') or ''):
+        if keyword == 'ADAPTER' or (keyword == 'FROM' and _is_path(argument)):
+            return None
+        if keyword == 'FROM':
+            base = normalize_model_tag(argument)
+    return base
+
+
+def recipe_digest(request: Dict[str, Any], base_digest: Optional[str] = None) -> str:
+    """Hash of everything that determines the model a create request builds
+
+    The base model's digest is part of it, so re-pulling an updated base
+    makes the same Modelfile a new recipe.
+    """
+    recipe = {key: value for key, value in request.items() if key not in NON_RECIPE_FIELDS}
+    if isinstance(recipe.get('modelfile'), str):
+        recipe['modelfile'] = normalize_modelfile(recipe['modelfile'])
+    recipe['base_digest'] = base_digest
+    return hashlib.sha256(json.dumps(recipe, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class BuildConflictError(ValueError):
+    """The model is already being built from a different Modelfile"""
+
+
+class BuildJob(PullJob):
+    """One create request: waiting for a slot, building, or reusing a model built from the same recipe"""
+
+    def __init__(self, model: str, request: Dict[str, Any], request_key: str):
+        super().__init__(model, request)
+        self.request_key = request_key  # identical requests for the same model share this job
+        self.recipe = None  # the recipe digest, once the base model's digest is known
+        self.state = 'checking'
+        self.outcome = None  # 'built', 'copied', 'unchanged' or 'error' once finished
+
+    def publish_status(self, **status):
+        self.publish(json.dumps(status).encode('utf-8'))
+
+
+class BuildManager:
+    """Deduplicates /api/create by content and runs real builds in the background, BUILD_SLOTS at a time
+
+    After each build, the recipe digest and the resulting model's digest go
+    into a small JSON registry. A later create with the same recipe is then
+    answered from /api/tags: nothing to do if the requested name already has
+    that digest, otherwise an /api/copy from a model that has it.
+    """
+
+    def __init__(self, ollama_api: str, timeout: Optional[float] = None, slots: int = BUILD_SLOTS,
+                 registry_path: Optional[str] = None,
+                 on_finish: Optional[Callable[[BuildJob], None]] = None):
+        self.ollama_api = urlparse(ollama_api)
+        self.timeout = timeout  # for connecting and for each read of the build's progress
+        self.slots = threading.Semaphore(slots)
+        self.registry_path = registry_path
+        self.on_finish = on_finish  # called with each job once it ends, however it ends
+        self.registry: Dict[str, str] = {}  # used when there is no registry file
+        self.jobs: Dict[str, BuildJob] = {}
+        self.lock = threading.Lock()
+
+    def start(self, request: Dict[str, Any]) -> BuildJob:
+        """Return the running build of the requested model, starting one if needed"""
+        name = request.get('model') or request.get('name')
+        if not name:
+            raise ValueError("Missing model name")
+        model = normalize_model_tag(name)
+        key = recipe_digest(request)
+
+        with self.lock:
+            job = self.jobs.get(model)
+            if job is not None:
+                if job.request_key != key:
+                    raise BuildConflictError(f"{model} is already being built from a different Modelfile")
+                return job
+
+            job = BuildJob(model, request, key)
+            self.jobs[model] = job
+
+        thread = threading.Thread(target=self._run, args=(job,), daemon=True)
+        thread.start()
+        return job
+
+    def _run(self, job: BuildJob):
+        try:
+            job.publish_status(status="checking for an identical model")
+            models = self._models()
+            base = base_model(job.request)
+            if base is not None and models.get(base) is not None:
+                job.recipe = recipe_digest(job.request, models[base])
+                if self._reuse(job, models):
+                    return
+
+            if not self.slots.acquire(blocking=False):
+                job.state = 'queued'
+                job.publish_status(status="waiting for a build slot")
+                self.slots.acquire()
+            try:
+                # An identical build may have finished while this one waited
+                if job.recipe is not None and self._reuse(job, self._models()):
+                    return
+                job.state = 'building'
+                self._build(job)
+            finally:
+                self.slots.release()
+
+        except (OSError, http.client.HTTPException) as e:
+            logger.error(f"Build of {job.model} failed: {e}")
+            job.outcome = 'error'
+            job.publish_status(error=f"Error connecting to Ollama API: {e}")
+
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error(f"Build of {job.model} failed on an unexpected Ollama answer: {e!r}")
+            job.outcome = 'error'
+            job.publish_status(error=f"Unexpected answer from Ollama API: {e}")
+
+        finally:
+            job.state = 'done'
+            with self.lock:
+                self.jobs.pop(job.model, None)
+            # Before subscribers see the end, so a client reloading /api/tags right away gets the new list
+            if self.on_finish is not None:
+                self.on_finish(job)
+            job.finish()
+
+    def _reuse(self, job: BuildJob, models: Dict[str, str]) -> bool:
+        """Finish `job` without building if a model with the recipe's result exists"""
+        digest = self._lookup(job.recipe)
+        if digest is None:
+            return False
+        if models.get(job.model) == digest:
+            job.outcome = 'unchanged'
+            job.publish_status(status="model is already up to date")
+            job.publish_status(status="success", deduplicated=job.outcome)
+            return True
+
+        source = next((name for name, model_digest in models.items() if model_digest == digest), None)
+        if source is None:
+            # Every model built from this recipe has since been deleted or replaced
+            return False
+        job.state = 'copying'
+        job.publish_status(status=f"copying identical model {source}")
+        status, answer = self._request('/copy', {"source": source, "destination": job.model})
+        if status != 200:
+            job.outcome = 'error'
+            job.publish_status(error=upstream_error(answer, status))
+            return True
+        job.outcome = 'copied'
+        job.publish_status(status="success", deduplicated=job.outcome, source=source)
+        return True
+
+    def _build(self, job: BuildJob):
+        """Stream the upstream create into the job, and remember what it built"""
+        connection = http.client.HTTPConnection(self.ollama_api.hostname, self.ollama_api.port, timeout=self.timeout)
+        try:
+            connection.request(
+                'POST',
+                f"{self.ollama_api.path}/create",
+                body=json.dumps(dict(job.request, stream=True)).encode('utf-8'),
+                headers={'Content-Type': 'application/json'}
+            )
+            response = connection.getresponse()
+            if response.status != 200:
+                job.outcome = 'error'
+                job.publish_status(error=upstream_error(response.read(), response.status))
+                return
+
+            last_line = b''
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                if line.strip():
+                    last_line = line.rstrip(b'\n')
+                    job.publish(last_line)
+        finally:
+            connection.close()
+
+        if b'"success"' not in last_line or b'"error"' in last_line:
+            job.outcome = 'error'
+            if b'"error"' not in last_line:
+                job.publish_status(error="Ollama closed the stream early")
+            return
+        job.outcome = 'built'
+        digest = self._models().get(job.model)
+        if job.recipe is not None and digest is not None:
+            self._remember(job.recipe, digest)
+
+    # Ollama calls
+
+    def _request(self, endpoint: str, body: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        connection = http.client.HTTPConnection(self.ollama_api.hostname, self.ollama_api.port, timeout=self.timeout)
+        try:
+            if body is None:
+                connection.request('GET', f"{self.ollama_api.path}{endpoint}")
+            else:
+                connection.request('POST', f"{self.ollama_api.path}{endpoint}", body=json.dumps(body).encode('utf-8'),
+                                   headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def _models(self) -> Dict[str, str]:
+        """Installed models and their digests, from /api/tags"""
+        status, answer = self._request('/tags')
+        if status != 200:
+            raise ValueError(f"/api/tags answered HTTP {status}")
+        try:
+            return {
+                normalize_model_tag(model['name']): model.get('digest')
+                for model in json.loads(answer)['models']
+            }
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"malformed /api/tags answer ({e!r})")
+
+    # Registry of recipe digest -> model digest, shared by worker processes through the file
+
+    def _load(self) -> Dict[str, str]:
+        if not self.registry_path:
+            return dict(self.registry)
+        try:
+            with open(self.registry_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable build registry {self.registry_path}: {e}")
+            return {}
+
+    def _lookup(self, recipe: str) -> Optional[str]:
+        return self._load().get(recipe)
+
+    def _remember(self, recipe: str, digest: str):
+        with self.lock:
+            registry = self._load()
+            registry[recipe] = digest
+            if not self.registry_path:
+                self.registry = registry
+                return
+            temp_path = f"{self.registry_path}.{os.getpid()}.tmp"
+            try:
+                with open(temp_path, 'w') as f:
+                    json.dump(registry, f)
+                os.replace(temp_path, self.registry_path)
+            except OSError as e:
+                logger.warning(f"Could not save build registry to {self.registry_path}: {e}")
+
+    def get_status(self) -> List[Dict[str, Any]]:
+        """Summarize every active build"""
+        with self.lock:
+            jobs = list(self.jobs.values())
+
+        builds = []
+        for job in jobs:
+            latest = job.latest_status() or {}
+            builds.append({
+                "model": job.model,
+                "state": job.state,
+                "recipe": job.recipe,
+                "subscribers": job.subscribers,
+                "started_at": job.started_at,
+                "status": latest.get('status'),
+                "error": latest.get('error'),
+            })
+        return builds
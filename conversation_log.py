@@ -0,0 +1,304 @@
+"""
+Conversation Log for Ollama8Web
+Write-behind log of generations: the request path enqueues raw bytes, a background thread parses them and batch-inserts into SQLite
+"""
+
+import os
+import json
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from typing import Optional, Dict, Any, List, Callable
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 1000  # entries waiting to be written before new ones are dropped
+BATCH_SIZE = 200  # most rows inserted in one transaction
+FLUSH_INTERVAL = 1.0  # seconds a partial batch waits before it is written anyway
+RETENTION_DAYS = 30
+MAX_ROWS = 100000
+COMPACT_INTERVAL = 3600.0  # seconds between deleting old rows and returning their space
+MAX_PAGE_SIZE = 500
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS generations (
+        id INTEGER PRIMARY KEY,
+        ts REAL NOT NULL,
+        request_id TEXT,
+        client TEXT,
+        endpoint TEXT,
+        model TEXT,
+        status INTEGER,
+        prompt TEXT,
+        response TEXT,
+        options TEXT,
+        duration_ms REAL,
+        ttfb_ms REAL,
+        prompt_tokens INTEGER,
+        eval_tokens INTEGER,
+        load_ms REAL,
+        prompt_eval_ms REAL,
+        eval_ms REAL,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS generations_ts ON generations (ts);
+    CREATE INDEX IF NOT EXISTS generations_model ON generations (model, id);
+    CREATE INDEX IF NOT EXISTS generations_client ON generations (client, id);
+'''
+
+COLUMNS = (
+    'ts', 'request_id', 'client', 'endpoint', 'model', 'status', 'prompt', 'response', 'options',
+    'duration_ms', 'ttfb_ms', 'prompt_tokens', 'eval_tokens', 'load_ms', 'prompt_eval_ms', 'eval_ms', 'error'
+)
+
+# Request fields kept as the generation's options; prompt, messages and images are stored elsewhere or not at all
+OPTION_FIELDS = ('options', 'system', 'template', 'format', 'keep_alive', 'stream', 'think', 'tools')
+
+
+def _milliseconds(nanoseconds: Optional[int]) -> Optional[float]:
+    return None if nanoseconds is None else round(nanoseconds / 1e6, 1)
+
+
+def build_row(entry: Dict[str, Any]) -> tuple:
+    """Turn a raw entry (request body and response chunks as bytes) into a table row
+
+    Runs on the writer thread, so the request path never parses anything.
+    """
+    request = {}
+    if entry.get("body"):
+        try:
+            request = json.loads(entry["body"])
+        except ValueError:
+            pass
+    if not isinstance(request, dict):
+        request = {}
+
+    if 'messages' in request:
+        # Image data stays out of the log; the request path already swapped it for references
+        prompt = json.dumps([message for message in request['messages'] if isinstance(message, dict)])
+    else:
+        prompt = request.get('prompt')
+
+    text = []
+    stats = entry.get("stats") or {}
+    error = None
+    for line in b''.join(entry.get("chunks") or ()).splitlines():
+        if not line.strip():
+            continue
+        try:
+            chunk = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(chunk, dict):
+            continue
+        if 'error' in chunk:
+            error = str(chunk['error'])
+        text.append(chunk.get('response') or (chunk.get('message') or {}).get('content') or '')
+        if chunk.get('done'):
+            stats = chunk
+    if entry.get("text") is not None:
+        text = [entry["text"]]
+
+    options = {name: request[name] for name in OPTION_FIELDS if name in request}
+    return (
+        entry["ts"],
+        entry.get("request_id"),
+        entry.get("client"),
+        entry.get("endpoint"),
+        entry.get("model") or request.get('model'),
+        entry.get("status"),
+        prompt if isinstance(prompt, str) else None,
+        ''.join(text),
+        json.dumps(options) if options else None,
+        entry.get("duration_ms"),
+        entry.get("ttfb_ms"),
+        stats.get('prompt_eval_count'),
+        stats.get('eval_count'),
+        _milliseconds(stats.get('load_duration')),
+        _milliseconds(stats.get('prompt_eval_duration')),
+        _milliseconds(stats.get('eval_duration')),
+        entry.get("error") or error,
+    )
+
+
+class ConversationLog:
+    """Records every generation without making the request wait for the disk
+
+    log() only puts the raw entry on a bounded queue. A writer thread takes
+    up to BATCH_SIZE entries at a time and inserts them in one transaction
+    on a WAL-mode database, so readers and other workers are not blocked.
+    When the writer falls behind and the queue fills up, new entries are
+    dropped and counted rather than slowing requests down.
+    """
+
+    def __init__(self, path: Optional[str] = None, queue_size: int = QUEUE_SIZE,
+                 on_written: Optional[Callable[[int], None]] = None):
+        self.path = path
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.on_written = on_written  # called with the number of rows after each committed batch
+        self.thread = None
+        self.local = threading.local()
+        self.stats = {
+            "queued": 0,
+            "written": 0,
+            "dropped": 0,
+            "batches": 0,
+            "failed": 0,
+        }
+        self.stats_lock = threading.Lock()
+        self.last_compacted = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def open(self, path: str):
+        self.path = path
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def log(self, entry: Dict[str, Any]) -> bool:
+        """Queue an entry for writing; False if it was dropped because the queue is full"""
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            with self.stats_lock:
+                self.stats["dropped"] += 1
+            return False
+        with self.stats_lock:
+            self.stats["queued"] += 1
+        return True
+
+    def start(self):
+        """Start the writer thread; call after forking, since threads do not survive fork()"""
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def close(self, timeout: float = 5.0):
+        """Write what is still queued, then stop the writer"""
+        if self.thread is None:
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+        self.thread = None
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stopping = batch and batch[-1] is None
+            if stopping:
+                batch.pop()
+            if batch:
+                self._write(batch)
+            if stopping:
+                return
+            if time.monotonic() - self.last_compacted >= COMPACT_INTERVAL:
+                self.compact()
+
+    def _next_batch(self) -> List[Optional[Dict[str, Any]]]:
+        """Block for the first entry, then take whatever else arrives within FLUSH_INTERVAL"""
+        try:
+            batch = [self.queue.get(timeout=COMPACT_INTERVAL)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < BATCH_SIZE and batch[-1] is not None:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        rows = []
+        for entry in batch:
+            try:
+                rows.append(build_row(entry))
+            except (KeyError, TypeError, AttributeError) as e:
+                logger.warning(f"Skipping malformed conversation log entry: {e}")
+
+        connection = self._connection()
+        try:
+            connection.execute('BEGIN')
+            connection.executemany(
+                f"INSERT INTO generations ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows
+            )
+            connection.execute('COMMIT')
+        except sqlite3.Error as e:
+            logger.error(f"Could not write {len(rows)} conversation log entries: {e}")
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            with self.stats_lock:
+                self.stats["failed"] += len(rows)
+            return
+
+        with self.stats_lock:
+            self.stats["written"] += len(rows)
+            self.stats["batches"] += 1
+        if self.on_written is not None:
+            self.on_written(len(rows))
+
+    def compact(self, retention_days: float = RETENTION_DAYS, max_rows: int = MAX_ROWS):
+        """Delete rows past the retention period or row cap, then shrink the WAL file"""
+        self.last_compacted = time.monotonic()
+        connection = self._connection()
+        try:
+            connection.execute('DELETE FROM generations WHERE ts < ?', (time.time() - retention_days * 86400,))
+            connection.execute(
+                'DELETE FROM generations WHERE id <= (SELECT id FROM generations ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                (max_rows,)
+            )
+            connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except sqlite3.Error as e:
+            logger.warning(f"Could not compact the conversation log: {e}")
+
+    def query(self, limit: int = 50, before: Optional[int] = None, model: Optional[str] = None,
+              client: Optional[str] = None, since: Optional[float] = None) -> Dict[str, Any]:
+        """Newest entries first, one page at a time; pass the returned `next` as `before` for the next page
+
+        Pages are keyed on the row id rather than an offset, so each page is an
+        index range scan however deep into the log it is.
+        """
+        clauses, parameters = [], []
+        for clause, value in (('id < ?', before), ('model = ?', model), ('client = ?', client), ('ts >= ?', since)):
+            if value is not None:
+                clauses.append(clause)
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        connection = self._connection()
+        cursor = connection.execute(
+            f"SELECT id, {', '.join(COLUMNS)} FROM generations {where} ORDER BY id DESC LIMIT ?",
+            (*parameters, limit + 1)
+        )
+        names = [column[0] for column in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        for row in rows:
+            if row["options"]:
+                row["options"] = json.loads(row["options"])
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return {"entries": rows, "next": rows[-1]["id"] if more else None}
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["pending"] = self.queue.qsize()
+        return stats
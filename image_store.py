@@ -0,0 +1,368 @@
+"""
+Image Store for Ollama8Web
+Keeps uploaded images once on disk by SHA-256, and expands "sha256:<hex>" references in chat requests into base64
+"""
+
+import os
+import re
+import json
+import base64
+import binascii
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Iterator, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = 1024 * 1024 * 1024  # disk space for stored images, least recently used evicted first
+EVICT_TO = 0.9  # eviction frees space down to this share of MAX_BYTES
+ENCODED_CACHE_BYTES = 64 * 1024 * 1024  # base64 encodings kept in memory
+READ_SIZE = 3 * 64 * 1024  # a multiple of 3, so each piece base64-encodes without padding
+
+REFERENCE_PATTERN = re.compile(r'^sha256:([0-9a-f]{64})$')
+# A JSON string, or a character that opens, closes or keys into a container
+JSON_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]:]')
+# Where references may appear: the current key of each open container, None for an array
+IMAGE_PATHS = {('images', None), ('messages', None, 'images', None)}
+MAX_REFERENCE_TOKEN = 512  # longer strings in an images array are image data, even a fully escaped reference is shorter
+
+
+def _image_lists(request: Dict[str, Any]) -> List[list]:
+    """A generate request's images, and every chat message's images"""
+    image_lists = [request.get('images')]
+    for message in request.get('messages') or ():
+        if isinstance(message, dict):
+            image_lists.append(message.get('images'))
+    return [images for images in image_lists if isinstance(images, list)]
+
+
+def image_references(request: Dict[str, Any]) -> List[str]:
+    """The digests referenced from a request's images"""
+    digests = []
+    for images in _image_lists(request):
+        for image in images:
+            match = REFERENCE_PATTERN.match(image) if isinstance(image, str) else None
+            if match and match.group(1) not in digests:
+                digests.append(match.group(1))
+    return digests
+
+
+def _image_strings(body: bytes) -> Iterator[Tuple[int, int, bytes]]:
+    """(start, end, quoted text) of each string in a JSON request body's images arrays
+
+    Only the request's and each message's images array count, so a
+    "sha256:<hex>" quoted inside a prompt is left as it is.
+    """
+    keys = []  # per open container: an object's current key, None for an array
+    last_string = None
+    for token in JSON_TOKEN.finditer(body):
+        text = token.group()
+        if text == b'{':
+            keys.append('')
+        elif text == b'[':
+            keys.append(None)
+        elif text in (b'}', b']'):
+            keys.pop()
+        elif text == b':':
+            keys[-1] = json.loads(last_string)
+        else:
+            last_string = text
+            if keys and keys[-1] is None and tuple(keys) in IMAGE_PATHS:
+                yield token.start(), token.end(), text
+
+
+def reference_spans(body: bytes) -> List[Tuple[int, int, str]]:
+    """(start, end, digest) of each quoted image reference in a JSON request body"""
+    spans = []
+    for start, end, text in _image_strings(body):
+        match = REFERENCE_PATTERN.match(json.loads(text)) if len(text) <= MAX_REFERENCE_TOKEN else None
+        if match:
+            spans.append((start, end, match.group(1)))
+    return spans
+
+
+def strip_images(body: bytes) -> bytes:
+    """The body with each inline base64 image swapped for the "sha256:<hex>" reference of its bytes
+
+    Runs before anything has validated the body, so a body that does not
+    scan as JSON is returned as it is.
+    """
+    if b'"images"' not in body:
+        return body
+    pieces = []
+    position = 0
+    try:
+        for start, end, text in _image_strings(body):
+            image = json.loads(text)
+            if REFERENCE_PATTERN.match(image):
+                continue
+            try:
+                data = base64.b64decode(image, validate=True)
+            except binascii.Error:
+                data = image.encode('utf-8')
+            pieces.append(body[position:start])
+            pieces.append(f'"sha256:{hashlib.sha256(data).hexdigest()}"'.encode('ascii'))
+            position = end
+    except (IndexError, TypeError, ValueError):
+        # Unbalanced brackets, a ':' outside an object, or a bad escape
+        return body
+    pieces.append(body[position:])
+    return b''.join(pieces)
+
+
+def encoded_length(size: int) -> int:
+    return (size + 2) // 3 * 4
+
+
+class UnknownImageError(KeyError):
+    """A request referenced an image the store does not have (any more)"""
+
+    def __str__(self):
+        return f"Unknown image sha256:{self.args[0]}; upload it to /api/images first"
+
+
+class ImageStore:
+    """Content-addressed image files with a byte cap
+
+    Each image is one file named by its digest. Reading an image bumps the
+    file's mtime, so the least recently used images, which are evicted first,
+    can be found by a directory scan that every worker process agrees on.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = MAX_BYTES, encoded_cache_bytes: int = ENCODED_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.encoded_cache_bytes = encoded_cache_bytes
+        self.encoded: 'OrderedDict[str, bytes]' = OrderedDict()
+        self.encoded_size = 0
+        self.total_bytes = None  # measured on first use
+        self.lock = threading.Lock()
+        self.stats = {"uploads": 0, "duplicates": 0, "evicted": 0, "encode_hits": 0, "encode_misses": 0}
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    # Writing
+
+    def put(self, chunks: Iterable[bytes], max_size: Optional[int] = None) -> Tuple[str, int, bool]:
+        """Store an image from its raw bytes; returns (digest, size, whether it was new)
+
+        The upload is hashed while it is written to a temporary file, which is
+        then renamed to its digest, so a half-written image is never visible.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise ValueError(f"Image is larger than {max_size} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+            name = digest.hexdigest()
+            if self.exists(name):
+                os.unlink(temp_path)
+                self._touch(name)
+                self._count("duplicates")
+                return name, size, False
+            os.replace(temp_path, self.path(name))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        self._count("uploads")
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += size
+        if self._total() > self.max_bytes:
+            self.evict()
+        return name, size, True
+
+    def evict(self):
+        """Delete least recently used images until the store is back under EVICT_TO of its cap"""
+        files = self._scan()
+        total = sum(size for _, size, _ in files)
+        for digest, size, _ in sorted(files, key=lambda entry: entry[2]):
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.unlink(self.path(digest))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self._count("evicted")
+            with self.lock:
+                cached = self.encoded.pop(digest, None)
+                if cached is not None:
+                    self.encoded_size -= len(cached)
+        with self.lock:
+            self.total_bytes = total
+
+    def _scan(self) -> List[Tuple[str, int, float]]:
+        files = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return files
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((entry.name, stat.st_size, stat.st_mtime))
+        return files
+
+    def _total(self) -> int:
+        with self.lock:
+            total = self.total_bytes
+        if total is None:
+            total = sum(size for _, size, _ in self._scan())
+            with self.lock:
+                self.total_bytes = total
+        return total
+
+    def _touch(self, digest: str):
+        try:
+            os.utime(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _count(self, name: str):
+        with self.lock:
+            self.stats[name] += 1
+
+    # Reading
+
+    def open_images(self, digests: List[str]) -> List[Any]:
+        """Open every referenced image up front, one source per entry in `digests`
+
+        An open file stays readable even if another request evicts it while
+        this one is still being sent. Images with a cached encoding are not
+        opened at all; their source is the encoding itself.
+        """
+        sources = []
+        try:
+            for digest in digests:
+                with self.lock:
+                    cached = self.encoded.get(digest)
+                    if cached is not None:
+                        self.encoded.move_to_end(digest)
+                if cached is not None:
+                    sources.append(cached)
+                    self._count("encode_hits")
+                else:
+                    try:
+                        sources.append(open(self.path(digest), 'rb'))
+                    except FileNotFoundError:
+                        raise UnknownImageError(digest)
+                    self._count("encode_misses")
+                self._touch(digest)
+        except BaseException:
+            close_images(sources)
+            raise
+        return sources
+
+    def encoded_size_of(self, source) -> int:
+        if isinstance(source, bytes):
+            return len(source)
+        return encoded_length(os.fstat(source.fileno()).st_size)
+
+    def iter_encoded(self, digest: str, source) -> Iterator[bytes]:
+        """Yield an image's base64 in pieces, caching the encoding if it is small enough"""
+        if isinstance(source, bytes):
+            yield source
+            return
+
+        size = os.fstat(source.fileno()).st_size
+        keep = [] if encoded_length(size) <= self.encoded_cache_bytes // 8 else None
+        with source:
+            while True:
+                piece = source.read(READ_SIZE)
+                if not piece:
+                    break
+                encoded = base64.b64encode(piece)
+                if keep is not None:
+                    keep.append(encoded)
+                yield encoded
+
+        if keep is not None:
+            self._cache_encoding(digest, b''.join(keep))
+
+    def expand_request(self, request: Dict[str, Any]):
+        """Replace references in a parsed request in place, for requests that are built in memory anyway"""
+        for images in _image_lists(request):
+            for index, image in enumerate(images):
+                match = REFERENCE_PATTERN.match(image) if isinstance(image, str) else None
+                if match:
+                    source, = self.open_images([match.group(1)])
+                    images[index] = b''.join(self.iter_encoded(match.group(1), source)).decode('ascii')
+
+    def _cache_encoding(self, digest: str, encoded: bytes):
+        with self.lock:
+            if digest in self.encoded:
+                return
+            self.encoded[digest] = encoded
+            self.encoded_size += len(encoded)
+            while self.encoded_size > self.encoded_cache_bytes:
+                _, dropped = self.encoded.popitem(last=False)
+                self.encoded_size -= len(dropped)
+
+    def expand(self, body: bytes) -> Tuple[Iterator[bytes], int]:
+        """Replace each image reference in a JSON request body with the image's base64
+
+        Returns the new body as an iterator of pieces plus its exact length, so
+        it can be sent with a Content-Length without building it in memory.
+        """
+        spans = reference_spans(body)
+        sources = self.open_images([digest for _, _, digest in spans])
+
+        pieces = []  # body bytes between references, and (digest, source) for each reference
+        length = 0
+        position = 0
+        for (start, end, digest), source in zip(spans, sources):
+            # The reference's string becomes a plain quoted base64 string
+            pieces.append(body[position:start] + b'"')
+            pieces.append((digest, source))
+            length += start + 1 - position + self.encoded_size_of(source)
+            position = end - 1
+        pieces.append(body[position:])
+        length += len(body) - position
+
+        def generate():
+            try:
+                for piece in pieces:
+                    if isinstance(piece, bytes):
+                        yield piece
+                    else:
+                        yield from self.iter_encoded(*piece)
+            finally:
+                close_images(sources)
+
+        return generate(), length
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self._total()
+        with self.lock:
+            stats = dict(self.stats)
+            stats["encoded_cache_bytes"] = self.encoded_size
+        stats["bytes"] = total
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+def close_images(sources: List[Any]):
+    for source in sources:
+        if not isinstance(source, bytes):
+            source.close()
@@ -1,9 +1,18 @@
+import argparse
 import http.server
+import http.client
 import socketserver
-import urllib.request
-import urllib.error
+import hashlib
+import collections.abc
 import json
 import os
+import re
+import select
+import signal
+import socket
+import threading
+import time
+import uuid
 import webbrowser
 import tempfile
 from http import HTTPStatus
@@ -27,16 +36,374 @@ except ImportError:
     VOICE_AVAILABLE = False
     logger.warning("Voice features not available. Install with: pip install -r voice_requirements.txt")
 
+from pull_manager import PullManager
+from stream_manager import StreamManager
+from shared_store import MemoryStore, SQLiteStore
+from prefork import PreforkSupervisor, can_prefork
+import metrics
+from tracing import Tracer, Profiler, NULL_TRACE
+from traffic_recorder import TrafficRecorder, NULL_CAPTURE
+from upstream_health import CircuitBreaker, HealthMonitor
+from rate_limiter import TokenBudget, FairScheduler, client_key, load_api_keys
+from conversation_log import ConversationLog
+from model_residency import ResidencyManager
+from image_store import ImageStore, UnknownImageError, image_references, strip_images
+from build_manager import BuildManager, BuildConflictError
+
 # Configuration
 PORT = 8080
 OLLAMA_API = "http://localhost:11434/api"
+STREAM_CHUNK_SIZE = 64 * 1024
+CLIENT_CLOSED_REQUEST = 499  # nginx convention for "client went away"
+DISCONNECT_POLL_INTERVAL = 0.5
+MAX_BUFFERED_BODY = 1024 * 1024  # larger request bodies are streamed to Ollama
+KEEPALIVE_TIMEOUT = 30  # seconds an idle browser connection is kept open
+MAX_REQUESTS_PER_CONNECTION = 200
+SSE_FLUSH_INTERVAL = 0.05  # seconds of tokens batched into one SSE frame
+SSE_FLUSH_BYTES = 1024  # ...or this many characters, whichever comes first
+METADATA_CACHE_TTL = 5  # seconds /api/tags and /api/version answers are reused
+VOICE_STATUS_TTL = 30
+CANCEL_REQUEST_TTL = 60  # how long a cancel for a request on another worker is honoured
+GRACEFUL_TIMEOUT = 30  # seconds a stopping worker waits for open connections
+METRICS_PUBLISH_INTERVAL = 5  # seconds between each worker sharing its metrics
+GENERATION_TAIL_BYTES = 4096  # end of a response kept to read Ollama's eval statistics
+TRACE_SAMPLE_RATE = 0.0  # share of requests traced for /debug/traces; --trace-sample overrides
+UPSTREAM_CONNECT_TIMEOUT = 3  # seconds to open a connection to Ollama
+UPSTREAM_READ_TIMEOUT = 60  # seconds to wait for Ollama's response headers, unless listed below
+STREAM_IDLE_TIMEOUT = 120  # longest gap between chunks once a response is streaming
+RATE_LIMIT_TOKENS = 0  # prompt plus generated tokens per client per window; 0 is unlimited, --rate-limit overrides
+RATE_LIMIT_WINDOW = 60  # seconds
+API_KEYS = frozenset()  # digests of the keys a client may be charged by instead of its IP; --api-keys loads them
+KEEP_ALIVE_POLICY = True  # give generations without a keep_alive one picked by how much their model is used
+GENERATION_SLOTS = 4  # generations sent to Ollama at once while budgets are on; match OLLAMA_NUM_PARALLEL
+
+# Response header timeouts per endpoint; a non-streamed generation only answers when it is done
+UPSTREAM_READ_TIMEOUTS = {
+    '/version': 5,
+    '/tags': 10,
+    '/ps': 10,
+    '/show': 30,
+    '/generate': 600,
+    '/chat': 600,
+    '/embed': 300,
+    '/embeddings': 300,
+    '/create': 600,
+    '/blobs': 600,
+}
+
+# Uploaded images live here until the least recently used are evicted; --image-store overrides
+IMAGE_STORE_DIR = os.path.join(tempfile.gettempdir(), 'ollama8web-images')
+IMAGE_STORE_BYTES = 1024 * 1024 * 1024
+MAX_IMAGE_UPLOAD = 32 * 1024 * 1024
+IMAGE_PATH_PATTERN = re.compile(r'^/api/images/sha256[:-]([0-9a-f]{64})$')
+
+# Model builds; recipe digests of finished builds are kept here so identical ones can be skipped
+BUILD_SLOTS = 1  # /api/create builds run at once, so they do not starve chats; --build-slots overrides
+BUILD_REGISTRY = os.path.join(tempfile.gettempdir(), 'ollama8web-builds.json')
+
+# Endpoints whose streamed output is one NDJSON line per generated token
+GENERATION_ENDPOINTS = ('/generate', '/chat')
+
+# Blob uploads are addressed by the SHA-256 of their content
+BLOB_DIGEST_PATTERN = re.compile(r'^/blobs/sha256[:-]([0-9a-f]{64})$')
+
+# Cheap, idempotent metadata lookups the browser polls, and the calls that change their answers
+CACHEABLE_ENDPOINTS = ('/tags', '/version')
+MODEL_MUTATING_ENDPOINTS = ('/pull', '/create', '/copy', '/delete', '/push')
+
+# Hop-by-hop and proxy-specific headers that must not be forwarded to Ollama
+SKIPPED_REQUEST_HEADERS = (
+    'host', 'content-length', 'transfer-encoding', 'connection', 'expect', 'x-request-id'
+)
+
+# Response cache and counters; main() swaps in a SQLiteStore when pre-forking
+# so every worker process shares them
+shared_store = MemoryStore()
+
+# /debug/* can change what the server records, so only this machine may use it
+LOCAL_ADDRESSES = ('127.0.0.1', '::1', '::ffff:127.0.0.1')
+
+# Sent with every budgeted generation, and readable by the browser
+RATE_LIMIT_HEADERS = ('X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset')
+
+# Counters for work the proxy saved Ollama from doing
+PROXY_STAT_NAMES = (
+    'cancelled_requests', 'client_disconnects', 'tokens_streamed_before_abort', 'tokens_avoided'
+)
+
+
+class ProxiedCall:
+    """An in-flight upstream request that can be aborted from another thread"""
+
+    def __init__(self, request_id, endpoint, num_predict=None, model=None):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.num_predict = num_predict
+        self.model = model
+        self.connection = None
+        self.tokens_emitted = 0
+        self.tokens_used = None  # prompt plus generated tokens, once Ollama reports them
+        self.response_chunks = None  # raw response bytes, kept while the conversation log is on
+        self.ttfb = None
+        self.abort_reason = None
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def aborted(self):
+        return self.abort_reason is not None
+
+    def attach(self, connection):
+        """Connect to Ollama unless the call was aborted before it got that far"""
+        with self._lock:
+            if self.abort_reason is not None:
+                raise ConnectionAbortedError(self.abort_reason)
+            connection.connect()
+            self.connection = connection
+
+    def abort(self, reason):
+        """Close the upstream socket so Ollama stops generating"""
+        with self._lock:
+            if self.abort_reason is not None or self.finished.is_set():
+                return False
+            self.abort_reason = reason
+            self._close_upstream()
+
+        tokens_avoided = 0
+        if self.num_predict and self.num_predict > 0:
+            tokens_avoided = max(self.num_predict - self.tokens_emitted, 0)
+
+        if reason == 'client_disconnect':
+            shared_store.incr('proxy.client_disconnects')
+        else:
+            shared_store.incr('proxy.cancelled_requests')
+        shared_store.incr('proxy.tokens_streamed_before_abort', self.tokens_emitted)
+        shared_store.incr('proxy.tokens_avoided', tokens_avoided)
+
+        logger.info(f"Aborted request {self.request_id} ({reason}) after {self.tokens_emitted} tokens")
+        return True
+
+    def _close_upstream(self):
+        # shutdown() unblocks a handler thread sitting in recv(); the handler
+        # thread itself closes the connection once it notices
+        if self.connection is None or self.connection.sock is None:
+            return
+        try:
+            self.connection.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+active_calls = {}
+active_calls_lock = threading.Lock()
+
+
+def refresh_model_list(job):
+    """A pull or build ended, so cached /api/tags answers may be missing its model"""
+    shared_store.delete_prefix('response:')
+
+
+def record_build(job):
+    metrics.model_builds.inc(job.outcome or 'error')
+    refresh_model_list(job)
+
+
+def record_warm_up(result, seconds):
+    metrics.model_warmups.inc(result)
+    if result == 'loaded':
+        metrics.model_warmup_duration.observe(seconds)
+
+
+pull_manager = PullManager(OLLAMA_API, STREAM_IDLE_TIMEOUT, on_finish=refresh_model_list)
+build_manager = BuildManager(
+    OLLAMA_API, UPSTREAM_READ_TIMEOUTS['/create'], BUILD_SLOTS, BUILD_REGISTRY, on_finish=record_build
+)
+upstream_breaker = CircuitBreaker()
+health_monitor = HealthMonitor(OLLAMA_API, upstream_breaker)
+tracer = Tracer(TRACE_SAMPLE_RATE)
+profiler = Profiler()
+recorder = TrafficRecorder()  # main() opens a file when started with --record
+token_budget = TokenBudget(RATE_LIMIT_TOKENS, RATE_LIMIT_WINDOW)
+generation_slots = FairScheduler(GENERATION_SLOTS, token_budget)
+residency = ResidencyManager(
+    OLLAMA_API, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUTS['/generate'],
+    on_warm=record_warm_up
+)
+image_store = ImageStore(IMAGE_STORE_DIR, IMAGE_STORE_BYTES)
+# main() opens a database when started with --log-db
+conversation_log = ConversationLog(on_written=lambda rows: metrics.log_written.inc(amount=rows))
+stream_manager = StreamManager(
+    OLLAMA_API, SSE_FLUSH_INTERVAL, SSE_FLUSH_BYTES, on_done=metrics.record_generation,
+    connect_timeout=UPSTREAM_CONNECT_TIMEOUT, read_timeout=UPSTREAM_READ_TIMEOUTS['/chat'],
+    idle_timeout=STREAM_IDLE_TIMEOUT, on_synthesized=metrics.tts_duration.observe
+)
+
+
+def release_generation(client, tokens):
+    """Charge a finished generation to its client's budget and free its slot"""
+    token_budget.charge(client, tokens)
+    metrics.charged_tokens.inc(amount=tokens)
+    generation_slots.release(client)
+
+
+def log_generation(entry):
+    """Hand a finished generation to the conversation log writer"""
+    if not conversation_log.log(entry):
+        metrics.log_dropped.inc()
+
+
+def upstream_read_timeout(api_endpoint):
+    """Seconds to wait for Ollama's response headers on `api_endpoint`"""
+    return UPSTREAM_READ_TIMEOUTS.get('/' + api_endpoint.split('/')[1].split('?')[0], UPSTREAM_READ_TIMEOUT)
+
+
+class RequestBodyError(ValueError):
+    """The client's request body was truncated, malformed or failed verification"""
+
+
+def iter_sized_body(rfile, length):
+    """Yield a Content-Length delimited body in fixed-size chunks"""
+    remaining = length
+    while remaining > 0:
+        chunk = rfile.read(min(STREAM_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise RequestBodyError(f"Request body ended {remaining} bytes early")
+        remaining -= len(chunk)
+        yield chunk
+
+
+def iter_chunked_body(rfile):
+    """Yield the decoded payload of a Transfer-Encoding: chunked body"""
+    while True:
+        size_line = rfile.readline(1024)
+        try:
+            size = int(size_line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise RequestBodyError(f"Invalid chunk size line: {size_line[:32]!r}")
+
+        if size == 0:
+            # Skip any trailer headers up to the terminating blank line
+            while rfile.readline(1024) not in (b'\r\n', b'\n', b''):
+                pass
+            return
+
+        yield from iter_sized_body(rfile, size)
+        rfile.readline(1024)  # CRLF after each chunk
+
+
+def verify_digest(chunks, expected_hex):
+    """Pass chunks through while hashing them, holding back the last one
+
+    The final chunk is only released once the digest matches, so Ollama never
+    receives a complete body for a corrupted blob.
+    """
+    digest = hashlib.sha256()
+    pending = None
+    for chunk in chunks:
+        digest.update(chunk)
+        if pending is not None:
+            yield pending
+        pending = chunk
+
+    if digest.hexdigest() != expected_hex:
+        raise RequestBodyError(f"Blob digest mismatch: got sha256:{digest.hexdigest()}")
+    if pending is not None:
+        yield pending
+
+
+def cancel_requested(request_id):
+    """Whether /api/cancel for this request or stream reached another worker"""
+    return shared_store.shared and shared_store.get(f'cancel:{request_id}') is not None
+
+
+def watch_client_disconnect(client_socket, call):
+    """Abort `call` if the browser closes its socket before the response is done"""
+    while not call.finished.is_set():
+        try:
+            readable, _, _ = select.select([client_socket], [], [], DISCONNECT_POLL_INTERVAL)
+            if not readable:
+                # A cancel for this request may have reached a different worker
+                if cancel_requested(call.request_id):
+                    call.abort('cancelled')
+                    return
+                continue
+            if client_socket.recv(1, socket.MSG_PEEK) == b'':
+                call.abort('client_disconnect')
+            # Otherwise the client sent more data (a pipelined request), which
+            # we cannot tell apart from a live connection, so stop watching
+            return
+        except (OSError, ValueError):
+            call.abort('client_disconnect')
+            return
+
 
 class OllamaUIHandler(http.server.SimpleHTTPRequestHandler):
+    # Keep browser connections open between requests; every response below
+    # is framed with Content-Length or chunked encoding so this is safe
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out in separate writes; with Nagle on, a keep-alive
+    # client's delayed ACK holds the body back by ~40 ms
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        self.requests_handled = 0
+        super().handle()
+
+    def parse_request(self):
+        parsed = super().parse_request()
+        if parsed:
+            self.request_started = time.perf_counter()
+            metrics.http_in_flight.inc()
+            if not self.path.startswith('/debug/'):
+                self.trace = tracer.start(self.command, self.path)
+                self.profile = profiler.begin()
+                if self.path != '/metrics':
+                    self.capture = recorder.start(self.command, self.path, self.headers.get('Content-Type', ''))
+        return parsed
+
+    def handle_one_request(self):
+        self.request_started = None
+        self.response_status = None
+        self.trace = NULL_TRACE
+        self.profile = None
+        self.capture = NULL_CAPTURE
+        self.budget_client = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.request_started is not None:
+                profiler.end(self.profile)
+                tracer.finish(self.trace, self.response_status)
+                recorder.finish(self.capture, self.response_status)
+                route = metrics.route_label(self.path)
+                metrics.http_in_flight.dec()
+                metrics.http_request_duration.observe(time.perf_counter() - self.request_started, route)
+                metrics.http_requests.inc(route, self.command, str(self.response_status))
+
+    def send_response(self, code, message=None):
+        super().send_response(code, message)
+        self.response_status = int(code)
+        self.requests_handled += 1
+        if self.requests_handled >= MAX_REQUESTS_PER_CONNECTION:
+            self.send_header('Connection', 'close')
+
     def do_GET(self):
+        # Prometheus scrape endpoint
+        if self.path == '/metrics':
+            self.handle_metrics()
+            return
+
+        # Recent request traces and profile captures
+        if self.path.startswith('/debug/'):
+            self.handle_debug_api('GET')
+            return
+
         # Redirect root path to the ollama8web/index.html
         if self.path == '/':
             self.send_response(HTTPStatus.MOVED_PERMANENTLY)
             self.send_header('Location', '/ollama8web/index.html')
+            self.send_header('Content-Length', '0')
             self.end_headers()
             return
 
@@ -45,6 +412,66 @@ class OllamaUIHandler(http.server.SimpleHTTPRequestHandler):
             self.handle_voice_api('GET')
             return
 
+        # Report work saved by aborting abandoned generations
+        if self.path == '/api/proxy/stats':
+            counters = shared_store.get_counters('proxy.')
+            stats = {name: counters.get(f'proxy.{name}', 0) for name in PROXY_STAT_NAMES}
+            with active_calls_lock:
+                stats["active_requests"] = len(active_calls)
+            stats["sse"] = stream_manager.get_stats()
+            self.send_json_response(stats)
+            return
+
+        # The caller's own token budget
+        if self.path == '/api/proxy/budget':
+            client = client_key(self.headers, self.client_address[0], API_KEYS)
+            self.send_json_response({
+                "enabled": token_budget.enabled,
+                "limit": token_budget.limit,
+                "window": token_budget.window,
+                "used": round(token_budget.usage(client)),
+                "remaining": token_budget.remaining(client) if token_budget.enabled else None,
+                "reset": round(token_budget.reset_after(client)),
+                "slots": generation_slots.get_status(),
+            })
+            return
+
+        # Page through the conversation log
+        if urlparse(self.path).path == '/api/logs':
+            self.handle_logs_api()
+            return
+
+        # Image store usage, or whether one image is stored
+        if self.path.startswith('/api/images'):
+            self.handle_images_api('GET')
+            return
+
+        # Which models Ollama has loaded, and the keep_alive each would get
+        if self.path == '/api/residency':
+            self.send_json_response(residency.get_status())
+            return
+
+        # Ollama reachability and circuit breaker state
+        if self.path == '/api/proxy/health':
+            status = health_monitor.get_status()
+            self.send_json_response(status, HTTPStatus.OK if status["status"] != 'down' else HTTPStatus.SERVICE_UNAVAILABLE)
+            return
+
+        # Resume a Server-Sent Events stream after a dropped connection
+        if self.path.startswith('/api/stream/'):
+            self.handle_stream_api('GET')
+            return
+
+        # List model downloads in progress
+        if self.path == '/api/pulls':
+            self.send_json_response({"pulls": pull_manager.get_status()})
+            return
+
+        # List model builds in progress
+        if self.path == '/api/builds':
+            self.send_json_response({"builds": build_manager.get_status()})
+            return
+
         # Handle API proxy requests
         if self.path.startswith('/api/'):
             self.proxy_request('GET')
@@ -53,7 +480,25 @@ class OllamaUIHandler(http.server.SimpleHTTPRequestHandler):
         # Default behavior - serve files
         return http.server.SimpleHTTPRequestHandler.do_GET(self)
 
+    def do_HEAD(self):
+        # Clients check for a stored image before uploading it again
+        if self.path.startswith('/api/images/'):
+            self.handle_images_api('HEAD')
+            return
+
+        # Ollama clients probe /api/blobs/<digest> with HEAD before uploading
+        if self.path.startswith('/api/'):
+            self.proxy_request('HEAD')
+            return
+
+        return http.server.SimpleHTTPRequestHandler.do_HEAD(self)
+
     def do_POST(self):
+        # Change trace sampling, or arm a profile capture
+        if self.path.startswith('/debug/'):
+            self.handle_debug_api('POST')
+            return
+
         # Handle voice API requests
         if self.path.startswith('/api/voice/'):
             self.handle_voice_api('POST')
@@ -64,6 +509,41 @@ class OllamaUIHandler(http.server.SimpleHTTPRequestHandler):
             self.handle_tts_api()
             return
 
+        # Stream a generation as coalesced Server-Sent Events
+        if urlparse(self.path).path == '/api/stream':
+            self.handle_stream_api('POST')
+            return
+
+        # The same stream, with each sentence also synthesized as it completes
+        if urlparse(self.path).path == '/api/speak':
+            self.handle_stream_api('POST', speak=True)
+            return
+
+        # Store an image for chat requests to reference by digest
+        if self.path == '/api/images':
+            self.handle_images_api('POST')
+            return
+
+        # Load a model ahead of its first prompt
+        if self.path == '/api/warm':
+            self.handle_warm_api()
+            return
+
+        # Share one upstream download between everyone pulling the same model
+        if self.path == '/api/pull':
+            self.handle_pull_api()
+            return
+
+        # Build models in the background, skipping builds identical to an existing model
+        if self.path == '/api/create':
+            self.handle_create_api()
+            return
+
+        # Cancel an in-flight proxied request
+        if self.path.startswith('/api/cancel/'):
+            self.handle_cancel_api()
+            return
+
         # Handle API proxy requests
         if self.path.startswith('/api/'):
             self.proxy_request('POST')
@@ -71,72 +551,888 @@ class OllamaUIHandler(http.server.SimpleHTTPRequestHandler):
 
         # Default behavior for POST
         self.send_response(HTTPStatus.METHOD_NOT_ALLOWED)
+        self.send_header('Content-Length', '0')
+        if self.has_request_body():
+            # Left unread, the body would be parsed as the next request on this connection
+            self.send_header('Connection', 'close')
         self.end_headers()
 
     def proxy_request(self, method):
         # Extract the API endpoint from the path
         api_endpoint = self.path[4:]  # Remove '/api' prefix
-        target_url = f"{OLLAMA_API}{api_endpoint}"
+        target = urlparse(OLLAMA_API)
+
+        cache_key = None
+        if method == 'GET' and api_endpoint in CACHEABLE_ENDPOINTS:
+            cache_key = f'response:{api_endpoint}'
+            cached = shared_store.get(cache_key)
+            metrics.cache_requests.inc('response', 'miss' if cached is None else 'hit')
+            self.trace.annotate(cache='miss' if cached is None else 'hit')
+            if cached is not None:
+                self.trace.mark('write_response')
+                self.send_cached_response(cached)
+                return
+
+        if not upstream_breaker.allow():
+            self.send_upstream_unavailable()
+            return
+
+        model_mutating = api_endpoint.startswith(MODEL_MUTATING_ENDPOINTS)
+        if model_mutating:
+            shared_store.delete_prefix('response:')
 
         # Get request body for POST requests
-        content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length) if content_length > 0 else None
+        self.trace.mark('read_body')
+        try:
+            body, content_length = self.read_request_body(api_endpoint)
+        except ValueError as e:
+            self.send_json_response({"error": str(e)}, HTTPStatus.BAD_REQUEST, close_connection=True)
+            return
+
+        self.capture.request_body(body if not isinstance(body, collections.abc.Iterator) else content_length or 0)
+
+        if method == 'POST' and api_endpoint.startswith(GENERATION_ENDPOINTS):
+            if not self.admit_generation(close_connection=isinstance(body, collections.abc.Iterator)):
+                return
 
         try:
-            # Create the request to Ollama API
-            req = urllib.request.Request(
-                url=target_url,
-                data=body,
-                method=method
-            )
+            request_id = self.headers.get('X-Request-ID') or uuid.uuid4().hex
+            generation = self._parse_generation_request(api_endpoint, body)
+            call = ProxiedCall(request_id, api_endpoint, generation.get('num_predict'), generation.get('model'))
+            if method == 'POST' and api_endpoint.startswith(GENERATION_ENDPOINTS):
+                residency.record_use(call.model)
+                if KEEP_ALIVE_POLICY and isinstance(body, bytes):
+                    body = residency.apply_keep_alive(body, call.model)
+                    content_length = len(body)
+            log_entry = None
+            if conversation_log.enabled and method == 'POST' and api_endpoint.startswith(GENERATION_ENDPOINTS):
+                log_entry = self.new_log_entry(request_id, api_endpoint, call.model, body)
+                call.response_chunks = []
+            self.trace.annotate(request_id=request_id, model=call.model)
+            with active_calls_lock:
+                active_calls[request_id] = call
+            metrics.upstream_in_flight.inc()
+        except BaseException:
+            # The generation slot is only given back in the finally below, which has not started yet
+            if self.budget_client is not None:
+                release_generation(self.budget_client, 0)
+            raise
+
+        # Create the request to Ollama API
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=UPSTREAM_CONNECT_TIMEOUT)
+        try:
+            if isinstance(body, bytes) and b'"sha256:' in body and api_endpoint.startswith(GENERATION_ENDPOINTS):
+                # Stored images go to Ollama inline, read from disk as the request is sent
+                self.trace.mark('expand_images')
+                try:
+                    body, content_length = self.expand_images(body)
+                except UnknownImageError as e:
+                    self.send_json_response({"error": str(e)}, HTTPStatus.BAD_REQUEST)
+                    return
 
             # Copy headers from the original request
-            for header_name, header_value in self.headers.items():
-                if header_name.lower() not in ('host', 'content-length'):
-                    req.add_header(header_name, header_value)
+            headers = {
+                header_name: header_value
+                for header_name, header_value in self.headers.items()
+                if header_name.lower() not in SKIPPED_REQUEST_HEADERS
+            }
+            if content_length is not None:
+                headers['Content-Length'] = str(content_length)
 
             # Make the request to Ollama API
-            with urllib.request.urlopen(req) as response:
-                # Send the response status code
-                self.send_response(response.status)
+            body_consumed = not isinstance(body, collections.abc.Iterator)
+            connected = False
+            try:
+                self.trace.mark('connect')
+                call.attach(connection)
+                connected = True
+                connection.sock.settimeout(upstream_read_timeout(api_endpoint))
+                # Streamed bodies are read from the client during this phase
+                self.trace.mark('send_request')
+                connection.request(method, f"{target.path}{api_endpoint}", body=body, headers=headers)
+                body_consumed = True
+                sent_at = time.perf_counter()
+                self.capture.upstream_request_sent()
+                # For generations this is model load plus prompt evaluation
+                self.trace.mark('wait_first_byte')
+
+                # Only watch for a disconnect once the body has been consumed,
+                # otherwise pending upload bytes look like a live client
+                watcher = threading.Thread(
+                    target=watch_client_disconnect,
+                    args=(self.connection, call),
+                    daemon=True
+                )
+                watcher.start()
+
+                response = connection.getresponse()
+                call.ttfb = time.perf_counter() - sent_at
+                metrics.upstream_ttfb.observe(call.ttfb, metrics.route_label(self.path))
+                self.capture.upstream_response(response.status, response.getheader('Content-Type', ''))
+                upstream_breaker.record_success()
+            except RequestBodyError as e:
+                # Closing the connection in `finally` leaves Ollama with a short body
+                self.send_json_response({"error": str(e)}, HTTPStatus.BAD_REQUEST, close_connection=True)
+                return
+            except (OSError, http.client.HTTPException) as e:
+                if call.abort_reason == 'cancelled':
+                    self.send_json_response({
+                        "error": "Request cancelled",
+                        "request_id": request_id
+                    }, CLIENT_CLOSED_REQUEST, close_connection=not body_consumed)
+                elif not call.aborted:
+                    if not connected or body_consumed:
+                        # Ollama refused, hung or dropped us; an upload that broke mid-way may be the client's fault
+                        upstream_breaker.record_failure()
+                    if isinstance(e, socket.timeout):
+                        waited = upstream_read_timeout(api_endpoint) if connected else UPSTREAM_CONNECT_TIMEOUT
+                        metrics.upstream_timeouts.inc('response' if connected else 'connect')
+                        self.send_json_response({
+                            "error": f"Ollama did not respond within {waited} seconds"
+                        }, HTTPStatus.GATEWAY_TIMEOUT, close_connection=not body_consumed)
+                    else:
+                        self.send_error(
+                            HTTPStatus.BAD_GATEWAY,
+                            f"Error connecting to Ollama API: {str(e)}"
+                        )
+                return
+
+            self.relay_response(response, call, cache_key)
+
+        except (BrokenPipeError, ConnectionResetError):
+            call.abort('client_disconnect')
+
+        finally:
+            call.finished.set()
+            connection.close()
+            metrics.upstream_in_flight.dec()
+            if model_mutating:
+                # The model list may have changed while the request ran
+                shared_store.delete_prefix('response:')
+            with active_calls_lock:
+                active_calls.pop(request_id, None)
+            if self.budget_client is not None:
+                release_generation(self.budget_client, call.tokens_emitted if call.tokens_used is None else call.tokens_used)
+            if log_entry is not None:
+                log_entry.update(
+                    status=self.response_status,
+                    chunks=call.response_chunks,
+                    duration_ms=round((time.perf_counter() - self.request_started) * 1000, 1),
+                    ttfb_ms=None if call.ttfb is None else round(call.ttfb * 1000, 1),
+                    error=call.abort_reason
+                )
+                log_generation(log_entry)
+
+    def relay_response(self, response, call, cache_key=None):
+        """Copy an upstream response to the client as it arrives"""
+        cached_chunks = [] if cache_key and response.status == HTTPStatus.OK else None
+        self.trace.mark('relay')
+        # Send the response status code
+        self.send_response(response.status)
+
+        # Send headers
+        for header_name, header_value in response.getheaders():
+            # send_response() already wrote our own Server and Date headers
+            if header_name.lower() not in ('transfer-encoding', 'connection', 'keep-alive', 'server', 'date'):
+                self.send_header(header_name, header_value)
+
+        # Streams without a length are re-framed with chunked encoding
+        has_body = self.command != 'HEAD' and response.status not in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED)
+        chunked = has_body and response.getheader('Content-Length') is None
+        if chunked:
+            self.begin_chunked_body()
+            # Past the headers, only a stall between chunks counts as a timeout
+            if call.connection is not None and call.connection.sock is not None:
+                call.connection.sock.settimeout(STREAM_IDLE_TIMEOUT)
+
+        # Add CORS headers
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Request-ID, Authorization, X-API-Key')
+        self.send_header('Access-Control-Expose-Headers', 'X-Request-ID, ' + ', '.join(RATE_LIMIT_HEADERS))
+        self.send_header('X-Request-ID', call.request_id)
+        self.send_budget_headers()
+        self.end_headers()
+
+        # Write each chunk straight through so a broken pipe is noticed at once
+        counts_tokens = call.endpoint.startswith(GENERATION_ENDPOINTS)
+        tail = b''
+        complete = False
+        upstream_wait = client_write = 0.0
+        while True:
+            read_started = time.perf_counter()
+            try:
+                chunk = response.read1(STREAM_CHUNK_SIZE)
+            except socket.timeout:
+                logger.warning(f"Ollama sent nothing for {STREAM_IDLE_TIMEOUT}s on {call.endpoint}, giving up")
+                metrics.upstream_timeouts.inc('idle')
+                upstream_breaker.record_failure()
+                if chunked and counts_tokens:
+                    # Ollama reports mid-stream failures as an error line; do the same
+                    self.write_chunk(json.dumps({
+                        "error": f"Ollama stopped responding for {STREAM_IDLE_TIMEOUT} seconds"
+                    }).encode('utf-8') + b'\n')
+                break
+            except (OSError, http.client.HTTPException):
+                break  # Ollama dropped the stream, or we aborted it
+            write_started = time.perf_counter()
+            upstream_wait += write_started - read_started
+            if chunk:
+                self.capture.upstream_chunk(len(chunk))
+            if not chunk:
+                # An abort shuts the upstream socket down, which also reads as the end of the stream
+                complete = not call.aborted
+                break
+            if response.isclosed() or response.length == 0:
+                # Nothing left to save, so a disconnect from here on is not an abort
+                call.finished.set()
+            if counts_tokens:
+                call.tokens_emitted += chunk.count(b'\n')
+                tail = (tail + chunk)[-GENERATION_TAIL_BYTES:]
+            if cached_chunks is not None:
+                cached_chunks.append(chunk)
+            if call.response_chunks is not None:
+                call.response_chunks.append(chunk)
+            if chunked:
+                self.write_chunk(chunk)
+            else:
+                self.wfile.write(chunk)
+            self.wfile.flush()
+            client_write += time.perf_counter() - write_started
+
+        if chunked and call.aborted:
+            # Tell a client still listening that the stream was cut short, not finished
+            self.write_chunk(json.dumps({"error": call.abort_reason}).encode('utf-8') + b'\n')
+        if chunked:
+            self.end_chunked_body()
+
+        # Split the relay into time waiting on Ollama and time waiting on the client
+        self.trace.add('upstream_wait', upstream_wait)
+        self.trace.add('client_write', client_write)
+
+        if counts_tokens and complete:
+            stats = metrics.record_generation_tail(call.model, tail)
+            if stats:
+                call.tokens_used = stats.get('prompt_eval_count', 0) + stats.get('eval_count', 0)
+            self.trace.annotate(**{
+                f'ollama_{name}_ms': value / 1e6 for name, value in stats.items() if name.endswith('_duration')
+            })
+
+        if cached_chunks is not None and complete:
+            shared_store.set(cache_key, b''.join(cached_chunks), METADATA_CACHE_TTL)
+
+    def send_cached_response(self, body):
+        """Answer a metadata request from the shared response cache"""
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('X-Cache', 'HIT')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def begin_chunked_body(self):
+        """Announce a streamed body of unknown length (call before end_headers)"""
+        self.chunked_body = self.request_version == 'HTTP/1.1'
+        if self.chunked_body:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            # HTTP/1.0 clients cannot parse chunks, so the end of the body is the close
+            self.send_header('Connection', 'close')
+
+    def write_chunk(self, data):
+        if not data:
+            return
+        if self.chunked_body:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        else:
+            self.wfile.write(data)
+
+    def end_chunked_body(self):
+        if self.chunked_body:
+            self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def read_request_body(self, api_endpoint):
+        """Return the request body and its length for forwarding to Ollama
+
+        Small JSON bodies are read into memory so they can be inspected; large
+        uploads, chunked bodies and blobs are returned as an iterator of chunks
+        so memory use does not grow with the upload. The length is None when
+        the body should be sent chunked (or not at all).
+        """
+        transfer_encoding = self.headers.get('Transfer-Encoding', '').lower()
+        content_length = int(self.headers.get('Content-Length', 0))
+        blob_match = BLOB_DIGEST_PATTERN.match(api_endpoint)
+
+        if 'chunked' in transfer_encoding:
+            chunks, content_length = iter_chunked_body(self.rfile), None
+        elif content_length <= 0:
+            return None, None
+        elif content_length <= MAX_BUFFERED_BODY and not blob_match:
+            body = self.rfile.read(content_length)
+            if len(body) < content_length:
+                raise RequestBodyError(f"Request body ended {content_length - len(body)} bytes early")
+            return body, content_length
+        else:
+            chunks = iter_sized_body(self.rfile, content_length)
+
+        if blob_match:
+            chunks = verify_digest(chunks, blob_match.group(1))
+        return chunks, content_length
+
+    def send_upstream_unavailable(self):
+        """Fail fast with 503 while the circuit breaker keeps requests away from Ollama"""
+        metrics.upstream_rejected.inc(metrics.route_label(self.path))
+        retry_after = max(1, round(upstream_breaker.retry_after()))
+        data = json.dumps({
+            "error": "Ollama is unavailable",
+            "detail": health_monitor.last_error,
+            "retry_after": retry_after
+        }).encode('utf-8')
+        self.send_response(HTTPStatus.SERVICE_UNAVAILABLE)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Retry-After', str(retry_after))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if self.has_request_body():
+            # The request body was never read, so the connection cannot be reused
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def has_request_body(self):
+        """Whether the request came with a body; replies sent before reading it must close the connection"""
+        return self.headers.get('Content-Length', '0') != '0' or bool(self.headers.get('Transfer-Encoding'))
+
+    def admit_generation(self, close_connection=False):
+        """Check the client's token budget, then wait for a generation slot
+
+        Returns False once it has answered 429 (budget spent) or 503 (no slot
+        came free) itself. Otherwise the caller must hand the slot back with
+        release_generation(self.budget_client, tokens).
+        """
+        if not token_budget.enabled:
+            return True
+        client = client_key(self.headers, self.client_address[0], API_KEYS)
+        if token_budget.remaining(client) <= 0:
+            metrics.rate_limited.inc()
+            retry_after = max(1, round(token_budget.retry_after(client)))
+            self.send_json_response({
+                "error": "Token budget exhausted",
+                "limit": token_budget.limit,
+                "window": token_budget.window,
+                "retry_after": retry_after
+            }, HTTPStatus.TOO_MANY_REQUESTS, close_connection, headers={
+                'Retry-After': str(retry_after), **self.budget_headers(client)
+            })
+            return False
+
+        self.trace.mark('wait_slot')
+        waiting_since = time.perf_counter()
+        if not generation_slots.acquire(client):
+            self.send_json_response({
+                "error": "Too many generations queued, try again shortly"
+            }, HTTPStatus.SERVICE_UNAVAILABLE, close_connection, headers={'Retry-After': '5'})
+            return False
+        metrics.slot_wait.observe(time.perf_counter() - waiting_since)
+        self.budget_client = client
+        return True
+
+    def new_log_entry(self, request_id, endpoint, model, body):
+        """The raw start of a conversation log entry; the log's writer thread parses it
+
+        Inline images are swapped for their references first, so queued entries stay small.
+        """
+        return {
+            "ts": time.time(),
+            "request_id": request_id,
+            "client": self.budget_client or client_key(self.headers, self.client_address[0], API_KEYS),
+            "endpoint": endpoint,
+            "model": model,
+            "body": strip_images(body) if isinstance(body, bytes) else None,
+        }
+
+    def budget_headers(self, client):
+        return {
+            'X-RateLimit-Limit': str(token_budget.limit),
+            'X-RateLimit-Remaining': str(token_budget.remaining(client)),
+            'X-RateLimit-Reset': str(round(token_budget.reset_after(client))),
+        }
+
+    def send_budget_headers(self):
+        """Tell an admitted client how much of its budget is left (call before end_headers)"""
+        if self.budget_client is not None:
+            for name, value in self.budget_headers(self.budget_client).items():
+                self.send_header(name, value)
 
-                # Send headers
-                for header_name, header_value in response.getheaders():
-                    if header_name.lower() not in ('transfer-encoding', 'connection'):
-                        self.send_header(header_name, header_value)
+    def expand_images(self, body):
+        """Swap "sha256:<hex>" image references in a generate/chat body for the stored images
+
+        Returns the body to send (an iterator when anything was replaced) and its length.
+        """
+        try:
+            digests = image_references(json.loads(body))
+        except (ValueError, AttributeError):
+            return body, len(body)
+        if not digests:
+            return body, len(body)
+        return image_store.expand(body)
+
+    def _parse_generation_request(self, api_endpoint, body):
+        """Return the model and token limit of a generate/chat request, where known"""
+        if not isinstance(body, bytes) or not api_endpoint.startswith(GENERATION_ENDPOINTS):
+            return {}
+        try:
+            request = json.loads(body)
+            generation = {"model": request.get('model')}
+            options = request.get('options') or {}
+            generation["num_predict"] = int(options['num_predict'])
+        except (ValueError, TypeError, AttributeError):
+            return {}
+        except KeyError:
+            pass
+        return generation
+
+    def handle_metrics(self):
+        """Serve every worker's metrics in the Prometheus text format"""
+        metrics.upstream_up.set(1 if health_monitor.status == 'up' else 0)
+        metrics.log_pending.set(conversation_log.queue.qsize())
+        snapshots = [metrics.snapshot()]
+        if shared_store.shared:
+            own_key = f'metrics:{os.getpid()}'
+            snapshots.extend(
+                json.loads(value) for key, value in shared_store.get_prefix('metrics:').items()
+                if key != own_key
+            )
+
+        counters = shared_store.get_counters('proxy.')
+        extra_counters = {
+            f'ollama8web_proxy_{name}_total': counters.get(f'proxy.{name}', 0)
+            for name in PROXY_STAT_NAMES
+        }
+
+        body = metrics.render(snapshots, extra_counters).encode('utf-8')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_debug_api(self, method):
+        """Serve /debug/traces and /debug/profile to local clients only"""
+        if self.client_address[0] not in LOCAL_ADDRESSES:
+            self.send_json_response(
+                {"error": "Debug endpoints are only available locally"}, HTTPStatus.FORBIDDEN,
+                close_connection=self.has_request_body()
+            )
+            return
+
+        parsed = urlparse(self.path)
+        body = {}
+        if method == 'POST':
+            content_length = int(self.headers.get('Content-Length', 0))
+            try:
+                body = json.loads(self.rfile.read(content_length) or b'{}')
+            except ValueError:
+                self.send_json_response({"error": "Invalid JSON body"}, HTTPStatus.BAD_REQUEST)
+                return
+
+        if parsed.path == '/debug/traces' and method == 'GET':
+            query = parse_qs(parsed.query)
+            limit = int(query['limit'][0]) if query.get('limit', [''])[0].isdigit() else None
+            self.send_json_response({"sample_rate": tracer.sample_rate, "traces": tracer.recent(limit)})
+            return
+
+        if parsed.path == '/debug/traces' and method == 'POST':
+            try:
+                tracer.set_sample_rate(float(body.get('sample_rate', 0)))
+            except (TypeError, ValueError) as e:
+                self.send_json_response({"error": str(e)}, HTTPStatus.BAD_REQUEST)
+                return
+            self.send_json_response({"sample_rate": tracer.sample_rate})
+            return
+
+        if parsed.path == '/debug/budgets' and method == 'GET':
+            self.send_json_response({
+                "limit": token_budget.limit,
+                "window": token_budget.window,
+                "slots": generation_slots.get_status(),
+                "clients": token_budget.get_status(),
+            })
+            return
+
+        if parsed.path == '/debug/profile' and method == 'GET':
+            self.send_json_response(profiler.get_status())
+            return
+
+        if parsed.path == '/debug/profile' and method == 'POST':
+            try:
+                profiler.arm(body.get('mode', 'cpu'), int(body.get('requests', 10)))
+            except (TypeError, ValueError) as e:
+                self.send_json_response({"error": str(e)}, HTTPStatus.BAD_REQUEST)
+                return
+            except RuntimeError as e:
+                self.send_json_response({"error": str(e)}, HTTPStatus.CONFLICT)
+                return
+            self.send_json_response(profiler.get_status(), HTTPStatus.ACCEPTED)
+            return
 
-                # Add CORS headers
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-                self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        if parsed.path == '/debug/profile/download' and method == 'GET':
+            capture = profiler.download()
+            if capture is None:
+                self.send_json_response({"error": "No finished capture"}, HTTPStatus.NOT_FOUND)
+                return
+            filename, data = capture
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
 
-                self.end_headers()
+        self.send_json_response({"error": "Unknown debug endpoint"}, HTTPStatus.NOT_FOUND)
 
-                # Send the response body
-                self.wfile.write(response.read())
+    def handle_logs_api(self):
+        """Serve the conversation log, newest first, to local clients only"""
+        if not conversation_log.enabled:
+            self.send_json_response({"error": "Conversation log is off; start with --log-db FILE"}, HTTPStatus.NOT_FOUND)
+            return
+        if self.client_address[0] not in LOCAL_ADDRESSES:
+            self.send_json_response(
+                {"error": "The conversation log is only available locally"}, HTTPStatus.FORBIDDEN,
+                close_connection=self.has_request_body()
+            )
+            return
 
-        except urllib.error.URLError as e:
-            self.send_error(
-                HTTPStatus.BAD_GATEWAY,
-                f"Error connecting to Ollama API: {str(e)}"
+        query = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+        try:
+            page = conversation_log.query(
+                limit=int(query.get('limit', 50)),
+                before=int(query['before']) if 'before' in query else None,
+                model=query.get('model'),
+                client=query.get('client'),
+                since=float(query['since']) if 'since' in query else None
             )
+        except ValueError as e:
+            self.send_json_response({"error": str(e)}, HTTPStatus.BAD_REQUEST)
+            return
+        page["stats"] = conversation_log.get_stats()
+        self.send_json_response(page)
+
+    def handle_images_api(self, method):
+        """Upload an image once (POST /api/images) and check for one by digest"""
+        match = IMAGE_PATH_PATTERN.match(self.path)
+        if match and method == 'HEAD':
+            self.send_response(HTTPStatus.OK if image_store.exists(match.group(1)) else HTTPStatus.NOT_FOUND)
+            self.send_header('Content-Length', '0')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return
+        if match:
+            path = image_store.path(match.group(1))
+            if not os.path.exists(path):
+                self.send_json_response({"error": "Unknown image"}, HTTPStatus.NOT_FOUND)
+                return
+            self.send_json_response({"ref": f"sha256:{match.group(1)}", "size": os.path.getsize(path)})
+            return
+
+        if self.path != '/api/images':
+            self.send_json_response({"error": "Unknown image endpoint"}, HTTPStatus.NOT_FOUND)
+            return
+        if method == 'GET':
+            self.send_json_response(image_store.get_stats())
+            return
+
+        # Raw image bytes; the digest is computed while the upload is written to disk
+        self.trace.mark('store_image')
+        try:
+            body, _ = self.read_request_body('/images')
+            if body is None:
+                raise RequestBodyError("No image data provided")
+            digest, size, new = image_store.put([body] if isinstance(body, bytes) else body, MAX_IMAGE_UPLOAD)
+        except RequestBodyError as e:
+            self.send_json_response({"error": str(e)}, HTTPStatus.BAD_REQUEST, close_connection=True)
+            return
+        except ValueError as e:
+            self.send_json_response({"error": str(e)}, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, close_connection=True)
+            return
+        except OSError as e:
+            logger.error(f"Could not store image: {e}")
+            self.send_json_response({"error": "Could not store image"}, HTTPStatus.INTERNAL_SERVER_ERROR,
+                                    close_connection=True)
+            return
+        self.capture.request_body(size)
+        self.send_json_response({"ref": f"sha256:{digest}", "size": size},
+                                HTTPStatus.CREATED if new else HTTPStatus.OK)
+
+    def handle_warm_api(self):
+        """Preload a model; answers at once unless the body asks to wait for the load"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(content_length)
+            self.capture.request_body(body)
+            request = json.loads(body or b'{}')
+            model = request['model']
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json_response({"error": f"Expected a JSON body with a model: {e}"}, HTTPStatus.BAD_REQUEST)
+            return
+        if not isinstance(model, str) or not model:
+            self.send_json_response({"error": "model must be a non-empty string"}, HTTPStatus.BAD_REQUEST)
+            return
+        if not upstream_breaker.allow():
+            self.send_upstream_unavailable()
+            return
+
+        self.trace.annotate(model=model)
+        status = residency.warm(model)
+        if status["status"] == 'loaded' or not request.get('wait'):
+            self.send_json_response(status, HTTPStatus.OK if status["status"] == 'loaded' else HTTPStatus.ACCEPTED)
+            return
+
+        self.trace.mark('wait_load')
+        outcome = residency.wait(model, UPSTREAM_READ_TIMEOUTS['/generate']) or status
+        self.send_json_response(outcome, HTTPStatus.BAD_GATEWAY if outcome["status"] == 'error' else HTTPStatus.OK)
+
+    def handle_pull_api(self):
+        """Subscribe the client to the shared progress stream for a model pull"""
+        if not upstream_breaker.allow():
+            self.send_upstream_unavailable()
+            return
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(content_length)
+            self.capture.request_body(body)
+            request = json.loads(body or b'{}')
+            job = pull_manager.start(request)
+        except (ValueError, AttributeError) as e:
+            self.send_json_response({"error": str(e)}, HTTPStatus.BAD_REQUEST)
+            return
+
+        self.send_job_progress(job, request)
+
+    def handle_create_api(self):
+        """Start (or join) a background model build and subscribe the client to its progress"""
+        if not upstream_breaker.allow():
+            self.send_upstream_unavailable()
+            return
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(content_length)
+            self.capture.request_body(body)
+            request = json.loads(body or b'{}')
+            job = build_manager.start(request)
+        except BuildConflictError as e:
+            self.send_json_response({"error": str(e)}, HTTPStatus.CONFLICT)
+            return
+        except (ValueError, AttributeError) as e:
+            self.send_json_response({"error": str(e)}, HTTPStatus.BAD_REQUEST)
+            return
+
+        self.send_job_progress(job, request)
+
+    def send_job_progress(self, job, request):
+        """Relay a pull or build job's progress lines, or only its last one for stream: false"""
+        if request.get('stream') is False:
+            last_line = b'{}'
+            for line in job.follow():
+                last_line = line
+            status = HTTPStatus.INTERNAL_SERVER_ERROR if b'"error"' in last_line else HTTPStatus.OK
+            self.send_json_response(json.loads(last_line), status)
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.begin_chunked_body()
+        self.end_headers()
+
+        try:
+            for line in job.follow():
+                self.write_chunk(line + b'\n')
+                self.wfile.flush()
+            self.end_chunked_body()
+        except (BrokenPipeError, ConnectionResetError):
+            # The job keeps going for the remaining (or future) watchers
+            pass
+
+    def handle_stream_api(self, method, speak=False):
+        """Serve a generation as Server-Sent Events: POST starts one, GET resumes it
+
+        With `speak`, the answer's sentences are synthesized while the rest is
+        generated and interleaved with the text as 'audio' events.
+        """
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if speak and not (VOICE_AVAILABLE and voice_manager.tts_available):
+            self.send_json_response({
+                "error": "TTS not available",
+                "message": "Install voice dependencies with: pip install -r voice_requirements.txt"
+            }, HTTPStatus.SERVICE_UNAVAILABLE, close_connection=True)
+            return
+
+        if method == 'POST':
+            if not upstream_breaker.allow():
+                self.send_upstream_unavailable()
+                return
+            try:
+                content_length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(content_length)
+                self.capture.request_body(body)
+                request = json.loads(body or b'{}')
+                voice_id = request.pop('voice_id', None) if speak else None
+                flush_interval = float(query['flush_ms'][0]) / 1000 if 'flush_ms' in query else None
+                flush_bytes = int(query['flush_bytes'][0]) if 'flush_bytes' in query else None
+                if flush_interval is not None and not 0 < flush_interval < float('inf'):
+                    raise ValueError("flush_ms must be a positive number")
+                if flush_bytes is not None and flush_bytes < 1:
+                    raise ValueError("flush_bytes must be a positive integer")
+                image_store.expand_request(request)
+            except (ValueError, AttributeError, UnknownImageError) as e:
+                self.send_json_response({"error": str(e)}, HTTPStatus.BAD_REQUEST)
+                return
+            if not self.admit_generation():
+                return
+            # The generation outlives this request if the client drops, so it cleans up after itself
+            client = self.budget_client
+            try:
+                residency.record_use(request.get('model'))
+                if KEEP_ALIVE_POLICY and request.get('model'):
+                    request.setdefault('keep_alive', residency.keep_alive_for(request['model']))
+                log_entry = self.new_log_entry(
+                    None, '/speak' if speak else '/stream', request.get('model'), body
+                ) if conversation_log.enabled else None
+            except BaseException:
+                # on_finish, which gives the slot back, is only attached once the stream starts
+                if client is not None:
+                    release_generation(client, 0)
+                raise
+            started = time.perf_counter()
+
+            def on_finish(stream):
+                if client is not None:
+                    release_generation(client, stream.tokens_used)
+                if log_entry is not None:
+                    if stream.abort_reason is not None:
+                        status = CLIENT_CLOSED_REQUEST
+                    elif stream.error is not None:
+                        status = stream.error_status or HTTPStatus.BAD_GATEWAY
+                    else:
+                        status = HTTPStatus.OK
+                    log_entry.update(
+                        request_id=stream.stream_id,
+                        status=status,
+                        text=''.join(stream.text),
+                        stats=stream.stats,
+                        duration_ms=round((time.perf_counter() - started) * 1000, 1),
+                        error=stream.abort_reason or stream.error
+                    )
+                    log_generation(log_entry)
+
+            try:
+                stream = stream_manager.start(
+                    request, flush_interval, flush_bytes, on_finish,
+                    speak=(lambda sentence: voice_manager.text_to_speech(sentence, voice_id)) if speak else None
+                )
+            except (ValueError, AttributeError) as e:
+                if client is not None:
+                    release_generation(client, 0)
+                self.send_json_response({"error": str(e)}, HTTPStatus.BAD_REQUEST)
+                return
+            except BaseException:
+                if client is not None:
+                    release_generation(client, 0)
+                raise
+            last_event_id = 0
+        else:
+            stream = stream_manager.get(url.path[len('/api/stream/'):])
+            if stream is None:
+                self.send_json_response({"error": "Unknown or expired stream"}, HTTPStatus.NOT_FOUND)
+                return
+            try:
+                last_event_id = int(self.headers.get('Last-Event-ID') or query.get('last_event_id', ['0'])[0])
+            except ValueError:
+                last_event_id = 0
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers', 'X-Stream-ID, ' + ', '.join(RATE_LIMIT_HEADERS))
+        self.send_header('X-Stream-ID', stream.stream_id)
+        self.send_budget_headers()
+        self.begin_chunked_body()
+        self.end_headers()
+
+        try:
+            self.write_chunk(b'retry: 1000\n\n')
+            for batch in stream.follow(last_event_id):
+                self.write_chunk(batch)
+                self.wfile.flush()
+            self.end_chunked_body()
+        except (BrokenPipeError, ConnectionResetError):
+            # Generation carries on for a while in case the client reconnects
+            pass
+
+    def handle_cancel_api(self):
+        """Abort a proxied request by the id sent in (or returned as) X-Request-ID"""
+        request_id = self.path[len('/api/cancel/'):]
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        with active_calls_lock:
+            call = active_calls.get(request_id)
+
+        if call is None and stream_manager.cancel(request_id):
+            self.send_json_response({"status": "cancelled", "request_id": request_id})
+            return
+
+        if call is None and shared_store.shared:
+            # The request may be running in another worker, which polls for this flag
+            shared_store.set(f'cancel:{request_id}', b'1', CANCEL_REQUEST_TTL)
+            self.send_json_response({
+                "status": "cancel_requested",
+                "request_id": request_id
+            }, HTTPStatus.ACCEPTED)
+            return
+
+        if call is None or not call.abort('cancelled'):
+            self.send_json_response({
+                "error": "No active request with that id",
+                "request_id": request_id
+            }, HTTPStatus.NOT_FOUND)
+            return
+
+        self.send_json_response({
+            "status": "cancelled",
+            "request_id": request_id,
+            "tokens_emitted": call.tokens_emitted
+        })
 
     def do_OPTIONS(self):
         # Handle CORS preflight requests
         self.send_response(HTTPStatus.NO_CONTENT)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Request-ID, Last-Event-ID, Authorization, X-API-Key')
         self.send_header('Access-Control-Max-Age', '86400')  # 24 hours
         self.end_headers()
 
-    def send_json_response(self, data, status_code=HTTPStatus.OK):
+    def send_json_response(self, data, status_code=HTTPStatus.OK, close_connection=False, headers=None):
         """Send a JSON response"""
+        response_data = json.dumps(data).encode('utf-8')
         self.send_response(status_code)
         self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_data)))
         self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if close_connection:
+            # The request body was not fully read, so the stream is out of sync
+            self.send_header('Connection', 'close')
         self.end_headers()
-        response_data = json.dumps(data).encode('utf-8')
         self.wfile.write(response_data)
 
     def handle_voice_api(self, method):
@@ -147,14 +1443,26 @@ class OllamaUIHandler(http.server.SimpleHTTPRequestHandler):
 
         # Get voice status
         if self.path == '/api/voice/status' and method == 'GET':
-            status = voice_manager.get_voice_status()
+            cached = shared_store.get('voice:status')
+            metrics.cache_requests.inc('voice_status', 'miss' if cached is None else 'hit')
+            self.trace.annotate(cache='miss' if cached is None else 'hit')
+            if cached is None:
+                self.trace.mark('voice_status')
+                status = voice_manager.get_voice_status()
+                shared_store.set('voice:status', json.dumps(status).encode('utf-8'), VOICE_STATUS_TTL)
+            else:
+                status = json.loads(cached)
+            self.trace.mark('write_response')
             self.send_json_response(status)
             return
 
         # Update voice settings
         if self.path == '/api/voice/settings' and method == 'POST':
+            self.trace.mark('read_body')
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
+            self.capture.request_body(post_data)
+            self.trace.mark('apply_settings')
             try:
                 settings = json.loads(post_data.decode('utf-8'))
                 if 'auto_play' in settings:
@@ -173,8 +1481,11 @@ class OllamaUIHandler(http.server.SimpleHTTPRequestHandler):
                     raise ValueError("Expected multipart/form-data")
 
                 # Read the form data
+                self.trace.mark('read_body')
                 content_length = int(self.headers['Content-Length'])
                 post_data = self.rfile.read(content_length)
+                self.capture.request_body(post_data)
+                self.trace.mark('save_sample')
 
                 # Create a temporary file to store the audio
                 with tempfile.NamedTemporaryFile(delete=False) as temp_file:
@@ -183,27 +1494,37 @@ class OllamaUIHandler(http.server.SimpleHTTPRequestHandler):
 
                 # Save the voice sample
                 result = voice_manager.save_voice_sample(post_data)
+                self.trace.mark('refresh_status')
+                shared_store.set(
+                    'voice:status',
+                    json.dumps(voice_manager.get_voice_status()).encode('utf-8'),
+                    VOICE_STATUS_TTL
+                )
                 
                 # Clean up
                 os.unlink(temp_path)
                 
+                self.trace.mark('write_response')
                 self.send_json_response(result)
                 
             except Exception as e:
                 self.send_error(HTTPStatus.BAD_REQUEST, str(e))
             return
 
+        self.send_error(HTTPStatus.NOT_FOUND, "Unknown voice endpoint")
+
     def handle_tts_api(self):
         """Handle text-to-speech API requests"""
         if not VOICE_AVAILABLE:
             self.send_json_response({
                 "error": "TTS not available",
                 "message": "Install voice dependencies with: pip install -r voice_requirements.txt"
-            }, HTTPStatus.SERVICE_UNAVAILABLE)
+            }, HTTPStatus.SERVICE_UNAVAILABLE, close_connection=True)
             return
 
         try:
             # Get request body
+            self.trace.mark('read_body')
             content_length = int(self.headers.get('Content-Length', 0))
             if content_length == 0:
                 self.send_json_response({
@@ -212,6 +1533,7 @@ class OllamaUIHandler(http.server.SimpleHTTPRequestHandler):
                 return
 
             body = self.rfile.read(content_length)
+            self.capture.request_body(body)
             data = json.loads(body.decode('utf-8'))
 
             text = data.get('text', '').strip()
@@ -224,8 +1546,13 @@ class OllamaUIHandler(http.server.SimpleHTTPRequestHandler):
                 return
 
             # Generate TTS
+            self.trace.mark('synthesize')
+            self.trace.annotate(characters=len(text))
+            synthesis_started = time.perf_counter()
             audio_base64 = voice_manager.text_to_speech(text, voice_id)
+            metrics.tts_duration.observe(time.perf_counter() - synthesis_started)
 
+            self.trace.mark('write_response')
             if audio_base64:
                 self.send_json_response({
                     "audio": audio_base64,
@@ -237,12 +1564,82 @@ class OllamaUIHandler(http.server.SimpleHTTPRequestHandler):
                 }, HTTPStatus.INTERNAL_SERVER_ERROR)
 
         except Exception as e:
-            print(f"TTS error: {e}")
+            logger.error(f"TTS error: {e}")
             self.send_json_response({
                 "error": "TTS generation failed",
                 "message": str(e)
             }, HTTPStatus.INTERNAL_SERVER_ERROR)
 
+class OllamaUIServer(socketserver.ThreadingTCPServer):
+    """Threaded server so /api/cancel and disconnect checks run alongside a long generation"""
+    daemon_threads = True
+    allow_reuse_address = True
+    block_on_close = False  # drain() waits for connections instead, with a timeout
+
+    def __init__(self, server_address, handler, reuse_port=False):
+        self.reuse_port = reuse_port
+        self.active_connections = 0
+        self.connections_changed = threading.Condition()
+        super().__init__(server_address, handler)
+
+    def server_bind(self):
+        if self.reuse_port:
+            # Lets every pre-forked worker bind the same port; the kernel spreads connections
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def process_request_thread(self, request, client_address):
+        with self.connections_changed:
+            self.active_connections += 1
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            with self.connections_changed:
+                self.active_connections -= 1
+                self.connections_changed.notify_all()
+
+    def drain(self, timeout):
+        """After shutdown(), wait up to `timeout` seconds for open connections to finish"""
+        deadline = time.monotonic() + timeout
+        with self.connections_changed:
+            while self.active_connections > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"Closing with {self.active_connections} connections still open")
+                    return
+                self.connections_changed.wait(remaining)
+
+
+def publish_metrics():
+    """Share this worker's metrics with the others so any of them can answer /metrics"""
+    while True:
+        shared_store.set(f'metrics:{os.getpid()}', metrics.dumps_snapshot(), METRICS_PUBLISH_INTERVAL * 3)
+        time.sleep(METRICS_PUBLISH_INTERVAL)
+
+
+def run_worker():
+    """Serve requests in a pre-forked worker until SIGTERM, then drain and return"""
+    httpd = OllamaUIServer(("", PORT), OllamaUIHandler, reuse_port=True)
+    threading.Thread(target=publish_metrics, daemon=True).start()
+    health_monitor.start()
+    if token_budget.enabled:
+        token_budget.start()
+    if conversation_log.enabled:
+        conversation_log.start()
+
+    def stop(signum, frame):
+        # shutdown() blocks until serve_forever() returns, so it needs its own thread
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    httpd.serve_forever()
+    httpd.drain(GRACEFUL_TIMEOUT)
+    httpd.server_close()
+    conversation_log.close()
+    if token_budget.path:
+        token_budget.save()
+
+
 def create_index_html():
     """Create a simple index.html file if it doesn't exist"""
     if not os.path.exists('index.html'):
@@ -823,13 +2220,117 @@ def create_index_html():
 
 def check_ollama_running():
     """Check if Ollama is running"""
-    try:
-        with urllib.request.urlopen(f"{OLLAMA_API}/tags") as response:
-            return response.status == 200
-    except:
-        return False
+    return health_monitor.check()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ollama8Web server")
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help="number of pre-forked worker processes (0 = one per CPU core); with more than one, "
+             "SSE streams cannot be resumed, since a reconnect usually reaches another worker"
+    )
+    parser.add_argument('--port', type=int, default=PORT, help="port to serve the UI on")
+    parser.add_argument(
+        '--ollama-api', default=OLLAMA_API, metavar='URL',
+        help=f"Ollama API base URL (default: {OLLAMA_API})"
+    )
+    parser.add_argument('--no-browser', action='store_true', help="do not open a browser tab")
+    parser.add_argument(
+        '--record', metavar='FILE',
+        help="append anonymized traffic to FILE for benchmarks/replay.py"
+    )
+    parser.add_argument(
+        '--trace-sample', type=float, default=TRACE_SAMPLE_RATE, metavar='RATE',
+        help="share of requests to trace for /debug/traces, from 0 to 1"
+    )
+    parser.add_argument(
+        '--rate-limit', type=int, default=RATE_LIMIT_TOKENS, metavar='TOKENS',
+        help="prompt plus generated tokens each client may use per window (0 = unlimited)"
+    )
+    parser.add_argument(
+        '--rate-limit-window', type=float, default=RATE_LIMIT_WINDOW, metavar='SECONDS',
+        help=f"length of the token budget window (default: {RATE_LIMIT_WINDOW})"
+    )
+    parser.add_argument(
+        '--rate-limit-state', metavar='FILE',
+        help="keep token budgets in FILE so a restart does not reset them"
+    )
+    parser.add_argument(
+        '--api-keys', metavar='FILE',
+        help="API keys (one per line) that get their own token budget; other clients are charged by IP"
+    )
+    parser.add_argument(
+        '--no-keep-alive-policy', action='store_true',
+        help="forward generations without a keep_alive as they are, instead of choosing one by model usage"
+    )
+    parser.add_argument(
+        '--image-store', default=IMAGE_STORE_DIR, metavar='DIR',
+        help="directory for images uploaded to /api/images"
+    )
+    parser.add_argument(
+        '--image-store-size', type=int, default=IMAGE_STORE_BYTES // (1024 * 1024), metavar='MB',
+        help="disk space for stored images before the least recently used are evicted"
+    )
+    parser.add_argument(
+        '--build-slots', type=int, default=BUILD_SLOTS, metavar='N',
+        help=f"model builds (/api/create) run at once; more wait their turn (default: {BUILD_SLOTS})"
+    )
+    parser.add_argument(
+        '--log-db', metavar='FILE',
+        help="log every generation (prompts, replies, options, timings) to the SQLite database FILE"
+    )
+    return parser.parse_args()
 
 def main():
+    global shared_store, PORT, OLLAMA_API, KEEP_ALIVE_POLICY, API_KEYS
+    args = parse_args()
+    tracer.set_sample_rate(args.trace_sample)
+    PORT = args.port
+    OLLAMA_API = args.ollama_api.rstrip('/')
+    pull_manager.ollama_api = stream_manager.ollama_api = health_monitor.ollama_api = urlparse(OLLAMA_API)
+    residency.ollama_api = build_manager.ollama_api = urlparse(OLLAMA_API)
+    build_manager.slots = threading.Semaphore(args.build_slots)
+    if args.record:
+        recorder.open(args.record)
+    workers = args.workers or os.cpu_count() or 1
+    if workers > 1 and not can_prefork():
+        logger.warning("Multiple workers need fork() and SO_REUSEPORT; running a single process")
+        workers = 1
+    KEEP_ALIVE_POLICY = not args.no_keep_alive_policy
+    image_store.directory = args.image_store
+    image_store.max_bytes = args.image_store_size * 1024 * 1024
+    if args.log_db:
+        conversation_log.open(args.log_db)
+    token_budget.limit = args.rate_limit
+    token_budget.window = args.rate_limit_window
+    if args.api_keys:
+        try:
+            API_KEYS = load_api_keys(args.api_keys)
+        except OSError as e:
+            logger.error(f"Could not read the API keys: {e}")
+            return
+    if token_budget.enabled and workers > GENERATION_SLOTS:
+        logger.error(
+            f"--rate-limit shares {GENERATION_SLOTS} generation slots between workers, "
+            f"so it allows at most --workers {GENERATION_SLOTS}"
+        )
+        return
+
+    if workers > 1:
+        # Caches, counters and token budgets must be visible to every worker, so keep them on disk
+        store_path = os.path.join(tempfile.gettempdir(), f"ollama8web-{PORT}.sqlite")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(store_path + suffix):
+                os.unlink(store_path + suffix)
+        shared_store = SQLiteStore(store_path)
+        token_budget.store = shared_store
+        stream_manager.cancel_requested = cancel_requested
+        # Each worker schedules its share, so together they never send Ollama more than GENERATION_SLOTS
+        generation_slots.slots = GENERATION_SLOTS // workers
+    if args.rate_limit_state:
+        token_budget.path = args.rate_limit_state
+        token_budget.load()
+
     # Check if Ollama is running
     if not check_ollama_running():
         logger.error("Ollama is not running! Please start Ollama by running: ollama serve")
@@ -855,19 +2356,40 @@ def main():
     # Set the directory to serve files from
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-    with socketserver.TCPServer(("", PORT), handler) as httpd:
+    if workers > 1:
+        print(f"\nOllama8Web is running with {workers} worker processes!")
+        print(f"→ Open http://localhost:{PORT}/ollama8web/index.html in your browser")
+        print("Press Ctrl+C to stop the server, or send SIGHUP for a graceful restart\n")
+        if not args.no_browser:
+            webbrowser.open(f"http://localhost:{PORT}/ollama8web/index.html")
+
+        PreforkSupervisor(run_worker, workers).run()
+        print("\nServer stopped")
+        return
+
+    with OllamaUIServer(("", PORT), handler) as httpd:
+        health_monitor.start()
+        if token_budget.enabled:
+            token_budget.start()
+        if conversation_log.enabled:
+            conversation_log.start()
         print(f"\nOllama8Web is running!")
         print(f"→ Open http://localhost:{PORT}/ollama8web/index.html in your browser")
         print("Press Ctrl+C to stop the server\n")
 
         # Open the browser directly to the correct URL
-        webbrowser.open(f"http://localhost:{PORT}/ollama8web/index.html")
+        if not args.no_browser:
+            webbrowser.open(f"http://localhost:{PORT}/ollama8web/index.html")
 
         # Start the server
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
             print("\nServer stopped")
+        finally:
+            conversation_log.close()
+            if token_budget.path:
+                token_budget.save()
 
 if __name__ == "__main__":
     main()
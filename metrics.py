@@ -0,0 +1,258 @@
+"""
+Metrics for Ollama8Web
+Lightweight in-process counters, gauges and histograms rendered in the Prometheus text format
+"""
+
+import re
+import json
+import bisect
+import threading
+from typing import Dict, Any, List, Optional, Iterable
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Fields in Ollama's final generate/chat object that carry generation statistics
+STAT_PATTERN = re.compile(
+    rb'"(load_duration|prompt_eval_count|prompt_eval_duration|eval_count|eval_duration)"\s*:\s*(\d+)'
+)
+
+registry: List['Metric'] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    """A named family of series keyed by label values
+
+    Recording is a dict update under a per-metric lock, so it is cheap enough
+    for the proxy hot path.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values: Dict[tuple, Any] = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {'\t'.join(key): (list(value) if isinstance(value, list) else value)
+                    for key, value in self.values.items()}
+
+    def _label_text(self, key: tuple, extra: str = '') -> str:
+        pairs = [f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self, values: Dict[tuple, Any]) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{self._label_text(key)} {value:g}')
+        return lines
+
+    @staticmethod
+    def merge(current, other):
+        return current + other
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values: str):
+        with self.lock:
+            self.values[label_values] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                # Per-bucket counts (not cumulative), then the +Inf bucket, sum and count
+                series = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self, values: Dict[tuple, Any]) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        for key, series in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+                lines.append(f'{self.name}_bucket{self._label_text(key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{self._label_text(key)} {series[-2]:g}')
+            lines.append(f'{self.name}_count{self._label_text(key)} {series[-1]}')
+        return lines
+
+    @staticmethod
+    def merge(current, other):
+        return [a + b for a, b in zip(current, other)]
+
+
+# HTTP front end
+http_requests = Counter(
+    'ollama8web_http_requests_total', 'Requests handled, by route, method and status',
+    ('route', 'method', 'status')
+)
+http_request_duration = Histogram(
+    'ollama8web_http_request_duration_seconds', 'Time from parsed request to last byte sent', ('route',)
+)
+http_in_flight = Gauge('ollama8web_http_requests_in_flight', 'Requests currently being handled')
+
+# Ollama upstream
+upstream_ttfb = Histogram(
+    'ollama8web_upstream_ttfb_seconds', 'Time from sending a request to Ollama until its response headers arrive',
+    ('endpoint',)
+)
+upstream_in_flight = Gauge('ollama8web_upstream_requests_in_flight', 'Requests currently waiting on Ollama')
+upstream_up = Gauge('ollama8web_upstream_up', 'Worker processes whose last health check reached Ollama')
+upstream_rejected = Counter(
+    'ollama8web_upstream_rejected_total', 'Requests failed fast while the circuit breaker was open', ('route',)
+)
+upstream_timeouts = Counter('ollama8web_upstream_timeouts_total', 'Ollama calls that timed out, by phase', ('phase',))
+prompt_tokens = Counter('ollama8web_prompt_tokens_total', 'Prompt tokens evaluated by Ollama', ('model',))
+prompt_eval_seconds = Counter('ollama8web_prompt_eval_seconds_total', 'Time Ollama spent on prompt evaluation', ('model',))
+generated_tokens = Counter('ollama8web_generated_tokens_total', 'Tokens generated by Ollama', ('model',))
+eval_seconds = Counter('ollama8web_eval_seconds_total', 'Time Ollama spent generating tokens', ('model',))
+
+# Token budgets
+rate_limited = Counter('ollama8web_rate_limited_total', 'Generations refused because the client spent its token budget')
+charged_tokens = Counter('ollama8web_charged_tokens_total', 'Prompt and generated tokens charged to client budgets')
+slot_wait = Histogram('ollama8web_generation_slot_wait_seconds', 'Time generations waited for a free slot')
+
+# Model residency
+model_warmups = Counter('ollama8web_model_warmups_total', 'Model preloads sent to Ollama, by result', ('result',))
+model_warmup_duration = Histogram('ollama8web_model_warmup_seconds', 'Time Ollama took to load a model on request')
+
+# Model builds
+model_builds = Counter(
+    'ollama8web_model_builds_total', 'Model creates by outcome: built, copied, unchanged or error', ('outcome',)
+)
+
+# Conversation log
+log_written = Counter('ollama8web_conversation_log_written_total', 'Generations written to the conversation log')
+log_dropped = Counter('ollama8web_conversation_log_dropped_total', 'Generations not logged because the write queue was full')
+log_pending = Gauge('ollama8web_conversation_log_pending', 'Generations queued for the conversation log writer')
+
+# Voice and caches
+tts_duration = Histogram('ollama8web_tts_synthesis_seconds', 'Time spent synthesizing speech')
+cache_requests = Counter('ollama8web_cache_requests_total', 'Cache lookups by cache and result', ('cache', 'result'))
+
+
+def route_label(path: str) -> str:
+    """Collapse a request path to a low-cardinality route name"""
+    path = path.split('?', 1)[0]
+    if path.startswith('/api/'):
+        return '/api/' + path[5:].split('/', 1)[0]
+    if path in ('/metrics', '/'):
+        return path
+    if path.startswith('/debug/'):
+        return '/debug/' + path[7:].split('/', 1)[0]
+    return 'static'
+
+
+def record_generation(model: Optional[str], stats: Dict[str, Any]):
+    """Account the eval counts and durations from Ollama's final response object"""
+    model = model or 'unknown'
+    if stats.get('prompt_eval_count'):
+        prompt_tokens.inc(model, amount=stats['prompt_eval_count'])
+        prompt_eval_seconds.inc(model, amount=stats.get('prompt_eval_duration', 0) / 1e9)
+    if stats.get('eval_count'):
+        generated_tokens.inc(model, amount=stats['eval_count'])
+        eval_seconds.inc(model, amount=stats.get('eval_duration', 0) / 1e9)
+
+
+def parse_generation_tail(tail: bytes) -> Dict[str, int]:
+    """Read Ollama's statistics from the last bytes of a relayed response
+
+    Ollama puts the statistics at the very end of its final object, so a
+    regex over the tail avoids parsing (or keeping) the whole body.
+    """
+    last_object = tail.rstrip().rsplit(b'\n', 1)[-1]
+    return {name.decode(): int(value) for name, value in STAT_PATTERN.findall(last_object)}
+
+
+def record_generation_tail(model: Optional[str], tail: bytes) -> Dict[str, int]:
+    """Like record_generation, from the last bytes of a relayed response; returns the statistics"""
+    stats = parse_generation_tail(tail)
+    if stats:
+        record_generation(model, stats)
+    return stats
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """Every series of every metric, in a JSON-friendly form for sharing between workers"""
+    return {metric.name: metric.snapshot() for metric in registry}
+
+
+def render(snapshots: Iterable[Dict[str, Dict[str, Any]]], extra_counters: Optional[Dict[str, float]] = None) -> str:
+    """Merge worker snapshots and render them in the Prometheus text exposition format"""
+    merged: Dict[str, Dict[tuple, Any]] = {metric.name: {} for metric in registry}
+    by_name = {metric.name: metric for metric in registry}
+    for worker in snapshots:
+        for name, series in worker.items():
+            metric = by_name.get(name)
+            if metric is None:
+                continue
+            target = merged[name]
+            for key, value in series.items():
+                key = tuple(key.split('\t')) if key else ()
+                target[key] = metric.merge(target[key], value) if key in target else value
+
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render(merged[metric.name]))
+
+    # Average throughput per model, derived from the merged counters
+    lines.append('# HELP ollama8web_model_tokens_per_second Tokens per second reported by Ollama, by phase')
+    lines.append('# TYPE ollama8web_model_tokens_per_second gauge')
+    for phase, tokens, seconds in (('prompt', prompt_tokens, prompt_eval_seconds),
+                                   ('eval', generated_tokens, eval_seconds)):
+        for key, count in sorted(merged[tokens.name].items()):
+            duration = merged[seconds.name].get(key, 0)
+            if duration > 0:
+                lines.append(
+                    f'ollama8web_model_tokens_per_second{{model="{_escape(key[0])}",phase="{phase}"}} '
+                    f'{count / duration:g}'
+                )
+
+    for name, value in sorted((extra_counters or {}).items()):
+        lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name} {value:g}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def dumps_snapshot() -> bytes:
+    return json.dumps(snapshot()).encode('utf-8')
@@ -0,0 +1,203 @@
+"""
+Model Residency for Ollama8Web
+Preloads models before their first prompt and picks each model's keep_alive from how often it is used
+"""
+
+import json
+import math
+import time
+import logging
+import threading
+import http.client
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+USAGE_HALF_LIFE = 3600.0  # seconds for a model's usage score to halve
+# (usage score, keep_alive): models scoring at least the first value are kept loaded that long
+KEEP_ALIVE_TIERS = (
+    (10.0, '30m'),
+    (3.0, '15m'),
+    (0.0, '5m'),  # Ollama's own default
+)
+PS_CACHE_TTL = 2.0  # seconds an /api/ps answer is reused
+
+
+def model_key(name: str) -> str:
+    """Ollama treats "llama3" and "llama3:latest" as the same model"""
+    return name if ':' in name.rsplit('/', 1)[-1] else name + ':latest'
+
+
+class ResidencyManager:
+    """Knows which models Ollama has loaded, warms them on request, and sets their keep_alive
+
+    Usage is a score per model that decays with USAGE_HALF_LIFE, so a model
+    used ten times this morning ranks below one used twice in the last few
+    minutes. The score picks the model's KEEP_ALIVE_TIERS entry.
+    """
+
+    def __init__(self, ollama_api: str, connect_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None,
+                 on_warm: Optional[Callable[[str, float], None]] = None):
+        self.ollama_api = urlparse(ollama_api)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.on_warm = on_warm  # called with (result, seconds) after each warm-up
+        self.usage: Dict[str, list] = {}  # model -> [score, when it was last updated]
+        self.warming: Dict[str, threading.Event] = {}
+        self.last_warmed: Dict[str, Dict[str, Any]] = {}
+        self.ps_cache = None
+        self.ps_fetched = 0.0
+        self.lock = threading.Lock()
+
+    # Usage and policy
+
+    def record_use(self, model: Optional[str]):
+        if not model:
+            return
+        key = model_key(model)
+        now = time.monotonic()
+        with self.lock:
+            score, updated = self.usage.get(key, (0.0, now))
+            self.usage[key] = [self._decayed(score, updated, now) + 1, now]
+
+    def score(self, model: str) -> float:
+        now = time.monotonic()
+        with self.lock:
+            score, updated = self.usage.get(model_key(model), (0.0, now))
+        return self._decayed(score, updated, now)
+
+    @staticmethod
+    def _decayed(score: float, updated: float, now: float) -> float:
+        return score * math.pow(0.5, (now - updated) / USAGE_HALF_LIFE)
+
+    def keep_alive_for(self, model: str) -> str:
+        score = self.score(model)
+        for threshold, keep_alive in KEEP_ALIVE_TIERS:
+            if score >= threshold:
+                return keep_alive
+        return KEEP_ALIVE_TIERS[-1][1]
+
+    def apply_keep_alive(self, body: bytes, model: Optional[str]) -> bytes:
+        """Add the policy's keep_alive to a generate/chat body that does not set its own
+
+        The body is spliced rather than re-encoded, so requests carrying
+        large inline images cost no more than small ones.
+        """
+        if not model or b'"keep_alive"' in body:
+            return body
+        end = body.rstrip().rfind(b'}')
+        if end <= 0:
+            return body
+        return body[:end] + b',"keep_alive":' + json.dumps(self.keep_alive_for(model)).encode('utf-8') + body[end:]
+
+    # Warm-up
+
+    def warm(self, model: str) -> Dict[str, Any]:
+        """Start loading `model` in the background unless it is loaded or loading already"""
+        key = model_key(model)
+        if self.is_loaded(key):
+            return {"model": key, "status": "loaded"}
+        with self.lock:
+            if key in self.warming:
+                return {"model": key, "status": "warming"}
+            done = self.warming[key] = threading.Event()
+        threading.Thread(target=self._warm, args=(key, done), daemon=True).start()
+        return {"model": key, "status": "warming", "keep_alive": self.keep_alive_for(key)}
+
+    def wait(self, model: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Block until a warm-up of `model` finishes; returns its outcome"""
+        key = model_key(model)
+        with self.lock:
+            done = self.warming.get(key)
+        if done is not None:
+            done.wait(timeout)
+        return self.last_warmed.get(key)
+
+    def _warm(self, model: str, done: threading.Event):
+        # A generate without a prompt makes Ollama load the model and answer at once
+        body = json.dumps({"model": model, "keep_alive": self.keep_alive_for(model)}).encode('utf-8')
+        connection = http.client.HTTPConnection(
+            self.ollama_api.hostname, self.ollama_api.port, timeout=self.connect_timeout
+        )
+        started = time.perf_counter()
+        outcome = {"model": model, "status": "error"}
+        try:
+            connection.connect()
+            connection.sock.settimeout(self.read_timeout)
+            connection.request('POST', f"{self.ollama_api.path}/generate", body=body,
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            answer = response.read()
+            if response.status == 200:
+                outcome["status"] = "loaded"
+            else:
+                outcome["error"] = json.loads(answer).get('error') or f"HTTP {response.status}"
+        except (OSError, ValueError, AttributeError, http.client.HTTPException) as e:
+            outcome["error"] = str(e) or type(e).__name__
+        finally:
+            connection.close()
+            elapsed = time.perf_counter() - started
+            outcome["seconds"] = round(elapsed, 3)
+            outcome["finished_at"] = time.time()
+            if outcome["status"] != "loaded":
+                logger.warning(f"Could not warm up {model}: {outcome.get('error')}")
+            with self.lock:
+                self.last_warmed[model] = outcome
+                del self.warming[model]
+                self.ps_cache = None
+            done.set()
+            if self.on_warm is not None:
+                self.on_warm(outcome["status"], elapsed)
+
+    # Residency
+
+    def loaded_models(self) -> Dict[str, Dict[str, Any]]:
+        """Models Ollama has in memory, from a briefly cached /api/ps"""
+        with self.lock:
+            if self.ps_cache is not None and time.monotonic() - self.ps_fetched < PS_CACHE_TTL:
+                return self.ps_cache
+
+        connection = http.client.HTTPConnection(
+            self.ollama_api.hostname, self.ollama_api.port, timeout=self.connect_timeout
+        )
+        try:
+            connection.request('GET', f"{self.ollama_api.path}/ps")
+            response = connection.getresponse()
+            data = json.loads(response.read()) if response.status == 200 else {}
+            models = {model_key(model['name']): model for model in data.get('models', [])}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, http.client.HTTPException):
+            return {}
+        finally:
+            connection.close()
+
+        with self.lock:
+            self.ps_cache = models
+            self.ps_fetched = time.monotonic()
+        return models
+
+    def is_loaded(self, model: str) -> bool:
+        return model_key(model) in self.loaded_models()
+
+    def get_status(self) -> Dict[str, Any]:
+        loaded = self.loaded_models()
+        with self.lock:
+            names = set(loaded) | set(self.usage) | set(self.warming)
+            warming = set(self.warming)
+            last_warmed = dict(self.last_warmed)
+
+        models = []
+        for name in sorted(names):
+            resident = loaded.get(name)
+            models.append({
+                "name": name,
+                "loaded": resident is not None,
+                "warming": name in warming,
+                "size_vram": resident.get('size_vram') if resident else None,
+                "expires_at": resident.get('expires_at') if resident else None,
+                "usage_score": round(self.score(name), 2),
+                "keep_alive": self.keep_alive_for(name),
+                "last_warm_up": last_warmed.get(name),
+            })
+        return {"models": models}
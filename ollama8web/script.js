@@ -53,6 +53,7 @@ const contextWindowSelect = document.getElementById('context-window');
 let currentModel = null;
 let chatHistory = [];
 let isDarkTheme = false;
+let proxyAvailable = false; // true when served by main.py, which adds streaming endpoints
 
 // Voice Mode State
 let mediaRecorder = null;
@@ -64,6 +65,7 @@ let voiceCloneId = null;
 
 // Initialize the application
 async function init() {
+    await detectProxy();
     await loadModels();
     setupEventListeners();
     checkThemePreference();
@@ -73,6 +75,16 @@ async function init() {
     createModelContent.classList.remove('active');
 }
 
+// Check whether the page is served by the Python proxy (main.py)
+async function detectProxy() {
+    try {
+        const response = await fetch('/api/proxy/stats');
+        proxyAvailable = response.ok;
+    } catch (error) {
+        proxyAvailable = false;
+    }
+}
+
 // Toggle collapsible section
 function toggleCollapsible(header, content) {
     header.classList.toggle('active');
@@ -148,6 +160,7 @@ function selectModel(model) {
     }
 
     currentModel = model.name;
+    warmModel(model.name);
     currentModelSpan.textContent = model.name;
     modelSizeSpan.textContent = formatSize(model.size);
     modelModifiedSpan.textContent = formatDate(model.modified_at);
@@ -164,6 +177,18 @@ function selectModel(model) {
     addWelcomeMessage(`✨ I'm ${model.name} 🧠 - Ready to assist you today! How can I help? ✨`);
 }
 
+// Have the proxy load the model now, so the first prompt does not wait for it
+function warmModel(modelName) {
+    if (!proxyAvailable) return;
+    fetch('/api/warm', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ model: modelName })
+    }).catch(error => console.warn('Could not warm up model:', error));
+}
+
 // Create a custom model
 async function createCustomModel(event) {
     event.preventDefault();
@@ -188,8 +213,13 @@ async function createCustomModel(event) {
     modelfileContent += `PARAMETER top_k ${topK}\n`;
     modelfileContent += `PARAMETER num_ctx ${contextWindow}\n`;
 
+    const submitButton = createModelForm.querySelector('button[type="submit"]');
+    const submitLabel = submitButton.textContent;
+    submitButton.disabled = true;
+
     try {
-        const createResponse = await fetch(API_ENDPOINTS.CREATE_MODEL, {
+        // Through the proxy, identical builds are deduplicated and run as one background job
+        const createResponse = await fetch(proxyAvailable ? '/api/create' : API_ENDPOINTS.CREATE_MODEL, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -205,11 +235,50 @@ async function createCustomModel(event) {
             throw new Error(errorData.error || `HTTP error! Status: ${createResponse.status}`);
         }
 
-        alert(`Model "${modelName}" created successfully!`);
+        // Progress arrives one JSON object per line; identical builds finish at once
+        const lastStatus = await readBuildProgress(createResponse, status => {
+            submitButton.textContent = status.status;
+        });
+        if (lastStatus.error) {
+            throw new Error(lastStatus.error);
+        }
+
+        const note = lastStatus.deduplicated === 'copied' ? ` (copied from identical model "${lastStatus.source}")`
+            : lastStatus.deduplicated === 'unchanged' ? ' (already up to date)' : '';
+        alert(`Model "${modelName}" created successfully!${note}`);
         await loadModels(); // Refresh models list
     } catch (error) {
         console.error('Error creating model:', error);
         alert(`Error creating model: ${error.message}`);
+    } finally {
+        submitButton.disabled = false;
+        submitButton.textContent = submitLabel;
+    }
+}
+
+// Read a streamed create response, calling onStatus for each line; returns the last one
+async function readBuildProgress(response, onStatus) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let lastStatus = {};
+
+    while (true) {
+        const { value, done } = await reader.read();
+        buffer += done ? '' : decoder.decode(value, { stream: true });
+
+        const lines = buffer.split('\n');
+        buffer = done ? '' : lines.pop();
+        lines.filter(line => line.trim()).forEach(line => {
+            lastStatus = JSON.parse(line);
+            if (lastStatus.status) {
+                onStatus(lastStatus);
+            }
+        });
+
+        if (done) {
+            return lastStatus;
+        }
     }
 }
 
@@ -227,6 +296,15 @@ async function sendMessage() {
     const topP = parseFloat(topPSlider.value);
     const topK = parseInt(topKSlider.value);
 
+    if (proxyAvailable) {
+        await streamMessage(message, {
+            temperature: temperature,
+            top_p: topP,
+            top_k: topK
+        });
+        return;
+    }
+
     try {
         // Add loading indicator
         const loadingId = addLoadingMessage();
@@ -267,6 +345,229 @@ async function sendMessage() {
     }
 }
 
+// Stream a reply as Server-Sent Events, resuming with Last-Event-ID if the connection drops
+async function streamMessage(message, options) {
+    const view = createStreamingMessage();
+    // With voice replies on, /api/speak interleaves each sentence's audio with the text
+    let speak = voiceResponsesEnabled.checked && hasVoiceClone;
+    const speech = createSpeechQueue();
+    let spoken = false;
+    let answer = '';
+    let thinking = '';
+    let streamId = null;
+    let lastEventId = 0;
+    let finished = false;
+    let serverError = null;
+
+    const onEvent = (id, event, data) => {
+        lastEventId = id;
+        if (event === 'start') {
+            streamId = data.stream_id;
+        } else if (event === 'think') {
+            thinking += data.text;
+            view.thinkingDetails.style.display = 'block';
+            view.thinkingContent.textContent = thinking;
+        } else if (event === 'answer') {
+            answer += data.text;
+            view.messageText.textContent = answer.trimStart();
+        } else if (event === 'audio') {
+            if (data.audio) {
+                spoken = true;
+                speech.add(data.audio);
+            }
+        } else if (event === 'done') {
+            finished = true;
+        } else if (event === 'error' || event === 'reset') {
+            serverError = data.error;
+        }
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+    };
+
+    try {
+        const request = {
+            model: currentModel,
+            prompt: message,
+            options: options
+        };
+        let response = await fetch(speak ? '/api/speak' : '/api/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(speak ? { ...request, voice_id: voiceCloneId || 'user_voice' } : request)
+        });
+        if (speak && response.status === 503) {
+            // No TTS on the server; stream the text alone
+            speak = false;
+            response = await fetch('/api/stream', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify(request)
+            });
+        }
+
+        for (let attempt = 0; ; attempt++) {
+            try {
+                if (!response.ok) {
+                    throw new Error(`HTTP error! Status: ${response.status}`);
+                }
+                await readEventStream(response, onEvent);
+            } catch (error) {
+                if (!streamId || attempt >= 3) {
+                    throw error;
+                }
+            }
+
+            if (finished || serverError) {
+                break;
+            }
+            if (!streamId || attempt >= 3) {
+                throw new Error('Stream ended unexpectedly');
+            }
+            response = await fetch(`/api/stream/${streamId}`, {
+                headers: { 'Last-Event-ID': String(lastEventId) }
+            });
+        }
+
+        if (serverError) {
+            throw new Error(serverError);
+        }
+
+        answer = answer.trim();
+        view.messageText.textContent = answer;
+        finishStreamingMessage(view, answer, spoken);
+
+        // Update chat history
+        chatHistory.push({ role: 'user', content: message });
+        chatHistory.push({ role: 'assistant', content: answer });
+    } catch (error) {
+        console.error('Error streaming message:', error);
+        if (!answer) {
+            view.messageDiv.remove();
+        }
+        addErrorMessage(`Error: ${error.message}`);
+    }
+}
+
+// Read an SSE response body, calling onEvent(id, event, data) for each event
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            return;
+        }
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let id = null;
+            let event = 'message';
+            const dataLines = [];
+            block.split('\n').forEach(line => {
+                if (line.startsWith('id: ')) id = parseInt(line.slice(4));
+                else if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) dataLines.push(line.slice(6));
+            });
+
+            if (id !== null && dataLines.length > 0) {
+                onEvent(id, event, JSON.parse(dataLines.join('\n')));
+            }
+        }
+    }
+}
+
+// Create an empty AI message that fills in as a stream arrives
+function createStreamingMessage() {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message ai-message';
+
+    const thinkingDetails = document.createElement('details');
+    thinkingDetails.className = 'thinking-details';
+    thinkingDetails.style.display = 'none';
+    thinkingDetails.innerHTML = '<summary>Thinking</summary><div class="thinking-content"></div>';
+
+    const messageText = document.createElement('div');
+    messageText.className = 'message-text loading';
+    messageText.textContent = 'Thinking...';
+
+    messageDiv.appendChild(thinkingDetails);
+    messageDiv.appendChild(messageText);
+    chatContainer.appendChild(messageDiv);
+    chatContainer.scrollTop = chatContainer.scrollHeight;
+
+    return {
+        messageDiv: messageDiv,
+        messageText: messageText,
+        thinkingDetails: thinkingDetails,
+        thinkingContent: thinkingDetails.querySelector('.thinking-content')
+    };
+}
+
+// Play streamed audio segments one after another, in the order they arrive
+function createSpeechQueue() {
+    const segments = [];
+    let playing = false;
+
+    const playNext = () => {
+        const segment = segments.shift();
+        if (!segment) {
+            playing = false;
+            return;
+        }
+        playing = true;
+        const audio = new Audio(`data:audio/wav;base64,${segment}`);
+        audio.addEventListener('ended', playNext);
+        audio.addEventListener('error', playNext);
+        audio.play().catch(e => {
+            console.log('Auto-play prevented by browser:', e);
+            segments.length = 0;
+            playing = false;
+        });
+    };
+
+    return {
+        add(segment) {
+            segments.push(segment);
+            if (!playing) {
+                playNext();
+            }
+        }
+    };
+}
+
+// Add audio controls to a finished streamed message
+function finishStreamingMessage(view, answer, spoken) {
+    view.messageText.classList.remove('loading');
+
+    const audioControls = document.createElement('div');
+    audioControls.className = 'audio-controls';
+    audioControls.style.cssText = 'margin-top: 10px; display: none;';
+    audioControls.innerHTML = `
+        <button class="play-audio-btn">🔊 Play Audio</button>
+        <audio class="message-audio" controls style="display: none; width: 100%; margin-top: 5px;"></audio>
+    `;
+    audioControls.querySelector('.play-audio-btn').addEventListener('click', (e) => {
+        playMessageAudio(e.currentTarget, answer);
+    });
+    view.messageDiv.appendChild(audioControls);
+
+    if (spoken) {
+        // Already played sentence by sentence; Play Audio synthesizes the whole reply again
+        audioControls.style.display = 'block';
+    } else if (voiceResponsesEnabled.checked && hasVoiceClone) {
+        generateAudioForMessage(answer, view.messageDiv);
+    }
+}
+
 // Add a user message to the chat
 function addUserMessage(message) {
     const messageDiv = document.createElement('div');
@@ -0,0 +1,126 @@
+"""
+Pre-fork Supervisor for Ollama8Web
+Runs several worker processes that each accept connections on the same port via SO_REUSEPORT
+"""
+
+import os
+import time
+import signal
+import socket
+import logging
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+RESPAWN_BACKOFF = 1.0  # seconds before replacing a worker that died straight after starting
+STOP_TIMEOUT = 35.0  # seconds to wait for workers to drain before killing them
+
+
+def can_prefork() -> bool:
+    """Pre-forking needs fork() and SO_REUSEPORT, so it is unavailable on Windows"""
+    return hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')
+
+
+class PreforkSupervisor:
+    """Keeps `workers` child processes running `serve_worker`
+
+    SIGHUP starts a fresh set of workers and then asks the old ones to drain
+    and exit, so a restart never leaves the port without a listener.
+    SIGTERM or SIGINT drains every worker and stops.
+    """
+
+    def __init__(self, serve_worker: Callable[[], None], workers: int):
+        self.serve_worker = serve_worker
+        self.workers = workers
+        self.children: Dict[int, float] = {}  # pid -> start time
+        self.stopping = False
+        self.restart_requested = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGHUP, self._request_restart)
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        while not self.stopping:
+            if self.restart_requested:
+                self.restart_requested = False
+                self._restart()
+            self._reap(respawn=True)
+            time.sleep(0.2)
+
+        self._stop_all()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            # Ctrl+C reaches the whole process group; let the supervisor decide
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                self.serve_worker()
+            except Exception as e:
+                logger.error(f"Worker {os.getpid()} crashed: {e}")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        self.children[pid] = time.monotonic()
+        logger.info(f"Started worker {pid}")
+
+    def _reap(self, respawn: bool):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+
+            started = self.children.pop(pid, None)
+            if started is None or not respawn:
+                continue
+
+            logger.warning(f"Worker {pid} exited with status {status}, starting a replacement")
+            if time.monotonic() - started < RESPAWN_BACKOFF:
+                time.sleep(RESPAWN_BACKOFF)
+            self._spawn()
+
+    def _restart(self):
+        old_children = list(self.children)
+        for _ in range(self.workers):
+            self._spawn()
+        for pid in old_children:
+            self.children.pop(pid, None)
+            self._signal(pid, signal.SIGTERM)
+        logger.info(f"Restarted {self.workers} workers")
+
+    def _stop_all(self):
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + STOP_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            self._reap(respawn=False)
+            time.sleep(0.1)
+
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGKILL)
+        self._reap(respawn=False)
+
+    def _signal(self, pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _request_stop(self, signum, frame):
+        self.stopping = True
+
+    def _request_restart(self, signum, frame):
+        self.restart_requested = True
@@ -0,0 +1,191 @@
+"""
+Pull Manager for Ollama8Web
+Runs one upstream /api/pull per model tag and fans its progress out to every client watching it
+"""
+
+import json
+import time
+import logging
+import threading
+import http.client
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any, List, Callable
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_model_tag(name: str) -> str:
+    """Return the canonical form of a model name so equal pulls share a job"""
+    name = name.strip().lower()
+    if ':' not in name.rsplit('/', 1)[-1]:
+        name += ':latest'
+    return name
+
+
+def upstream_error(answer: bytes, status: int) -> str:
+    """The message of an error answer from Ollama, which is JSON like {"error": "..."} unless something in between sent text"""
+    try:
+        error = json.loads(answer).get('error')
+    except (ValueError, AttributeError):
+        error = None
+    return str(error or answer.decode('utf-8', 'replace').strip() or f"HTTP {status}")
+
+
+class PullJob:
+    """A single upstream pull and the progress history shared by its subscribers"""
+
+    def __init__(self, model: str, request: Dict[str, Any]):
+        self.model = model
+        self.request = request
+        self.started_at = time.time()
+        self.finished_at = None
+        self.done = False
+        self.subscribers = 0
+        # Each entry is [status_key, line, seq]. Progress updates for the same
+        # status replace the previous entry, so the history only grows by phase.
+        self.entries: List[list] = []
+        self.seq = 0
+        self.condition = threading.Condition()
+
+    def publish(self, line: bytes):
+        """Record a progress line and wake up every subscriber"""
+        try:
+            status = json.loads(line)
+        except ValueError:
+            status = {}
+        key = (status.get('status'), status.get('digest'), 'error' in status)
+
+        with self.condition:
+            self.seq += 1
+            if self.entries and self.entries[-1][0] == key:
+                self.entries[-1][1:] = [line, self.seq]
+            else:
+                self.entries.append([key, line, self.seq])
+            self.condition.notify_all()
+
+    def finish(self):
+        with self.condition:
+            self.done = True
+            self.finished_at = time.time()
+            self.condition.notify_all()
+
+    def latest_status(self) -> Optional[Dict[str, Any]]:
+        with self.condition:
+            if not self.entries:
+                return None
+            line = self.entries[-1][1]
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def follow(self, timeout: float = 1.0):
+        """Yield progress lines, starting from the latest one, until the pull ends"""
+        with self.condition:
+            self.subscribers += 1
+            # Late joiners start with the current status rather than the full history
+            cursor = self.entries[-1][2] - 1 if self.entries else 0
+
+        try:
+            while True:
+                with self.condition:
+                    while self.seq <= cursor and not self.done:
+                        self.condition.wait(timeout)
+                    pending = [entry[1] for entry in self.entries if entry[2] > cursor]
+                    cursor = self.seq
+                    done = self.done
+
+                for line in pending:
+                    yield line
+                if done:
+                    return
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+
+class PullManager:
+    """Deduplicates /api/pull so each model tag is downloaded by at most one upstream stream"""
+
+    def __init__(self, ollama_api: str, timeout: Optional[float] = None,
+                 on_finish: Optional[Callable[[PullJob], None]] = None):
+        self.ollama_api = urlparse(ollama_api)
+        self.timeout = timeout  # for connecting and for each read, so a stalled download ends with an error
+        self.on_finish = on_finish  # called with each job once it ends, before its subscribers hear so
+        self.jobs: Dict[str, PullJob] = {}
+        self.lock = threading.Lock()
+
+    def start(self, request: Dict[str, Any]) -> PullJob:
+        """Return the running pull for the requested model, starting one if needed"""
+        name = request.get('model') or request.get('name')
+        if not name:
+            raise ValueError("Missing model name")
+        model = normalize_model_tag(name)
+
+        with self.lock:
+            job = self.jobs.get(model)
+            if job is not None:
+                return job
+
+            job = PullJob(model, request)
+            self.jobs[model] = job
+
+        thread = threading.Thread(target=self._run, args=(job,), daemon=True)
+        thread.start()
+        return job
+
+    def _run(self, job: PullJob):
+        """Stream the upstream pull into the job until Ollama finishes"""
+        body = dict(job.request, stream=True)
+        connection = http.client.HTTPConnection(self.ollama_api.hostname, self.ollama_api.port, timeout=self.timeout)
+        try:
+            connection.request(
+                'POST',
+                f"{self.ollama_api.path}/pull",
+                body=json.dumps(body).encode('utf-8'),
+                headers={'Content-Type': 'application/json'}
+            )
+            response = connection.getresponse()
+            if response.status != 200:
+                error = upstream_error(response.read(), response.status)
+                job.publish(json.dumps({"error": error}).encode('utf-8'))
+                return
+
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                if line.strip():
+                    job.publish(line.rstrip(b'\n'))
+
+        except (OSError, http.client.HTTPException) as e:
+            logger.error(f"Pull of {job.model} failed: {e}")
+            job.publish(json.dumps({"error": f"Error connecting to Ollama API: {e}"}).encode('utf-8'))
+
+        finally:
+            connection.close()
+            with self.lock:
+                self.jobs.pop(job.model, None)
+            if self.on_finish is not None:
+                self.on_finish(job)
+            job.finish()
+
+    def get_status(self) -> List[Dict[str, Any]]:
+        """Summarize every active pull"""
+        with self.lock:
+            jobs = list(self.jobs.values())
+
+        pulls = []
+        for job in jobs:
+            latest = job.latest_status() or {}
+            pulls.append({
+                "model": job.model,
+                "subscribers": job.subscribers,
+                "started_at": job.started_at,
+                "status": latest.get('status'),
+                "digest": latest.get('digest'),
+                "completed": latest.get('completed'),
+                "total": latest.get('total'),
+                "error": latest.get('error'),
+            })
+        return pulls
@@ -0,0 +1,263 @@
+"""
+Rate Limiter for Ollama8Web
+Per-client token budgets over a sliding window, charged with the tokens Ollama actually processed
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import itertools
+import threading
+from collections import Counter
+from typing import Optional, Dict
+
+from shared_store import MemoryStore
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 60.0  # seconds the budget applies to
+MAINTENANCE_INTERVAL = 10.0  # seconds between sweeping idle clients (and saving, when persisted)
+QUEUE_TIMEOUT = 120.0  # longest a request waits for a generation slot
+
+
+def key_digest(key: str) -> str:
+    # Keys are only compared and may end up in a state file, so keep a digest
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def load_api_keys(path: str) -> frozenset:
+    """Digests of the API keys in `path`, one per line; blank lines and # comments are skipped"""
+    with open(path, encoding='utf-8') as f:
+        return frozenset(key_digest(line.strip()) for line in f if line.strip() and not line.lstrip().startswith('#'))
+
+
+def client_key(headers, address: str, api_keys: frozenset = frozenset()) -> str:
+    """Who a request is charged to: its API key if that is one of `api_keys` (digests), otherwise its IP address
+
+    Any other key is ignored, so a client cannot get a fresh budget by sending a made-up one.
+    """
+    authorization = headers.get('Authorization', '')
+    if authorization.lower().startswith('bearer '):
+        key = authorization[7:].strip()
+    else:
+        key = headers.get('X-API-Key', '').strip()
+    digest = key_digest(key) if key else None
+    if digest in api_keys:
+        return 'key:' + digest
+    return 'ip:' + address
+
+
+class TokenBudget:
+    """How many prompt plus generated tokens each client used in the last `window` seconds
+
+    Usage is kept as two fixed windows per client: the current one in full,
+    plus the previous one weighted by how much of it the sliding window still
+    covers. That is two counters per client, so it is cheap enough to consult
+    on every generation. The counters live in a store (see shared_store.py),
+    so pre-forked workers given the shared SQLite store enforce one budget
+    together rather than one each.
+    """
+
+    def __init__(self, limit: int = 0, window: float = WINDOW, path: Optional[str] = None, store=None):
+        self.limit = limit
+        self.window = window
+        self.path = path
+        self.store = store if store is not None else MemoryStore()
+        self.lock = threading.Lock()
+        self.dirty = False
+        if path:
+            self.load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def _position(self, now: Optional[float] = None):
+        index, fraction = divmod((time.time() if now is None else now) / self.window, 1)
+        return int(index), fraction
+
+    @staticmethod
+    def _counter(client: str, index: int) -> str:
+        return f"budget:{client}:{index}"
+
+    def _windows(self) -> Dict[str, Dict[int, int]]:
+        """Every client's window totals: client -> {window index: tokens}"""
+        windows: Dict[str, Dict[int, int]] = {}
+        for name, tokens in self.store.get_counters('budget:').items():
+            client, _, index = name[len('budget:'):].rpartition(':')
+            windows.setdefault(client, {})[int(index)] = tokens
+        return windows
+
+    def _counts(self, client: str, index: int):
+        """(current, previous) window totals for `client`, as seen from window `index`"""
+        counters = self.store.get_counters(f"budget:{client}:")
+        return (
+            float(counters.get(self._counter(client, index), 0)),
+            float(counters.get(self._counter(client, index - 1), 0))
+        )
+
+    def usage(self, client: str) -> float:
+        index, fraction = self._position()
+        current, previous = self._counts(client, index)
+        return current + previous * (1 - fraction)
+
+    def remaining(self, client: str) -> int:
+        return max(0, int(self.limit - self.usage(client)))
+
+    def retry_after(self, client: str) -> float:
+        """Seconds until the client is under its budget again"""
+        index, fraction = self._position()
+        current, previous = self._counts(client, index)
+        if current + previous * (1 - fraction) < self.limit:
+            return 0.0
+        if current < self.limit:
+            # The previous window has to fade until the total drops below the limit
+            return ((1 - (self.limit - current) / previous) - fraction) * self.window
+        # This window is spent on its own; it fades from the start of the next one
+        return (1 - fraction + 1 - self.limit / current) * self.window
+
+    def reset_after(self, client: str) -> float:
+        """Seconds until everything the client used has left the window"""
+        index, fraction = self._position()
+        current, previous = self._counts(client, index)
+        if current:
+            return (2 - fraction) * self.window
+        if previous:
+            return (1 - fraction) * self.window
+        return 0.0
+
+    def charge(self, client: str, tokens: int):
+        if tokens <= 0:
+            return
+        index, _ = self._position()
+        self.store.incr(self._counter(client, index), int(tokens))
+        with self.lock:
+            self.dirty = True
+
+    def sweep(self):
+        """Forget windows that have left the sliding window"""
+        index, _ = self._position()
+        self.store.delete_counters([
+            self._counter(client, window)
+            for client, windows in self._windows().items() for window in windows if window < index - 1
+        ])
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable rate limit state {self.path}: {e}")
+            return
+        if state.get("window") != self.window:
+            # Window indexes from another window length mean nothing here
+            return
+        for client, (index, current, previous) in state.get("clients", {}).items():
+            for window, tokens in ((index, current), (index - 1, previous)):
+                if tokens:
+                    self.store.incr(self._counter(client, window), int(tokens))
+        self.sweep()
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+        clients = {}
+        for client, windows in self._windows().items():
+            index = max(windows)
+            clients[client] = [index, windows[index], windows.get(index - 1, 0)]
+        data = json.dumps({"window": self.window, "clients": clients})
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(data)
+        os.replace(temp_path, self.path)
+
+    def start(self):
+        """Sweep (and save, when persisted) in a daemon thread; call after forking"""
+        threading.Thread(target=self._maintain, daemon=True).start()
+
+    def _maintain(self):
+        while True:
+            time.sleep(MAINTENANCE_INTERVAL)
+            self.sweep()
+            if self.path:
+                try:
+                    self.save()
+                except OSError as e:
+                    logger.warning(f"Could not save rate limit state to {self.path}: {e}")
+
+    def get_status(self) -> Dict[str, Dict[str, float]]:
+        return {
+            client: {"used": round(self.usage(client)), "remaining": self.remaining(client)}
+            for client in self._windows()
+        }
+
+
+class FairScheduler:
+    """Hands out a fixed number of generation slots, fairest client first
+
+    Ollama serves queued requests in arrival order, so one client firing many
+    requests at once pushes everyone else back. While every slot is busy,
+    requests wait here instead, and a freed slot goes to the waiting client
+    with the fewest requests running, then the fewest tokens used in the
+    window, then whoever has waited longest.
+    """
+
+    def __init__(self, slots: int, budget: TokenBudget):
+        self.slots = slots
+        self.budget = budget
+        self.busy = 0
+        self.running = Counter()
+        self.waiting = []  # [arrival number, client]
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def acquire(self, client: str, timeout: float = QUEUE_TIMEOUT) -> bool:
+        """Wait for a slot; False if none came free within `timeout` seconds"""
+        with self.condition:
+            if self.busy < self.slots and not self.waiting:
+                self._take(client)
+                return True
+
+            ticket = [next(self.sequence), client]
+            self.waiting.append(ticket)
+            deadline = time.monotonic() + timeout
+            try:
+                while True:
+                    if self.busy < self.slots and self._next() is ticket:
+                        self._take(client)
+                        return True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting.remove(ticket)
+                # Whoever is next may have been waiting on this ticket
+                self.condition.notify_all()
+
+    def release(self, client: str):
+        with self.condition:
+            self.busy -= 1
+            self.running[client] -= 1
+            if not self.running[client]:
+                del self.running[client]
+            self.condition.notify_all()
+
+    def _take(self, client: str):
+        self.busy += 1
+        self.running[client] += 1
+
+    def _next(self):
+        return min(self.waiting, key=lambda ticket: (
+            self.running[ticket[1]], self.budget.usage(ticket[1]), ticket[0]
+        ))
+
+    def get_status(self) -> Dict[str, int]:
+        with self.condition:
+            return {"slots": self.slots, "busy": self.busy, "waiting": len(self.waiting)}
@@ -0,0 +1,154 @@
+"""
+Shared Store for Ollama8Web
+Small key/value cache and counters, either in process memory or in a SQLite file shared by worker processes
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from typing import Optional, Dict
+
+
+class MemoryStore:
+    """Store for the default single-process server"""
+
+    shared = False
+
+    def __init__(self):
+        self.values: Dict[str, tuple] = {}
+        self.counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self.values[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        expires = time.time() + ttl if ttl is not None else None
+        with self.lock:
+            self.values[key] = (value, expires)
+
+    def get_prefix(self, prefix: str) -> Dict[str, bytes]:
+        now = time.time()
+        with self.lock:
+            return {
+                key: value for key, (value, expires) in self.values.items()
+                if key.startswith(prefix) and (expires is None or expires >= now)
+            }
+
+    def delete_prefix(self, prefix: str):
+        with self.lock:
+            for key in [key for key in self.values if key.startswith(prefix)]:
+                del self.values[key]
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+            return self.counters[name]
+
+    def get_counters(self, prefix: str = '') -> Dict[str, int]:
+        with self.lock:
+            return {name: value for name, value in self.counters.items() if name.startswith(prefix)}
+
+    def delete_counters(self, names):
+        with self.lock:
+            for name in names:
+                self.counters.pop(name, None)
+
+
+class SQLiteStore:
+    """Store backed by a local SQLite file so pre-forked workers see the same state
+
+    Each thread gets its own connection, and a forked child never reuses its
+    parent's. WAL mode lets readers in every worker proceed while one writes.
+    """
+
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        connection = self._connection()
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires REAL
+            );
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        ''')
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._connection().execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires >= ?)',
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        expires = time.time() + ttl if ttl is not None else None
+        self._connection().execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, value, expires)
+        )
+
+    def get_prefix(self, prefix: str) -> Dict[str, bytes]:
+        rows = self._connection().execute(
+            'SELECT key, value FROM cache WHERE substr(key, 1, ?) = ? AND (expires IS NULL OR expires >= ?)',
+            (len(prefix), prefix, time.time())
+        ).fetchall()
+        return dict(rows)
+
+    def delete_prefix(self, prefix: str):
+        connection = self._connection()
+        connection.execute(
+            "DELETE FROM cache WHERE substr(key, 1, ?) = ? OR expires < ?",
+            (len(prefix), prefix, time.time())
+        )
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'INSERT INTO counters (name, value) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                (name, amount)
+            )
+            value = connection.execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()[0]
+            connection.execute('COMMIT')
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+        return value
+
+    def get_counters(self, prefix: str = '') -> Dict[str, int]:
+        rows = self._connection().execute(
+            'SELECT name, value FROM counters WHERE substr(name, 1, ?) = ?',
+            (len(prefix), prefix)
+        ).fetchall()
+        return dict(rows)
+
+    def delete_counters(self, names):
+        self._connection().executemany('DELETE FROM counters WHERE name = ?', [(name,) for name in names])
@@ -0,0 +1,119 @@
+"""
+Speech Pipeline for Ollama8Web
+Cuts a streamed answer into sentences and synthesizes each one while the rest is still being generated
+"""
+
+import re
+import time
+import queue
+import logging
+import threading
+from typing import Optional, List, Callable
+
+logger = logging.getLogger(__name__)
+
+MIN_SENTENCE_CHARS = 20  # shorter sentences are joined to the next, so each synthesis says something
+MAX_SENTENCE_CHARS = 400  # text without a sentence end is cut at a space once it gets this long
+
+# End punctuation (plus closing quotes or brackets) followed by whitespace, or a line break
+SENTENCE_END = re.compile(r'[.!?…]+["\')\]]*\s+|\n+')
+MARKDOWN = re.compile(r'[*_#`>|~]+')
+
+
+def speakable(sentence: str) -> str:
+    """The sentence without Markdown markup, or '' if nothing in it can be spoken"""
+    text = ' '.join(MARKDOWN.sub(' ', sentence).split())
+    return text if any(character.isalnum() for character in text) else ''
+
+
+class SentenceSplitter:
+    """Turn streamed text into complete sentences
+
+    A sentence is only cut once the whitespace after its end has arrived,
+    so "3.14" split across tokens as "3." + "14" is not cut in two.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+
+    def feed(self, text: str) -> List[str]:
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self.buffer):
+            if match.end() - start >= MIN_SENTENCE_CHARS:
+                sentences.append(self.buffer[start:match.end()])
+                start = match.end()
+        self.buffer = self.buffer[start:]
+
+        while len(self.buffer) > MAX_SENTENCE_CHARS:
+            cut = self.buffer.rfind(' ', 0, MAX_SENTENCE_CHARS) + 1 or MAX_SENTENCE_CHARS
+            sentences.append(self.buffer[:cut])
+            self.buffer = self.buffer[cut:]
+        return [sentence for sentence in map(speakable, sentences) if sentence]
+
+    def flush(self) -> List[str]:
+        sentence = speakable(self.buffer)
+        self.buffer = ''
+        return [sentence] if sentence else []
+
+
+class SentenceSpeaker:
+    """Synthesizes a stream's answer one sentence at a time, in order, on its own thread
+
+    Each finished sentence becomes an 'audio' event on the stream, right
+    after the text it was made from, so speech can start while later
+    sentences are still being generated.
+    """
+
+    def __init__(self, stream, synthesize: Callable[[str], Optional[str]],
+                 on_synthesized: Optional[Callable[[float], None]] = None):
+        self.stream = stream
+        self.synthesize = synthesize  # sentence -> base64 WAV, or None if synthesis failed
+        self.on_synthesized = on_synthesized  # called with the seconds each sentence took
+        self.splitter = SentenceSplitter()
+        self.sentences = queue.Queue()
+        self.cancelled = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def feed(self, text: str):
+        for sentence in self.splitter.feed(text):
+            self.sentences.put(sentence)
+
+    def close(self, timeout: Optional[float] = None):
+        """Speak what is left of the answer and wait until every sentence has been sent"""
+        for sentence in self.splitter.flush():
+            self.sentences.put(sentence)
+        self.sentences.put(None)
+        self.thread.join(timeout)
+
+    def cancel(self):
+        """Drop the sentences not yet synthesized"""
+        self.cancelled = True
+        self.sentences.put(None)
+
+    def _run(self):
+        index = 0
+        while True:
+            sentence = self.sentences.get()
+            if sentence is None or self.cancelled or self.stream.abort_reason is not None:
+                return
+
+            started = time.perf_counter()
+            try:
+                audio = self.synthesize(sentence)
+            except Exception as e:
+                logger.error(f"Synthesis failed for stream {self.stream.stream_id}: {e}")
+                audio = None
+            elapsed = time.perf_counter() - started
+            if self.on_synthesized is not None:
+                self.on_synthesized(elapsed)
+
+            event = {"index": index, "text": sentence, "synthesis_ms": round(elapsed * 1000, 1)}
+            if audio:
+                event.update(audio=audio, format="wav")
+            else:
+                event["error"] = "TTS generation failed"
+            self.stream.add_event('audio', event)
+            index += 1
@@ -0,0 +1,422 @@
+"""
+Stream Manager for Ollama8Web
+Turns Ollama's per-token NDJSON into coalesced Server-Sent Events frames that can be resumed
+"""
+
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+import http.client
+from collections import deque
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any, List, Tuple, Iterator, Callable
+
+from speech_pipeline import SentenceSpeaker
+
+logger = logging.getLogger(__name__)
+
+# Defaults for cutting frames; either limit triggers a flush
+FLUSH_INTERVAL = 0.05  # seconds
+FLUSH_BYTES = 1024
+MIN_FLUSH_INTERVAL = 0.01  # shorter intervals would only make followers wake up and find nothing new
+RING_SIZE = 512  # frames kept per stream for Last-Event-ID resume
+HEARTBEAT_INTERVAL = 15.0
+ORPHAN_GRACE = 30.0  # seconds a stream keeps generating with nobody listening
+RETENTION = 60.0  # seconds a finished stream stays available for resume
+CANCEL_POLL_INTERVAL = 0.5  # seconds between checks for a cancel sent to another worker
+
+
+class ThinkSplitter:
+    """Split streamed text into ('think', ...) and ('answer', ...) parts
+
+    Tags may arrive split across tokens ("<th" + "ink>"), so a trailing
+    fragment that could still become a tag is held back until the next feed.
+    """
+
+    OPEN_TAG = '<think>'
+    CLOSE_TAG = '</think>'
+
+    def __init__(self):
+        self.in_think = False
+        self.buffer = ''
+
+    @property
+    def kind(self) -> str:
+        return 'think' if self.in_think else 'answer'
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        self.buffer += text
+        parts = []
+        while True:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            index = self.buffer.find(tag)
+            if index >= 0:
+                if index:
+                    parts.append((self.kind, self.buffer[:index]))
+                self.buffer = self.buffer[index + len(tag):]
+                self.in_think = not self.in_think
+                continue
+
+            keep = 0
+            for size in range(min(len(tag) - 1, len(self.buffer)), 0, -1):
+                if tag.startswith(self.buffer[-size:]):
+                    keep = size
+                    break
+            ready = self.buffer[:len(self.buffer) - keep]
+            if ready:
+                parts.append((self.kind, ready))
+            self.buffer = self.buffer[len(ready):]
+            return parts
+
+    def flush(self) -> List[Tuple[str, str]]:
+        parts = [(self.kind, self.buffer)] if self.buffer else []
+        self.buffer = ''
+        return parts
+
+
+def format_event(event_id: int, event: str, data: Dict[str, Any]) -> bytes:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8')
+
+
+class TokenStream:
+    """One generation, its pending text and a ring buffer of finished frames"""
+
+    def __init__(self, stream_id: str, flush_interval: float, flush_bytes: int):
+        self.stream_id = stream_id
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.frames = deque(maxlen=RING_SIZE)  # (id, bytes)
+        self.next_id = 1
+        self.pending_kind = None
+        self.pending_text = []
+        self.pending_size = 0
+        self.pending_since = 0.0
+        self.tokens = 0
+        self.text = []  # the raw response text, <think> blocks included
+        self.stats = None  # Ollama's final statistics, once it sends them
+        self.error = None
+        self.error_status = None  # Ollama's HTTP status, when it refused the generation
+        self.speaker = None  # a SentenceSpeaker when the answer is also spoken
+        self.done = False
+        self.finished_at = None
+        self.subscribers = 0
+        self.orphaned_at = time.time()
+        self.connection = None
+        self.abort_reason = None
+        self.condition = threading.Condition()
+
+    # Producer side
+
+    def add_text(self, kind: str, text: str):
+        with self.condition:
+            if self.pending_kind not in (None, kind):
+                self._cut_frame()
+            if not self.pending_text:
+                self.pending_since = time.monotonic()
+            self.pending_kind = kind
+            self.pending_text.append(text)
+            self.pending_size += len(text)
+            if self.pending_size >= self.flush_bytes:
+                self._cut_frame()
+            else:
+                self._cut_frame_if_due()
+
+    def add_event(self, event: str, data: Dict[str, Any]):
+        with self.condition:
+            self._cut_frame()
+            self._append(event, data)
+
+    def finish(self, event: str, data: Dict[str, Any]):
+        with self.condition:
+            self._cut_frame()
+            self._append(event, data)
+            if event == 'error':
+                self.error = data.get('error')
+                self.error_status = data.get('status')
+            self.done = True
+            self.finished_at = time.time()
+            self.condition.notify_all()
+
+    def _append(self, event: str, data: Dict[str, Any]):
+        self.frames.append((self.next_id, format_event(self.next_id, event, data)))
+        self.next_id += 1
+        self.condition.notify_all()
+
+    def _cut_frame(self):
+        if not self.pending_text:
+            return
+        text = ''.join(self.pending_text)
+        self.pending_text = []
+        self.pending_size = 0
+        self._append(self.pending_kind, {"text": text})
+
+    def _cut_frame_if_due(self):
+        if self.pending_text and time.monotonic() - self.pending_since >= self.flush_interval:
+            self._cut_frame()
+
+    # Consumer side
+
+    def follow(self, last_event_id: int = 0) -> Iterator[bytes]:
+        """Yield batches of SSE bytes after `last_event_id` until the stream ends"""
+        with self.condition:
+            self.subscribers += 1
+            self.orphaned_at = None
+
+        cursor = last_event_id
+        idle_since = time.monotonic()
+        try:
+            while True:
+                with self.condition:
+                    self._cut_frame_if_due()
+                    if self.frames and self.frames[0][0] > cursor + 1 and cursor < self.next_id - 1:
+                        # The ring buffer has already dropped frames this client missed
+                        yield format_event(cursor, 'reset', {"error": "Resume window exceeded"})
+                        return
+                    batch = [frame for frame_id, frame in self.frames if frame_id > cursor]
+                    if batch:
+                        cursor = self.next_id - 1
+                    done = self.done
+                    if not batch and not done:
+                        self.condition.wait(self.flush_interval)
+
+                if batch:
+                    # Everything the client is behind on goes out in a single write
+                    yield b''.join(batch)
+                    idle_since = time.monotonic()
+                elif done:
+                    return
+                elif time.monotonic() - idle_since >= HEARTBEAT_INTERVAL:
+                    yield b': ping\n\n'
+                    idle_since = time.monotonic()
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+                if self.subscribers == 0:
+                    self.orphaned_at = time.time()
+
+    # Control
+
+    def abort(self, reason: str) -> bool:
+        """Close the upstream socket so Ollama stops generating"""
+        with self.condition:
+            if self.done or self.abort_reason is not None:
+                return False
+            self.abort_reason = reason
+            connection = self.connection
+        if connection is not None and connection.sock is not None:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        return True
+
+    @property
+    def tokens_used(self) -> int:
+        """Prompt plus generated tokens as Ollama reported them, else the tokens streamed"""
+        if self.stats is None:
+            return self.tokens
+        return self.stats.get('prompt_eval_count', 0) + self.stats.get('eval_count', 0)
+
+    def is_orphaned(self) -> bool:
+        with self.condition:
+            return self.orphaned_at is not None and time.time() - self.orphaned_at > ORPHAN_GRACE
+
+
+class StreamManager:
+    """Runs generations in the background and serves them as resumable SSE streams"""
+
+    def __init__(self, ollama_api: str, flush_interval: float = FLUSH_INTERVAL, flush_bytes: int = FLUSH_BYTES,
+                 on_done: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None,
+                 idle_timeout: Optional[float] = None,
+                 on_synthesized: Optional[Callable[[float], None]] = None,
+                 cancel_requested: Optional[Callable[[str], bool]] = None):
+        self.ollama_api = urlparse(ollama_api)
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.on_done = on_done  # called with (model, final statistics) after each generation
+        # Seconds allowed to connect, to wait for the first token, and between tokens after that
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.on_synthesized = on_synthesized  # called with the seconds each spoken sentence took
+        # Called with a stream id while it runs; True aborts it. Set when other workers can take the cancel
+        self.cancel_requested = cancel_requested
+        self.streams: Dict[str, TokenStream] = {}
+        self.lock = threading.Lock()
+        self.stats = {
+            "streams_started": 0,
+            "streams_aborted": 0,
+            "tokens": 0,
+            "frames": 0,
+        }
+
+    def start(self, request: Dict[str, Any], flush_interval: Optional[float] = None,
+              flush_bytes: Optional[int] = None,
+              on_finish: Optional[Callable[[TokenStream], None]] = None,
+              speak: Optional[Callable[[str], Optional[str]]] = None) -> TokenStream:
+        """Start generating `request` (a /api/chat or /api/generate body) in the background
+
+        `on_finish` is called with the stream once the generation ends,
+        however it ends. With `speak` (sentence -> base64 WAV), each sentence
+        of the answer is also synthesized as soon as it is complete and sent
+        as an 'audio' event; 'done' waits for the last one.
+        """
+        if not request.get('model'):
+            raise ValueError("Missing model name")
+
+        self._sweep()
+        stream = TokenStream(
+            uuid.uuid4().hex,
+            self.flush_interval if flush_interval is None else max(flush_interval, MIN_FLUSH_INTERVAL),
+            self.flush_bytes if flush_bytes is None else flush_bytes
+        )
+        endpoint = '/chat' if 'messages' in request else '/generate'
+        stream.add_event('start', {"stream_id": stream.stream_id, "model": request['model']})
+        if speak is not None:
+            stream.speaker = SentenceSpeaker(stream, speak, self.on_synthesized)
+
+        with self.lock:
+            self.streams[stream.stream_id] = stream
+            self.stats["streams_started"] += 1
+
+        thread = threading.Thread(target=self._run, args=(stream, endpoint, request, on_finish), daemon=True)
+        thread.start()
+        if self.cancel_requested is not None:
+            threading.Thread(target=self._watch_cancel, args=(stream,), daemon=True).start()
+        return stream
+
+    def _watch_cancel(self, stream: TokenStream):
+        """Abort `stream` once a cancel for it turns up; /api/cancel may have reached a different worker"""
+        while not stream.done:
+            time.sleep(CANCEL_POLL_INTERVAL)
+            if not stream.done and self.cancel_requested(stream.stream_id):
+                stream.abort('cancelled')
+                return
+
+    def get(self, stream_id: str) -> Optional[TokenStream]:
+        with self.lock:
+            return self.streams.get(stream_id)
+
+    def cancel(self, stream_id: str) -> bool:
+        stream = self.get(stream_id)
+        return stream is not None and stream.abort('cancelled')
+
+    def _run(self, stream: TokenStream, endpoint: str, request: Dict[str, Any],
+             on_finish: Optional[Callable[[TokenStream], None]] = None):
+        """Read Ollama's NDJSON stream and feed it into `stream` as frames"""
+        body = json.dumps(dict(request, stream=True)).encode('utf-8')
+        connection = http.client.HTTPConnection(
+            self.ollama_api.hostname, self.ollama_api.port, timeout=self.connect_timeout
+        )
+        splitter = ThinkSplitter()
+        try:
+            connection.connect()
+            connection.sock.settimeout(self.read_timeout)
+            stream.connection = connection
+            if stream.abort_reason is not None:
+                raise ConnectionAbortedError(stream.abort_reason)
+
+            connection.request('POST', f"{self.ollama_api.path}{endpoint}", body=body,
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            if connection.sock is not None:
+                connection.sock.settimeout(self.idle_timeout)
+            if response.status != 200:
+                answer = response.read()
+                try:
+                    # Ollama's errors are JSON like {"error": "..."}, but a proxy in between may send text
+                    error = json.loads(answer).get('error')
+                except (ValueError, AttributeError):
+                    error = None
+                error = error or answer.decode('utf-8', 'replace').strip() or f"HTTP {response.status}"
+                stream.finish('error', {"error": str(error), "status": response.status})
+                return
+
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                if stream.is_orphaned():
+                    stream.abort('client_disconnect')
+                    break
+                if not line.strip():
+                    continue
+
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    stream.finish('error', {"error": chunk['error']})
+                    return
+
+                message = chunk.get('message') or {}
+                thinking = chunk.get('thinking') or message.get('thinking')
+                if thinking:
+                    stream.add_text('think', thinking)
+                content = chunk.get('response') or message.get('content') or ''
+                stream.text.append(content)
+                for kind, text in splitter.feed(content):
+                    self._add_text(stream, kind, text)
+                stream.tokens += 1
+
+                if chunk.get('done'):
+                    for kind, text in splitter.flush():
+                        self._add_text(stream, kind, text)
+                    if stream.speaker is not None:
+                        stream.speaker.close()
+                    stats = {
+                        key: value for key, value in chunk.items()
+                        if key not in ('response', 'message', 'context', 'thinking')
+                    }
+                    stream.stats = stats
+                    stream.finish('done', stats)
+                    if self.on_done is not None:
+                        self.on_done(request['model'], stats)
+                    return
+
+            if stream.abort_reason is None:
+                stream.finish('error', {"error": "Ollama closed the stream early"})
+
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            if stream.abort_reason is None:
+                logger.error(f"Stream {stream.stream_id} failed: {e}")
+                stream.finish('error', {"error": f"Error connecting to Ollama API: {e}"})
+
+        finally:
+            connection.close()
+            if stream.speaker is not None:
+                stream.speaker.cancel()
+            if stream.abort_reason is not None:
+                stream.finish('error', {"error": "Stream aborted", "reason": stream.abort_reason})
+                with self.lock:
+                    self.stats["streams_aborted"] += 1
+            with self.lock:
+                self.stats["tokens"] += stream.tokens
+                self.stats["frames"] += stream.next_id - 1
+            if on_finish is not None:
+                on_finish(stream)
+
+    @staticmethod
+    def _add_text(stream: TokenStream, kind: str, text: str):
+        stream.add_text(kind, text)
+        if kind == 'answer' and stream.speaker is not None:
+            stream.speaker.feed(text)
+
+    def _sweep(self):
+        """Forget finished streams once their resume window has passed"""
+        now = time.time()
+        with self.lock:
+            expired = [
+                stream_id for stream_id, stream in self.streams.items()
+                if stream.done and now - stream.finished_at > RETENTION
+            ]
+            for stream_id in expired:
+                del self.streams[stream_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["active_streams"] = sum(1 for stream in self.streams.values() if not stream.done)
+        return stats
@@ -0,0 +1,56 @@
+import os
+import sys
+import json
+import base64
+import hashlib
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_store import strip_images, reference_spans
+
+
+class StripImagesTest(unittest.TestCase):
+
+    def test_inline_images_become_references(self):
+        image = base64.b64encode(b'image bytes').decode('ascii')
+        reference = 'sha256:' + 'a' * 64
+        body = json.dumps({
+            "model": "m",
+            "prompt": image,
+            "images": [image, reference],
+            "messages": [{"role": "user", "content": image, "images": [image]}],
+        }).encode('utf-8')
+
+        stripped = json.loads(strip_images(body))
+        expected = 'sha256:' + hashlib.sha256(b'image bytes').hexdigest()
+        self.assertEqual(stripped["images"], [expected, reference])
+        self.assertEqual(stripped["messages"][0]["images"], [expected])
+        self.assertEqual(stripped["prompt"], image)
+        self.assertEqual(stripped["messages"][0]["content"], image)
+
+    def test_malformed_bodies_are_returned_unchanged(self):
+        for body in (
+            b'{"model":"x","images":["a"]]]',
+            b'"images":["a"]',
+            b':{"images":["a"]}',
+            b'{"images":["\\x"]}',
+            b'{"images"',
+        ):
+            with self.subTest(body=body):
+                self.assertEqual(strip_images(body), body)
+
+
+class ReferenceSpansTest(unittest.TestCase):
+
+    def test_only_images_arrays_count(self):
+        reference = 'sha256:' + 'b' * 64
+        body = json.dumps({"prompt": f'"{reference}"', "images": [reference]}).encode('utf-8')
+        spans = reference_spans(body)
+        self.assertEqual([digest for _, _, digest in spans], ['b' * 64])
+        start, end, _ = spans[0]
+        self.assertEqual(body[start:end], f'"{reference}"'.encode('ascii'))
+
+
+if __name__ == '__main__':
+    unittest.main()
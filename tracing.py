@@ -0,0 +1,247 @@
+"""
+Request Tracing for Ollama8Web
+Sampled per-request phase timings kept in a ring buffer, and on-demand cProfile/tracemalloc captures
+"""
+
+import os
+import time
+import pstats
+import random
+import cProfile
+import tempfile
+import threading
+import tracemalloc
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple
+
+TRACE_RING_SIZE = 200  # most recent sampled requests kept for /debug/traces
+MAX_PROFILED_REQUESTS = 1000
+PROFILE_MODES = ('cpu', 'memory')
+
+
+class Trace:
+    """Phase timings for one request
+
+    Phases are sequential: mark() ends the current phase and starts the next.
+    Time spent on something spread across a phase (e.g. writes to the client
+    while relaying) is summed separately with add().
+    """
+
+    enabled = True
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.phases: List[Tuple[str, float, float]] = []  # (name, start, duration)
+        self.current: Optional[Tuple[str, float]] = None
+        self.totals: Dict[str, float] = {}
+        self.attributes: Dict[str, Any] = {}
+        self.status = None
+        self.duration = None
+
+    def mark(self, name: str):
+        now = time.perf_counter() - self.origin
+        self._close(now)
+        self.current = (name, now)
+
+    def add(self, name: str, seconds: float):
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+
+    def annotate(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, status: Optional[int]):
+        now = time.perf_counter() - self.origin
+        self._close(now)
+        self.status = status
+        self.duration = now
+
+    def _close(self, now: float):
+        if self.current is not None:
+            name, start = self.current
+            self.phases.append((name, start, now - start))
+            self.current = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": round(self.started_at, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            "phases": [
+                {"name": name, "start_ms": round(start * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+                for name, start, duration in self.phases
+            ],
+            "totals_ms": {name: round(seconds * 1000, 3) for name, seconds in self.totals.items()},
+            "attributes": self.attributes,
+        }
+
+
+class NullTrace:
+    """Stands in for a Trace on unsampled requests so call sites need no checks"""
+
+    enabled = False
+
+    def mark(self, name: str):
+        pass
+
+    def add(self, name: str, seconds: float):
+        pass
+
+    def annotate(self, **attributes):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class Tracer:
+    """Decides which requests are traced and keeps the finished traces"""
+
+    def __init__(self, sample_rate: float = 0.0, ring_size: int = TRACE_RING_SIZE):
+        self.sample_rate = sample_rate
+        self.traces = deque(maxlen=ring_size)
+        self.lock = threading.Lock()
+
+    def set_sample_rate(self, sample_rate: float):
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.sample_rate = sample_rate
+
+    def start(self, method: str, path: str):
+        # With sampling off this is a single comparison per request
+        if self.sample_rate <= 0.0 or random.random() >= self.sample_rate:
+            return NULL_TRACE
+        return Trace(method, path)
+
+    def finish(self, trace, status: Optional[int]):
+        if not trace.enabled:
+            return
+        trace.finish(status)
+        with self.lock:
+            self.traces.append(trace)
+
+    def recent(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Finished traces, newest first"""
+        with self.lock:
+            traces = list(self.traces)
+        traces.reverse()
+        return [trace.to_dict() for trace in traces[:limit]]
+
+
+class Profiler:
+    """Captures a CPU (cProfile) or memory (tracemalloc) profile over the next N requests
+
+    CPU profiles are per request thread and merged into one pstats file.
+    Python 3.12+ allows only one active cProfile at a time, so overlapping
+    requests wait for a later slot instead of being profiled. A memory capture
+    runs tracemalloc process-wide and snapshots it after the last request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mode = None
+        self.remaining = 0
+        self.in_progress = 0
+        self.captured = 0
+        self.stats = None
+        self.result: Optional[bytes] = None
+
+    def arm(self, mode: str, requests: int):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode must be one of: {', '.join(PROFILE_MODES)}")
+        if not 1 <= requests <= MAX_PROFILED_REQUESTS:
+            raise ValueError(f"requests must be between 1 and {MAX_PROFILED_REQUESTS}")
+
+        with self.lock:
+            if self.remaining or self.in_progress:
+                raise RuntimeError("A capture is already running")
+            self.mode = mode
+            self.remaining = requests
+            self.captured = 0
+            self.stats = None
+            self.result = None
+            if mode == 'memory':
+                tracemalloc.start()
+
+    def begin(self):
+        """Start profiling the current request if a capture wants it; returns a token for end()"""
+        if not self.remaining:
+            return None
+        with self.lock:
+            if not self.remaining:
+                return None
+            self.remaining -= 1
+            self.in_progress += 1
+            mode = self.mode
+
+        if mode == 'memory':
+            return mode
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another request holds the profiler; give the slot back
+            with self.lock:
+                self.remaining += 1
+                self.in_progress -= 1
+            return None
+        return profile
+
+    def end(self, token):
+        if token is None:
+            return
+        if isinstance(token, cProfile.Profile):
+            token.disable()
+
+        with self.lock:
+            if isinstance(token, cProfile.Profile):
+                if self.stats is None:
+                    self.stats = pstats.Stats(token)
+                else:
+                    self.stats.add(token)
+            self.in_progress -= 1
+            self.captured += 1
+            if self.remaining == 0 and self.in_progress == 0:
+                self._complete()
+
+    def _complete(self):
+        fd, path = tempfile.mkstemp(prefix='ollama8web-profile-')
+        os.close(fd)
+        try:
+            if self.mode == 'cpu':
+                self.stats.dump_stats(path)
+            else:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                snapshot.dump(path)
+            with open(path, 'rb') as f:
+                self.result = f.read()
+        finally:
+            os.unlink(path)
+        self.stats = None
+
+    def filename(self) -> Optional[str]:
+        if self.mode is None:
+            return None
+        return 'ollama8web.pstats' if self.mode == 'cpu' else 'ollama8web.tracemalloc'
+
+    def get_status(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "mode": self.mode,
+                "remaining": self.remaining,
+                "in_progress": self.in_progress,
+                "captured": self.captured,
+                "ready": self.result is not None,
+            }
+
+    def download(self) -> Optional[Tuple[str, bytes]]:
+        with self.lock:
+            if self.result is None:
+                return None
+            return self.filename(), self.result
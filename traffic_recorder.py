@@ -0,0 +1,163 @@
+"""
+Traffic Recorder for Ollama8Web
+Appends anonymized request/response pairs and their upstream timings to an NDJSON file for later replay
+"""
+
+import os
+import json
+import time
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from typing import Optional, Dict, Any, List
+
+# Fields whose strings are kept verbatim; they steer routing and model choice but carry no user content
+KEPT_FIELDS = ('model', 'role', 'format', 'keep_alive', 'voice_id', 'stream', 'done_reason')
+# Query parameters kept in recorded paths; they tune flushing and paging, the rest are dropped
+KEPT_QUERY_KEYS = ('flush_ms', 'flush_bytes', 'last_event_id', 'limit', 'before', 'since')
+
+
+def anonymize(value, key: Optional[str] = None):
+    """Replace every string in a JSON value with its length, keeping structure, numbers and model names"""
+    if isinstance(value, dict):
+        return {name: anonymize(item, name) for name, item in value.items()}
+    if isinstance(value, list):
+        return [anonymize(item, key) for item in value]
+    if isinstance(value, str) and key not in KEPT_FIELDS:
+        return {"$redacted": len(value)}
+    return value
+
+
+def anonymize_path(path: str) -> str:
+    """The recorded form of a request path: the query string keeps only KEPT_QUERY_KEYS"""
+    url = urlsplit(path)
+    query = [(name, value) for name, value in parse_qsl(url.query, keep_blank_values=True) if name in KEPT_QUERY_KEYS]
+    return url.path + (f'?{urlencode(query)}' if query else '')
+
+
+def anonymize_body(body, content_type: str):
+    """The recorded form of a request body: anonymized JSON, or just its size"""
+    if body is None:
+        return None
+    if isinstance(body, int):
+        return {"$bytes": body}
+    if 'json' in content_type or body[:1] in (b'{', b'['):
+        try:
+            return anonymize(json.loads(body))
+        except ValueError:
+            pass
+    return {"$bytes": len(body)}
+
+
+class Capture:
+    """What one request did, built up while it is handled"""
+
+    enabled = True
+
+    def __init__(self, method: str, path: str, content_type: str):
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.record: Dict[str, Any] = {
+            "t": round(self.started_at, 3),
+            "method": method,
+            "path": anonymize_path(path),
+            "content_type": content_type,
+            "body": None,
+        }
+        self.upstream: Optional[Dict[str, Any]] = None
+        self.upstream_sent = None
+        self.chunks: List[List[int]] = []
+
+    def request_body(self, body):
+        """Record a body as bytes, or just its length for bodies that were streamed through"""
+        self.record["body"] = anonymize_body(body, self.record["content_type"])
+
+    def upstream_request_sent(self):
+        self.upstream_sent = time.perf_counter()
+
+    def upstream_response(self, status: int, content_type: str):
+        if self.upstream_sent is None:
+            return
+        self.upstream = {
+            "status": status,
+            "content_type": content_type,
+            "ttfb_ms": round((time.perf_counter() - self.upstream_sent) * 1000, 1),
+        }
+
+    def upstream_chunk(self, size: int):
+        # [milliseconds since the request went upstream, bytes]
+        if self.upstream_sent is not None:
+            self.chunks.append([round((time.perf_counter() - self.upstream_sent) * 1000, 1), size])
+
+    def finish(self, status: Optional[int]) -> Dict[str, Any]:
+        self.record["status"] = status
+        self.record["duration_ms"] = round((time.perf_counter() - self.origin) * 1000, 1)
+        if self.upstream is not None:
+            self.upstream["chunks"] = self.chunks
+            self.record["upstream"] = self.upstream
+        return self.record
+
+
+class NullCapture:
+    """Stands in for a Capture while recording is off"""
+
+    enabled = False
+
+    def request_body(self, body):
+        pass
+
+    def upstream_request_sent(self):
+        pass
+
+    def upstream_response(self, status: int, content_type: str):
+        pass
+
+    def upstream_chunk(self, size: int):
+        pass
+
+
+NULL_CAPTURE = NullCapture()
+
+
+class TrafficRecorder:
+    """Writes finished captures to an append-only NDJSON file
+
+    Each record is a single O_APPEND write, so threads and pre-forked
+    workers can share one file without interleaving lines.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.fd = None
+        self.path = None
+        if path:
+            self.open(path)
+
+    def open(self, path: str):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+
+    @property
+    def enabled(self) -> bool:
+        return self.fd is not None
+
+    def start(self, method: str, path: str, content_type: str = ''):
+        if self.fd is None:
+            return NULL_CAPTURE
+        return Capture(method, path, content_type)
+
+    def finish(self, capture, status: Optional[int]):
+        if not capture.enabled:
+            return
+        line = json.dumps(capture.finish(status), separators=(',', ':')).encode('utf-8') + b'\n'
+        os.write(self.fd, line)
+
+
+def load_records(path: str) -> List[Dict[str, Any]]:
+    """Read a recording, oldest request first, skipping a torn final line"""
+    records = []
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    records.sort(key=lambda record: record["t"])
+    return records
@@ -0,0 +1,163 @@
+"""
+Upstream Health for Ollama8Web
+Background health checks against Ollama and a circuit breaker that fails requests fast while it is down
+"""
+
+import json
+import time
+import logging
+import threading
+import http.client
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = 3  # consecutive failures that open the circuit
+RESET_TIMEOUT = 5.0  # seconds the circuit stays open before a trial request is let through
+CHECK_INTERVAL = 10.0  # seconds between health checks while Ollama is up
+CHECK_TIMEOUT = 2.0
+LATENCY_SMOOTHING = 0.2  # weight of the newest check in the moving average
+
+
+class CircuitBreaker:
+    """Stops sending requests to Ollama after repeated failures
+
+    closed: requests flow, consecutive failures are counted.
+    open: requests are refused until `reset_timeout` has passed.
+    half_open: one trial request (or health check) decides whether to close
+    the circuit again or reopen it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a request may go to Ollama now"""
+        if self.state == self.CLOSED:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_started = now
+                return True
+            if self.state == self.HALF_OPEN and now - self.trial_started >= self.reset_timeout:
+                # The trial never reported back (e.g. its client went away); try another
+                self.trial_started = now
+                return True
+            return self.state == self.CLOSED
+
+    def record_success(self):
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.warning("Ollama is reachable again, closing the circuit")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.CLOSED and self.failures < self.failure_threshold:
+                return
+            if self.state == self.CLOSED:
+                logger.warning(f"Ollama failed {self.failures} times in a row, opening the circuit")
+            # A failed trial (or check) while open starts the wait over
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def retry_after(self) -> float:
+        """Seconds until the next trial request is allowed"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+
+class HealthMonitor:
+    """Polls Ollama's /api/version in the background and feeds the circuit breaker
+
+    While the circuit is open the monitor checks every `reset_timeout`
+    seconds, so recovery is noticed even when no requests are arriving.
+    """
+
+    def __init__(self, ollama_api: str, breaker: CircuitBreaker,
+                 interval: float = CHECK_INTERVAL, timeout: float = CHECK_TIMEOUT):
+        self.ollama_api = urlparse(ollama_api)
+        self.breaker = breaker
+        self.interval = interval
+        self.timeout = timeout
+        self.status = 'unknown'
+        self.version = None
+        self.latency = None
+        self.average_latency = None
+        self.last_checked = None
+        self.last_error = None
+        self.thread = None
+
+    def check(self) -> bool:
+        """Run one health check now; returns whether Ollama answered"""
+        connection = http.client.HTTPConnection(self.ollama_api.hostname, self.ollama_api.port, timeout=self.timeout)
+        started = time.perf_counter()
+        try:
+            connection.request('GET', f"{self.ollama_api.path}/version")
+            response = connection.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise http.client.HTTPException(f"HTTP {response.status}")
+            version = json.loads(body).get('version')
+        except (OSError, ValueError, AttributeError, http.client.HTTPException) as e:
+            self.status = 'down'
+            self.last_error = str(e) or type(e).__name__
+            self.breaker.record_failure()
+            return False
+        finally:
+            connection.close()
+            self.last_checked = time.time()
+
+        self.latency = time.perf_counter() - started
+        self.average_latency = self.latency if self.average_latency is None else (
+            LATENCY_SMOOTHING * self.latency + (1 - LATENCY_SMOOTHING) * self.average_latency
+        )
+        self.status = 'up'
+        self.last_error = None
+        self.version = version
+        self.breaker.record_success()
+        return True
+
+    def start(self):
+        """Start checking in a daemon thread; call after forking, since threads do not survive fork()"""
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            self.check()
+            time.sleep(self.interval if self.breaker.state == CircuitBreaker.CLOSED else self.breaker.reset_timeout)
+
+    def get_status(self) -> Dict[str, Any]:
+        def milliseconds(seconds: Optional[float]) -> Optional[float]:
+            return None if seconds is None else round(seconds * 1000, 1)
+
+        return {
+            "status": self.status,
+            "version": self.version,
+            "latency_ms": milliseconds(self.latency),
+            "average_latency_ms": milliseconds(self.average_latency),
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "retry_after": round(self.breaker.retry_after(), 1),
+        }
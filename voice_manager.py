@@ -8,6 +8,7 @@ import io
 import base64
 import logging
 import tempfile
+import threading
 from pathlib import Path
 from typing import Optional, Dict, Any
 import pyttsx3
@@ -31,6 +32,7 @@ class VoiceManager:
         self.voices_dir = Path(voices_dir)
         self.voices_dir.mkdir(exist_ok=True)
         self.auto_play = False  # Setting to control auto-play behavior
+        self.synthesis_lock = threading.Lock()  # the pyttsx3 engine runs one job at a time
         
         try:
             # Initialize pyttsx3 engine
@@ -85,9 +87,10 @@ class VoiceManager:
             temp_path = temp_file.name
             temp_file.close()  # Close the file handle immediately
             
-            # Generate speech
-            self.tts_engine.save_to_file(text, temp_path)
-            self.tts_engine.runAndWait()
+            # Generate speech; spoken replies synthesize from several threads at once
+            with self.synthesis_lock:
+                self.tts_engine.save_to_file(text, temp_path)
+                self.tts_engine.runAndWait()
             
             # Small delay to ensure file is written
             time.sleep(0.1)